@@ -0,0 +1,190 @@
+import argparse
+import subprocess
+import threading
+import tempfile
+import resource
+import tracemalloc
+import psutil
+import json
+import time
+import sys
+import os
+
+from benchmarks.stages import STAGES, build_context, prepare_stage
+
+
+######################################################################################################################
+# DESCRIPTION: runs every pipeline stage in a fresh subprocess and records its peak RSS and tracemalloc peak
+# against the raw (uncompressed) size of the input rasters. Each stage has a declared ceiling on the growth of its
+# peak RSS per input byte, and the harness fails when a stage goes over it. A fixed allowance for what a stage
+# allocates whatever its input (lazy imports, library caches, plotly figures) comes off the RSS growth before the
+# ceiling is applied, so small scales do not fail on overhead alone. The tracemalloc peak (Python allocations
+# only, not those of GDAL or netCDF) is reported next to it
+#
+# USAGE:
+# python -m benchmarks.benchMemory --scales 1 10 --output memory.json
+# python -m benchmarks.benchMemory --stages cube_to_dataframe --ceiling cube_to_dataframe=30
+# python -m benchmarks.benchMemory --allowance 32
+#
+# OUTPUT:
+# a JSON document with one record per stage and scale. The exit code is 1 when any stage exceeds its ceiling
+######################################################################################################################
+
+# peak RSS growth in bytes per raw input byte each stage may use
+CEILINGS = {
+    "read_data": 2,
+    "raster_align": 2,
+    "raster_trim": 2,
+    "make_cube_filestotime_bandstotime": 8,
+    "make_cube_filestotime_bandstovar": 10,
+    "make_cube_filestovar_bandstotime": 8,
+    "make_cube_filestovar_bandstovar": 10,
+    "load_cube": 2,
+    "select_time": 8,
+    "scale_time": 10,
+    "cube_smasher": 10,
+    "cube_to_dataframe": 40,
+    "write_csv": 60,
+    "plot_cube": 60,
+}
+
+# RSS growth in MB any stage may use before its ceiling applies
+ALLOWANCE = 64
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# runs in the child process: sets up the stages the named one needs, then profiles only the named one
+def profile_stage(name, scale, workDir, interval=0.005):
+
+    ctx = prepare_stage(build_context(scale, workDir), name)
+    stage = dict(STAGES)[name]
+
+    process = psutil.Process()
+    baseRSS = process.memory_info().rss
+    peak = [baseRSS]
+    done = threading.Event()
+
+    # sample RSS while the stage runs, ru_maxrss would also count the setup
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], process.memory_info().rss)
+            time.sleep(interval)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+
+    tracemalloc.start()
+    sampler.start()
+    start = time.perf_counter()
+
+    stage(ctx)
+
+    seconds = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    peak[0] = max(peak[0], process.memory_info().rss)
+
+    out = dict(stage=name, scale=scale, seconds=seconds, raw_bytes=ctx["raw_bytes"], input_bytes=ctx["input_bytes"],
+               rss_base=baseRSS, rss_peak=peak[0], rss_delta=peak[0] - baseRSS, tracemalloc_peak=traced,
+               maxrss_process=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+    out["alloc_per_input_byte"] = traced / max(ctx["raw_bytes"], 1)
+    out["rss_per_input_byte"] = out["rss_delta"] / max(ctx["raw_bytes"], 1)
+
+    return out
+
+
+# runs one stage in a fresh interpreter so earlier stages cannot leave memory behind
+def run_stage(name, scale, workDir):
+
+    command = [sys.executable, "-m", "benchmarks.benchMemory", "--child", name, "--scales", str(scale), "--work-dir", workDir]
+    proc = subprocess.run(command, cwd=REPO, capture_output=True, text=True)
+
+    if proc.returncode != 0:
+        return dict(stage=name, scale=scale, error=proc.stderr.strip().splitlines()[-1:] or ["killed"])
+
+    # the stages may print, the record is the last line
+    out = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    return out
+
+
+def run_memory(scales=(1, 10), stages=None, ceilings=None, workDir=None, allowance=ALLOWANCE):
+
+    if workDir == None:
+        workDir = tempfile.mkdtemp(prefix="spacetime_memory_")
+
+    limits = dict(CEILINGS)
+    if ceilings != None:
+        limits.update(ceilings)
+
+    results = []
+    for scale in scales:
+        for name, stage in STAGES:
+
+            if stages != None and name not in stages:
+                continue
+
+            out = run_stage(name, scale, workDir)
+            out["ceiling"] = limits.get(name)
+            out["rss_allowance"] = int(allowance * 1024 ** 2)
+
+            if "error" in out:
+                out["passed"] = False
+            elif out["ceiling"] == None:
+                out["passed"] = True
+            else:
+                out["rss_over_allowance"] = max(out["rss_delta"] - out["rss_allowance"], 0) / max(out["raw_bytes"], 1)
+                out["passed"] = out["rss_over_allowance"] <= out["ceiling"]
+
+            results.append(out)
+
+    return results
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.benchMemory", description="Profile peak memory of the spacetime stages.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--stages", nargs="+", default=None, help="only run these stages")
+    parser.add_argument("--ceiling", nargs="+", default=[], help="override ceilings as stage=ratio")
+    parser.add_argument("--allowance", type=float, default=ALLOWANCE, help="MB of RSS growth allowed before the ceilings apply")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--work-dir", default=None)
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child != None:
+        print(json.dumps(profile_stage(args.child, args.scales[0], args.work_dir)))
+        return
+
+    ceilings = {}
+    for x in args.ceiling:
+        name, value = x.split("=")
+        ceilings[name] = float(value)
+
+    results = run_memory(scales=args.scales, stages=args.stages, ceilings=ceilings, workDir=args.work_dir,
+                         allowance=args.allowance)
+
+    for x in results:
+        if "error" in x:
+            print(f"{x['stage']:<40} x{x['scale']:<5} FAILED {x['error'][0]}")
+        else:
+            status = "ok" if x["passed"] else "OVER CEILING"
+            print(f"{x['stage']:<40} x{x['scale']:<5} {x['tracemalloc_peak'] / 1024 ** 2:10.1f} MB traced "
+                  f"{x['rss_delta'] / 1024 ** 2:10.1f} MB rss  {x['alloc_per_input_byte']:8.2f} B/B traced "
+                  f"{x['rss_per_input_byte']:8.2f} B/B rss  {status}")
+
+    if args.output != None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if not all(x["passed"] for x in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import platform
+import tempfile
+import json
+import time
+import sys
+import os
+
+from benchmarks.stages import STAGES, build_context, prepare_stage
+
+
+######################################################################################################################
+# DESCRIPTION: times every public pipeline stage on demoData and on scaled synthetic inputs, writes the results
+# as JSON and compares them to a stored baseline so regressions show up before an upgrade
+#
+# USAGE:
+# python -m benchmarks.benchPipeline --scales 1 10 100 --output bench.json
+# python -m benchmarks.benchPipeline --save-baseline          (writes benchmarks/baseline.json)
+# python -m benchmarks.benchPipeline --compare benchmarks/baseline.json --tolerance 0.25
+#
+# OUTPUT:
+# a JSON document with one record per stage and scale (seconds is the best of the repeats). The exit code is 1
+# when a stage is slower than the baseline by more than the tolerance
+######################################################################################################################
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def run_benchmarks(scales=(1, 10, 100), repeats=3, stages=None, workDir=None):
+
+    if workDir == None:
+        workDir = tempfile.mkdtemp(prefix="spacetime_bench_")
+
+    results = []
+
+    for scale in scales:
+
+        ctx = build_context(scale, workDir)
+
+        for name, stage in STAGES:
+
+            if stages != None and name not in stages:
+                continue
+
+            prepare_stage(ctx, name)
+
+            times = []
+            for r in range(repeats):
+                start = time.perf_counter()
+                out = stage(ctx)
+                times.append(time.perf_counter() - start)
+
+            # later stages read the output instead of running this one again
+            ctx[name] = out
+
+            results.append(dict(stage=name, scale=scale, seconds=min(times), mean=sum(times) / len(times),
+                                repeats=repeats, input_bytes=ctx["input_bytes"]))
+
+    out = dict(created=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(),
+               machine=platform.machine(), processor=platform.processor(), results=results)
+
+    return out
+
+
+# list of stages that got slower than the baseline by more than the tolerance
+def compare(current, baseline, tolerance=0.25):
+
+    base = {(x["stage"], x["scale"]): x["seconds"] for x in baseline["results"]}
+
+    out = []
+    for x in current["results"]:
+
+        key = (x["stage"], x["scale"])
+        if key not in base or base[key] <= 0:
+            continue
+
+        ratio = x["seconds"] / base[key]
+        if ratio > 1 + tolerance:
+            out.append(dict(stage=x["stage"], scale=x["scale"], seconds=x["seconds"], baseline=base[key], ratio=ratio))
+
+    return out
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.benchPipeline", description="Time the spacetime pipeline stages.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", default=None, help="only run these stages")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="baseline JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a stage fails")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as benchmarks/baseline.json")
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(scales=args.scales, repeats=args.repeats, stages=args.stages)
+
+    for x in current["results"]:
+        print(f"{x['stage']:<40} x{x['scale']:<5} {x['seconds']:10.4f} s")
+
+    if args.output != None:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.save_baseline:
+        with open(BASELINE, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.compare != None:
+
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        slower = compare(current, baseline, tolerance=args.tolerance)
+        for x in slower:
+            print(f"REGRESSION {x['stage']} x{x['scale']}: {x['seconds']:.4f} s vs {x['baseline']:.4f} s ({x['ratio']:.2f}x)")
+
+        if len(slower) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+from osgeo import gdal
+import math
+import os
+
+from spacetime.input.readData import read_data
+from spacetime.input.makeSynthetic import synthetic_rasters
+from spacetime.scale.rasterAlign import raster_align
+from spacetime.scale.rasterTrim import raster_trim
+from spacetime.operations.makeCube import make_cube
+from spacetime.operations.loadCube import load_cube
+from spacetime.operations.time import cube_time, select_time, scale_time
+from spacetime.operations.cubeSmasher import cube_smasher
+from spacetime.operations.cubeToDataframe import cube_to_dataframe
+from spacetime.output.writeCSV import write_csv
+from spacetime.graphics.dataPlot import plot_cube
+
+
+######################################################################################################################
+# DESCRIPTION: stage definitions shared by the benchmark and memory harnesses. Each stage takes a context dict
+# holding the outputs of the stages it needs (NEEDS) and returns its own output, so a stage can be timed or profiled
+# alone after prepare_stage has run only what it depends on
+#
+# INPUTS:
+# scale: pixel count multiplier of the synthetic inputs made with synthetic_rasters (1 uses demoData as is)
+# workDir: directory for scaled inputs and written cubes
+#
+# OUTPUT:
+# STAGES, a list of (name, function) pairs in pipeline order
+######################################################################################################################
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "demoData")
+
+DEMO_FILES = ["N0_AKestrel_1976_1980.tif", "N0_AKestrel_1977_1981.tif", "N0_AKestrel_1978_1982.tif"]
+
+# the four file and band layouts of make_cube
+CUBE_MODES = [("filestotime", "bandstotime"), ("filestotime", "bandstovar"),
+              ("filestovar", "bandstotime"), ("filestovar", "bandstovar")]
+
+
+#################################################
+# helper function to get the inputs of a run. Scaled runs use synthetic rasters with the demo layout and
+# scale times the demo pixel count
+def prepare_inputs(scale, workDir):
+
+    files = [os.path.join(DEMO_DIR, x) for x in DEMO_FILES]
+
+    if scale == 1:
+        return files
+
+    outDir = os.path.join(workDir, "x" + str(scale))
+    demo = gdal.Open(files[0])
+    factor = math.sqrt(scale)
+    dims = (int(round(demo.RasterXSize * factor)), int(round(demo.RasterYSize * factor)))
+    pixelSize = demo.GetGeoTransform()[1] / factor
+    ul = (demo.GetGeoTransform()[0], demo.GetGeoTransform()[3])
+
+    names = [os.path.join(outDir, "synthetic_" + str(i).zfill(4) + ".tif") for i in range(len(files))]
+
+    if not all(os.path.isfile(x) for x in names):
+        names = synthetic_rasters(outDir, files=len(files), dims=dims, bands=demo.RasterCount, ul=ul, pixelSize=pixelSize,
+                                  SRS=int(demo.GetSpatialRef().GetAuthorityCode(None)), nodataFraction=0.1, seed=scale)["files"]
+
+    return names
+
+
+# time vector for each make_cube layout
+def mode_time(trimmed, organizeFiles, organizeBands):
+
+    files = len(trimmed.get_GDAL_data())
+    bands = trimmed.get_band_number()[0]
+
+    if organizeFiles == "filestotime" and organizeBands == "bandstotime":
+        length = files * bands
+    if organizeFiles == "filestotime" and organizeBands == "bandstovar":
+        length = files
+    if organizeFiles == "filestovar" and organizeBands == "bandstotime":
+        length = bands
+    if organizeFiles == "filestovar" and organizeBands == "bandstovar":
+        length = 1
+
+    out = cube_time(start="1976", length=length, scale="year")
+
+    return out
+
+
+# uncompressed size of the pixels in a raster
+def raw_bytes(fileName):
+
+    ds = gdal.Open(fileName)
+    itemSize = gdal.GetDataTypeSize(ds.GetRasterBand(1).DataType) // 8
+    out = ds.RasterXSize * ds.RasterYSize * ds.RasterCount * itemSize
+
+    return out
+
+
+def new_file(ctx, name):
+
+    ctx["count"] = ctx.get("count", 0) + 1
+    out = os.path.join(ctx["workDir"], name + "_" + str(ctx["count"]))
+
+    return out
+#################################################
+
+
+
+#################################################
+# pipeline stages
+def stage_read_data(ctx):
+    return read_data(ctx["files"])
+
+def stage_raster_align(ctx):
+    return raster_align(ctx["read_data"])
+
+def stage_raster_trim(ctx):
+    return raster_trim(ctx["raster_align"])
+
+def make_cube_stage(organizeFiles, organizeBands):
+
+    def stage(ctx):
+        timeObj = mode_time(ctx["raster_trim"], organizeFiles, organizeBands)
+        return make_cube(data=ctx["raster_trim"], fileName=new_file(ctx, "cube") + ".nc4", organizeFiles=organizeFiles,
+                         organizeBands=organizeBands, timeObj=timeObj)
+
+    return stage
+
+def stage_load_cube(ctx):
+    ds = ctx["make_cube_filestotime_bandstotime"].get_GDAL_data()
+    if ds.isopen():
+        ctx["cube_path"] = ds.filepath()
+        ds.close() # the written file has to be closed before it is opened again
+    return load_cube(ctx["cube_path"])
+
+def stage_select_time(ctx):
+    return select_time(ctx["load_cube"], range="entire", scale="year", element=1977)
+
+def stage_scale_time(ctx):
+    return scale_time(ctx["load_cube"], "year", "mean")
+
+def stage_cube_smasher(ctx):
+    return cube_smasher(eq="a * 2", a=ctx["load_cube"], parentCube=ctx["load_cube"])
+
+def stage_cube_to_dataframe(ctx):
+    return cube_to_dataframe(ctx["load_cube"])
+
+def stage_write_csv(ctx):
+    return write_csv(ctx["load_cube"], file_name=new_file(ctx, "table") + ".csv")
+
+def stage_plot_cube(ctx):
+    return plot_cube(ctx["load_cube"], plot_type="timeseries", show_plot=False)
+#################################################
+
+
+STAGES = [("read_data", stage_read_data), ("raster_align", stage_raster_align), ("raster_trim", stage_raster_trim)]
+
+for organizeFiles, organizeBands in CUBE_MODES:
+    STAGES.append(("make_cube_" + organizeFiles + "_" + organizeBands, make_cube_stage(organizeFiles, organizeBands)))
+
+STAGES = STAGES + [("load_cube", stage_load_cube), ("select_time", stage_select_time), ("scale_time", stage_scale_time),
+                   ("cube_smasher", stage_cube_smasher), ("cube_to_dataframe", stage_cube_to_dataframe),
+                   ("write_csv", stage_write_csv), ("plot_cube", stage_plot_cube)]
+
+
+# stages each stage reads from the context
+NEEDS = dict([("raster_align", ["read_data"]), ("raster_trim", ["raster_align"])] +
+             [(name, ["raster_trim"]) for name, stage in STAGES if name.startswith("make_cube_")] +
+             [("load_cube", ["make_cube_filestotime_bandstotime"])] +
+             [(name, ["load_cube"]) for name in ["select_time", "scale_time", "cube_smasher", "cube_to_dataframe",
+                                                  "write_csv", "plot_cube"]])
+
+
+# the inputs of a run, the outputs of stages are added by prepare_stage
+def build_context(scale, workDir):
+
+    ctx = dict(scale=scale, workDir=workDir, files=prepare_inputs(scale, workDir))
+    ctx["input_bytes"] = sum(os.path.getsize(x) for x in ctx["files"])
+    ctx["raw_bytes"] = sum(raw_bytes(x) for x in ctx["files"])
+
+    return ctx
+
+
+# runs the stages the named one needs (and theirs) that are not in the context yet, so only those are paid for
+def prepare_stage(ctx, name):
+
+    for need in NEEDS.get(name, []):
+        if need not in ctx:
+            prepare_stage(ctx, need)
+            ctx[need] = dict(STAGES)[need](ctx)
+
+    return ctx
@@ -1,4 +1,620 @@
+import numpy as np
+import pandas as pd
+import argparse
+import hashlib
+import json
+import math
+import os
+import struct
+import threading
+import warnings
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from spacetime.operations.loadCube import load_cube
+from spacetime.operations.cubeOverviews import get_overview_levels, choose_level
+from spacetime.operations.extractPoints import srs_wkt
+from spacetime.scale.warpPlan import get_grid, map_to_pixel, transform_coords
+from spacetime.scale.diskCache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+from spacetime.objects.ioStats import read_variable
+from spacetime.objects.tracing import traced, span
+
+
+# web mercator tiles: 256 pixels a side, the extent of the projection and the radius of its sphere
+TILE_SIZE = 256
+MERCATOR_RADIUS = 6378137.0
+MERCATOR_ORIGIN = math.pi * MERCATOR_RADIUS
+
+# color ramps as evenly spaced RGB stops
+COLORMAPS = {
+    "viridis": [(68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98), (253, 231, 37)],
+    "magma": [(0, 0, 4), (81, 18, 124), (183, 55, 121), (252, 137, 97), (252, 253, 191)],
+    "gray": [(0, 0, 0), (255, 255, 255)],
+    "rdbu": [(103, 0, 31), (214, 96, 77), (247, 247, 247), (67, 147, 195), (5, 48, 97)],
+}
+
+
+######################################################################################################################
+# DESCRIPTION: tile_server renders XYZ (web mercator) PNG tiles of any variable and time step of a set of cubes,
+# on demand. Each tile is read from the coarsest overview level that still has the resolution of the tile (the full
+# resolution data when a cube has no overviews), reading only the window of the grid under the tile, with a stride
+# when the level is still finer than the tile. Rendered tiles are kept in an in-memory LRU cache and optionally in a
+# size limited directory, and a pool of workers renders tiles concurrently (concurrent requests for the same tile
+# share one render)
+#
+# INPUTS:
+# cubes (required): a list of cubes and/or paths of .nc cube files, or a dict of them by name
+# cacheSize: number of tiles kept in memory
+# cacheDir: directory of the on-disk tile cache, None for no disk cache
+# maxDiskSize: size limit in bytes of the on-disk tile cache
+# workers: number of threads rendering tiles
+# colormap: default color ramp, one of the keys of COLORMAPS
+#
+# OUTPUT:
+# a tile_server object, serve() starts the HTTP service
+######################################################################################################################
+class tile_server(object):
+
+    def __init__(self, cubes, cacheSize=1024, cacheDir=None, maxDiskSize=DEFAULT_MAX_SIZE, workers=4,
+                 colormap="viridis"):
+
+        if colormap not in COLORMAPS:
+            raise ValueError("colormap must be one of " + str(list(COLORMAPS)))
+
+        if not isinstance(cubes, dict):
+            cubes = dict((cube_name(c, i), c) for i, c in enumerate(cubes))
+
+        self.cubes = {}
+        for name, c in cubes.items():
+            if isinstance(c, str):
+                c = load_cube(c)
+            self.cubes[str(name)] = c
+
+        self.cacheSize = cacheSize
+        self.cacheDir = cacheDir
+        self.maxDiskSize = maxDiskSize
+        self.colormap = colormap
+
+        # netCDF4 is not thread safe, so every read goes through one lock
+        self.lock = threading.Lock()
+        self.cacheLock = threading.Lock()
+        self.memory = OrderedDict()
+        self.pending = {}
+        self.ranges = {}
+        self.grids = {}
+        self.diskWrites = 0
+
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+        if self.cacheDir != None:
+            os.makedirs(self.cacheDir, exist_ok=True)
+
+    # PNG bytes of tile z/x/y of a cube
+    def tile(self, name, z, x, y, variable=None, time=None, vmin=None, vmax=None, colormap=None):
+
+        cube = self.get_cube(name)
+        variable = self.get_variable(cube, variable)
+        t = self.get_time_index(cube, time)
+
+        if colormap == None:
+            colormap = self.colormap
+        if colormap not in COLORMAPS:
+            raise ValueError("colormap must be one of " + str(list(COLORMAPS)))
+
+        z, x, y = int(z), int(x), int(y)
+        if z < 0 or x < 0 or y < 0 or x >= 2 ** z or y >= 2 ** z:
+            raise ValueError("tile " + str((z, x, y)) + " is outside the tile grid.")
+
+        if vmin == None or vmax == None:
+            lo, hi = self.value_range(name, variable)
+            vmin = lo if vmin == None else float(vmin)
+            vmax = hi if vmax == None else float(vmax)
+
+        key = (name, variable, t, z, x, y, round(float(vmin), 12), round(float(vmax), 12), colormap)
+
+        with self.cacheLock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            future = self.pending.get(key)
+            if future == None:
+                future = self.pool.submit(self.cached_render, key)
+                self.pending[key] = future
+
+        try:
+            out = future.result()
+        finally:
+            with self.cacheLock:
+                self.pending.pop(key, None)
+
+        return out
+
+    # description of the cubes for clients
+    def info(self):
+
+        out = {}
+        for name, cube in self.cubes.items():
+
+            gt, dims, wkt = self.get_grid(name)
+            names = cube.get_var_names()
+            time = cube.get_time()
+
+            out[name] = dict(variables=["value"] if names is None else [str(v) for v in names],
+                             time=[str(t) for t in time],
+                             bounds=self.bounds(name),
+                             size=[int(dims[0]), int(dims[1])],
+                             overviews=self.get_levels(cube))
+
+        return out
+
+    def serve(self, host="127.0.0.1", port=8000):
+
+        httpd = ThreadingHTTPServer((host, port), tile_handler)
+        httpd.tiles = self
+        httpd.daemon_threads = True
+
+        print(f"serving {len(self.cubes)} cubes at http://{host}:{port}/ (Ctrl+C to stop)")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            self.pool.shutdown(wait=False)
+
+    #################################################
+    # helpers of the tile_server
+    def get_cube(self, name):
+
+        if name not in self.cubes:
+            raise KeyError("no cube named " + str(name))
+
+        return self.cubes[name]
+
+    def get_variable(self, cube, variable):
+
+        names = cube.get_var_names()
+        names = ["value"] if names is None else [str(v) for v in names]
+
+        if variable == None:
+            return names[0]
+        if variable not in names:
+            raise ValueError("variable " + str(variable) + " is not in the cube: " + str(names))
+
+        return variable
+
+    # index of a time step given as an index or a date (the nearest step)
+    def get_time_index(self, cube, time):
+
+        times = cube.get_time()
+
+        if time == None:
+            return 0
+        if isinstance(time, str) and not time.lstrip("-").isdigit():
+            if not isinstance(times, pd.DatetimeIndex):
+                raise ValueError("the cube has no dates on its time axis.")
+            return int(times.get_indexer([pd.Timestamp(time)], method="nearest")[0])
+
+        t = int(time)
+        if t < -len(times) or t >= len(times):
+            raise ValueError("time index " + str(t) + " is outside the cube.")
+
+        return t % len(times)
+
+    def get_grid(self, name):
+
+        if name not in self.grids:
+            self.grids[name] = get_grid(self.cubes[name])
+
+        return self.grids[name]
+
+    def get_levels(self, cube):
+
+        if "interum_cube" in str(type(cube)):
+            return []
+
+        with self.lock:
+            return get_overview_levels(cube)
+
+    # lon/lat bounds of a cube
+    def bounds(self, name):
+
+        gt, dims, wkt = self.get_grid(name)
+
+        x = np.array([gt[0], gt[0] + dims[0] * gt[1], gt[0], gt[0] + dims[0] * gt[1]])
+        y = np.array([gt[3], gt[3], gt[3] + dims[1] * gt[5], gt[3] + dims[1] * gt[5]])
+        lon, lat = transform_coords(x, y, wkt, srs_wkt(4326))
+
+        return [float(np.nanmin(lon)), float(np.nanmin(lat)), float(np.nanmax(lon)), float(np.nanmax(lat))]
+
+    # a (time, lat, lon) window of a variable at an overview level, NaN for nodata
+    def read_window(self, cube, variable, factor, key):
+
+        with self.lock:
+            if "interum_cube" in str(type(cube)):
+                array = cube.get_data_array()
+                if len(array.shape) == 4:
+                    array = array.sel(variables=variable)
+                raw = array.transpose("time", "lat", "lon")[key].values
+            elif factor == 1:
+                raw = read_variable(cube.get_GDAL_data().variables[variable], key, stats=cube.ioStats)
+            else:
+                group = cube.get_GDAL_data().groups["overview_" + str(factor)]
+                raw = read_variable(group.variables[variable], key, stats=cube.ioStats)
+
+        out = np.ma.filled(np.ma.asarray(raw).astype(np.float64), np.nan)
+        nodata = cube.get_nodata_value()
+        if nodata != None:
+            out[out == nodata] = np.nan
+
+        return out
+
+    # default color stretch of a variable: 2nd to 98th percentile of a sample from the coarsest level
+    def value_range(self, name, variable):
+
+        if (name, variable) in self.ranges:
+            return self.ranges[(name, variable)]
+
+        cube = self.cubes[name]
+        gt, dims, wkt = self.get_grid(name)
+        levels = self.get_levels(cube)
+        factor = max([1] + levels)
+
+        T = len(cube.get_time())
+        h, w = -(-dims[1] // factor), -(-dims[0] // factor)
+        step = max(1, int(math.ceil(max(h, w) / TILE_SIZE)))
+        key = (slice(None, None, max(1, T // 16)), slice(None, None, step), slice(None, None, step))
+
+        with span("tile_value_range"):
+            sample = self.read_window(cube, variable, factor, key)
+
+        sample = sample[np.isfinite(sample)]
+        if len(sample) == 0:
+            out = (0.0, 1.0)
+        else:
+            out = (float(np.percentile(sample, 2)), float(np.percentile(sample, 98)))
+            if out[1] <= out[0]:
+                out = (out[0], out[0] + 1.0)
+
+        self.ranges[(name, variable)] = out
+
+        return out
+
+    # a tile from the disk cache or rendered, then kept in the memory cache
+    def cached_render(self, key):
+
+        path = self.disk_path(key)
+
+        if path != None and os.path.exists(path):
+            with open(path, "rb") as f:
+                out = f.read()
+            os.utime(path)
+        else:
+            out = self.render(*key)
+            if path != None:
+                self.disk_put(path, out)
+
+        with self.cacheLock:
+            self.memory[key] = out
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.cacheSize:
+                self.memory.popitem(last=False)
+
+        return out
+
+    def render(self, name, variable, t, z, x, y, vmin, vmax, colormap):
+
+        with span("render_tile"):
+
+            cube = self.cubes[name]
+            gt, dims, wkt = self.get_grid(name)
+
+            lon, lat = tile_lonlat(z, x, y)
+            px, py = transform_coords(lon.ravel(), lat.ravel(), srs_wkt(4326), wkt)
+            px = px.reshape(lon.shape)
+            py = py.reshape(lat.shape)
+
+            # size of a tile pixel in cube units, along the middle row of the tile
+            mid = TILE_SIZE // 2
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning) # rows outside the projection of the cube
+                res = np.nanmedian(np.hypot(np.diff(px[mid]), np.diff(py[mid])))
+            if not np.isfinite(res):
+                res = abs(gt[1])
+
+            factor = choose_level(self.get_levels(cube), abs(gt[1]), dims, resolution=res)
+            levelGt = (gt[0], gt[1] * factor, 0.0, gt[3], 0.0, gt[5] * factor)
+            levelDims = (-(-dims[0] // factor), -(-dims[1] // factor))
+
+            col, row = map_to_pixel(levelGt, px, py)
+            with np.errstate(invalid="ignore"):
+                inside = (col >= 0) & (row >= 0) & (col < levelDims[0]) & (row < levelDims[1])
+
+            values = np.full(px.shape, np.nan)
+
+            if inside.any():
+
+                col = np.floor(col[inside]).astype(np.int64)
+                row = np.floor(row[inside]).astype(np.int64)
+
+                # read the window under the tile, every step-th pixel when the level is finer than the tile
+                step = max(1, int(res / (abs(gt[1]) * factor)))
+                r0, c0 = row.min(), col.min()
+                key = (t, slice(r0, row.max() + 1, step), slice(c0, col.max() + 1, step))
+                window = self.read_window(cube, variable, factor, key)
+
+                values[inside] = window[(row - r0) // step, (col - c0) // step]
+
+            rgba = colorize(values, vmin, vmax, colormap)
+            out = png_bytes(rgba)
+
+        return out
+
+    def disk_path(self, key):
+
+        cube = self.cubes[key[0]]
+        if self.cacheDir == None or "interum_cube" in str(type(cube)):
+            return None
+
+        # tiles are keyed on the identity of the cube file, so rewritten cubes do not serve stale tiles
+        fileName = cube.get_GDAL_data().filepath()
+        stat = os.stat(fileName)
+        ident = [os.path.abspath(fileName), stat.st_size, stat.st_mtime_ns] + [str(k) for k in key]
+        digest = hashlib.sha1(json.dumps(ident).encode()).hexdigest()
+
+        return os.path.join(self.cacheDir, digest[:2], digest + ".png")
+
+    def disk_put(self, path, data):
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + "." + str(threading.get_ident()) + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+
+        with self.cacheLock:
+            self.diskWrites += 1
+            check = self.diskWrites % 256 == 0
+        if check:
+            self.disk_evict()
+
+    # remove the least recently used tiles once the directory is over its size limit
+    def disk_evict(self):
+
+        files = []
+        for root, dirs, names in os.walk(self.cacheDir):
+            for n in names:
+                if n.endswith(".png"):
+                    p = os.path.join(root, n)
+                    s = os.stat(p)
+                    files.append((s.st_mtime, s.st_size, p))
+
+        total = sum(f[1] for f in files)
+        for mtime, size, p in sorted(files):
+            if total <= self.maxDiskSize:
+                break
+            try:
+                os.remove(p)
+                total -= size
+            except OSError:
+                pass
+######################################################################################################################
+# END CLASS
+######################################################################################################################
+
+
+
+#################################################
+# HTTP interface of the tile_server:
+# /                                   a map page to browse the cubes
+# /cubes                              JSON description of the cubes
+# /tiles/<cube>/<z>/<x>/<y>.png       a tile, with optional query parameters variable, time (index or date),
+#                                     vmin, vmax and colormap
+class tile_handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p != ""]
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        tiles = self.server.tiles
+
+        try:
+            if len(parts) == 0:
+                self.send(200, "text/html; charset=utf-8", INDEX_PAGE.encode())
+            elif parts == ["cubes"]:
+                self.send(200, "application/json", json.dumps(tiles.info()).encode())
+            elif len(parts) == 5 and parts[0] == "tiles" and parts[4].endswith(".png"):
+                out = tiles.tile(parts[1], parts[2], parts[3], parts[4][:-4], variable=query.get("variable"),
+                                 time=query.get("time"), vmin=query.get("vmin"), vmax=query.get("vmax"),
+                                 colormap=query.get("colormap"))
+                self.send(200, "image/png", out, cache="max-age=3600")
+            else:
+                self.send(404, "application/json", json.dumps(dict(error="not found")).encode())
+        except KeyError as e:
+            self.send(404, "application/json", json.dumps(dict(error=str(e))).encode())
+        except ValueError as e:
+            self.send(400, "application/json", json.dumps(dict(error=str(e))).encode())
+        except Exception as e:
+            self.send(500, "application/json", json.dumps(dict(error=repr(e))).encode())
+
+    def send(self, code, contentType, body, cache=None):
+
+        self.send_response(code)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if cache != None:
+            self.send_header("Cache-Control", cache)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# helper functions for tiles
+def cube_name(cube, i):
+
+    if isinstance(cube, str):
+        return os.path.splitext(os.path.basename(cube))[0]
+    if "interum_cube" not in str(type(cube)):
+        return os.path.splitext(os.path.basename(cube.get_GDAL_data().filepath()))[0]
+
+    return "cube_" + str(i)
+
+
+# lon/lat of the pixel centers of tile z/x/y
+def tile_lonlat(z, x, y):
+
+    res = 2 * MERCATOR_ORIGIN / (TILE_SIZE * 2 ** z)
+    i = np.arange(TILE_SIZE) + 0.5
+
+    mx = -MERCATOR_ORIGIN + (x * TILE_SIZE + i) * res
+    my = MERCATOR_ORIGIN - (y * TILE_SIZE + i) * res
+    mx, my = np.meshgrid(mx, my)
+
+    lon = np.degrees(mx / MERCATOR_RADIUS)
+    lat = np.degrees(2 * np.arctan(np.exp(my / MERCATOR_RADIUS)) - math.pi / 2)
+
+    return lon, lat
+
+
+# RGBA pixels of values stretched from vmin to vmax over a color ramp, transparent where NaN
+def colorize(values, vmin, vmax, colormap):
+
+    stops = np.array(COLORMAPS[colormap], dtype=np.float64)
+    ramp = np.empty((256, 3))
+    for c in range(3):
+        ramp[:, c] = np.interp(np.linspace(0, 1, 256), np.linspace(0, 1, len(stops)), stops[:, c])
+
+    valid = np.isfinite(values)
+    with np.errstate(invalid="ignore"):
+        scaled = (values - vmin) / (vmax - vmin) if vmax != vmin else np.zeros(values.shape)
+    index = np.clip(np.where(valid, scaled, 0) * 255 + 0.5, 0, 255).astype(np.uint8)
+
+    out = np.zeros(values.shape + (4,), dtype=np.uint8)
+    out[..., :3] = ramp[index].astype(np.uint8)
+    out[..., 3] = np.where(valid, 255, 0)
+
+    return out
+
+
+# encode a (rows, cols, 4) uint8 array as a PNG
+def png_bytes(rgba):
+
+    h, w = rgba.shape[:2]
+
+    # every row starts with filter type 0 (none)
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0)
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) +
+            chunk(b"IEND", b""))
+
+
+INDEX_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>spacetime</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+html, body, #map { height: 100%; margin: 0; }
+#controls { position: absolute; top: 10px; right: 10px; z-index: 1000; background: white; padding: 8px;
+            font: 13px sans-serif; border-radius: 4px; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="controls">
+  <select id="cube"></select> <select id="variable"></select>
+  <input id="time" type="range" min="0" value="0"> <span id="label"></span>
+</div>
+<script>
+var map = L.map("map").setView([0, 0], 2);
+L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {attribution: "OpenStreetMap"}).addTo(map);
+var layer = null, cubes = {};
+var $ = function(id) { return document.getElementById(id); };
+function options(select, values) {
+  select.innerHTML = values.map(function(v) { return "<option>" + v + "</option>"; }).join("");
+}
+function update() {
+  var c = cubes[$("cube").value];
+  $("label").textContent = c.time[$("time").value];
+  var url = "tiles/" + encodeURIComponent($("cube").value) + "/{z}/{x}/{y}.png?variable=" +
+            encodeURIComponent($("variable").value) + "&time=" + $("time").value;
+  if (layer) { layer.setUrl(url); } else { layer = L.tileLayer(url, {opacity: 0.8}).addTo(map); }
+}
+function pick() {
+  var c = cubes[$("cube").value];
+  options($("variable"), c.variables);
+  $("time").max = c.time.length - 1;
+  $("time").value = 0;
+  map.fitBounds([[c.bounds[1], c.bounds[0]], [c.bounds[3], c.bounds[2]]]);
+  update();
+}
+fetch("cubes").then(function(r) { return r.json(); }).then(function(data) {
+  cubes = data;
+  options($("cube"), Object.keys(data));
+  $("cube").onchange = pick;
+  $("variable").onchange = update;
+  $("time").oninput = update;
+  pick();
+});
+</script>
+</body>
+</html>
+"""
+#################################################
+
+
+
+# cube_explorer is imported on first use, so the tile server does not need the plotting packages
+def __getattr__(name):
+
+    if name == "cube_explorer":
+        from spacetime.graphics.cubeExplorer import cube_explorer
+        return cube_explorer
+
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+
+
+######################################################################################################################
+# DESCRIPTION: run starts the tile server from the command line, python -m spacetime cube.nc [more.nc ...]
+#
+# INPUTS:
+# argv: command line arguments, sys.argv by default
+######################################################################################################################
+@traced()
+def run(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m spacetime", description="Serve map tiles of spacetime cubes.")
+    parser.add_argument("files", nargs="+", help=".nc cube files")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=4, help="threads rendering tiles")
+    parser.add_argument("--cache-size", type=int, default=1024, help="tiles kept in memory")
+    parser.add_argument("--cache-dir", default=None, nargs="?", const=os.path.join(DEFAULT_CACHE_DIR, "tiles"),
+                        help="on-disk tile cache, in the spacetime cache directory when given without a path")
+    parser.add_argument("--max-disk-size", type=float, default=DEFAULT_MAX_SIZE, help="size limit in bytes of the disk cache")
+    parser.add_argument("--colormap", default="viridis", choices=list(COLORMAPS))
+    args = parser.parse_args(argv)
+
+    server = tile_server(args.files, cacheSize=args.cache_size, cacheDir=args.cache_dir,
+                         maxDiskSize=int(args.max_disk_size), workers=args.workers, colormap=args.colormap)
+    server.serve(args.host, args.port)
+
 
 
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    run()
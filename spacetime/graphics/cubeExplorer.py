@@ -0,0 +1,318 @@
+import numpy as np
+import pandas as pd
+import warnings
+import plotly.graph_objects as go
+from concurrent.futures import ThreadPoolExecutor
+from spacetime.graphics.dataPlot import plot_control, update_fig_layout
+from spacetime.operations.cubeStream import cube_reader
+from spacetime.operations.reduceCube import reduce_cube
+from spacetime.operations.cubeOverviews import get_overview_levels, choose_level
+from spacetime.objects.ioStats import read_variable
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+# spatial summaries of each time step, median needs a pass of its own
+EXPLORER_SUMMARIES = ["mean", "median", "min", "max", "std", "count"]
+
+
+######################################################################################################################
+# DESCRIPTION: cube_explorer is a dashboard backend for interactive plots of a cube. Instead of flattening the
+# cube to a data frame for every plot, it computes per cube aggregates once in streaming passes and caches them
+# keyed by their parameters: the spatial summaries of every time step (one pass gives mean, min, max, std and
+# count of every variable), histograms of every time step on fixed bins (summed over any time selection) and
+# reduced resolution images of single time steps (read from the overviews of the cube when it has them). Figures are
+# kept and their traces updated in place when a control changes, so after the first load interactions only slice
+# cached arrays
+#
+# INPUTS:
+# cube (required): a cube or interum_cube
+# bins: number of histogram bins over the range of each variable
+# maxSize: largest number of pixels along lat and lon of the images
+# widget: if True figures are plotly FigureWidgets, which redraw in a notebook when their traces are updated
+# workers: number of threads computing aggregates
+# budget: memory budget in bytes for the blocks in flight, defaults to the configured memory budget
+#
+# OUTPUT:
+# a cube_explorer object
+######################################################################################################################
+class cube_explorer(object):
+
+    def __init__(self, cube, bins=50, maxSize=512, widget=False, workers=4, budget=None):
+
+        if budget == None:
+            budget = get_memory_budget()
+
+        self.cube = cube
+        self.bins = int(bins)
+        self.maxSize = int(maxSize)
+        self.widget = widget
+        self.workers = workers
+        self.budget = budget
+
+        self.reader = cube_reader(cube)
+        self.names = self.reader.names
+        self.time = self.reader.get_time()
+
+        # caches of aggregates and figures, keyed by their parameters
+        self.summaries = {}
+        self.histograms = {}
+        self.images = {}
+        self.figures = {}
+
+    # compute the aggregates every control needs, so later interactions are served from the caches
+    @traced()
+    def preload(self, images=False):
+
+        for v in self.names:
+            self.summary(v, "mean")
+            self.histogram_counts(v)
+            if images:
+                for t in range(len(self.time)):
+                    self.image(v, t)
+
+        return self
+
+    # spatial summary of every time step of a variable as a Series over time
+    def summary(self, variable=None, summary="mean"):
+
+        variable = self.get_variable(variable)
+        if summary not in EXPLORER_SUMMARIES:
+            raise ValueError("summary must be one of " + str(EXPLORER_SUMMARIES))
+
+        key = (variable, summary)
+        if key not in self.summaries:
+            if summary == "median":
+                self.summaries[key] = pd.Series(self.spatial_median(variable), index=self.time, name="median")
+            else:
+                # one streaming pass fills the moments of every variable
+                ops = [s for s in EXPLORER_SUMMARIES if s != "median"]
+                with span("explorer_summaries"):
+                    ds = reduce_cube(self.cube, dims=["lat", "lon"], ops=ops, workers=self.workers,
+                                     budget=self.budget)
+                for v in self.names:
+                    for o in ops:
+                        values = ds[o].sel(variables=v).values if "variables" in ds[o].dims else ds[o].values
+                        self.summaries[(v, o)] = pd.Series(values, index=self.time, name=o)
+
+        return self.summaries[key]
+
+    # histogram counts (time, bins) of a variable on fixed bins over its whole range, and the bin edges
+    def histogram_counts(self, variable=None):
+
+        variable = self.get_variable(variable)
+
+        key = (variable, self.bins)
+        if key not in self.histograms:
+
+            lo = np.nanmin(self.summary(variable, "min").values)
+            hi = np.nanmax(self.summary(variable, "max").values)
+            if not np.isfinite(lo):
+                lo, hi = 0.0, 1.0
+            if hi <= lo:
+                hi = lo + 1.0
+            edges = np.linspace(lo, hi, self.bins + 1)
+
+            v = self.names.index(variable)
+            T = len(self.time)
+            counts = np.zeros((T, self.bins), dtype=np.int64)
+
+            def block_counts(block):
+
+                with span("explorer_histogram_block"):
+                    data = self.reader.read(v, *block)
+                    valid = ~np.isnan(data)
+                    index = np.clip(np.searchsorted(edges, data, side="right") - 1, 0, self.bins - 1)
+                    steps = np.broadcast_to(np.arange(data.shape[0])[:, None, None], data.shape)
+                    part = np.bincount((steps * self.bins + index)[valid], minlength=data.shape[0] * self.bins)
+
+                return block, part.reshape(data.shape[0], self.bins)
+
+            blocks = self.reader.blocks(self.budget // (max(1, self.workers) * 4))
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for block, part in pool.map(block_counts, blocks):
+                    counts[block[0]] += part
+
+            self.histograms[key] = (counts, edges)
+
+        return self.histograms[key]
+
+    # reduced resolution (lat, lon) image of one time step and its lat/lon, at most maxSize pixels a side
+    def image(self, variable=None, time=0):
+
+        variable = self.get_variable(variable)
+        t = int(time) % len(self.time)
+
+        key = (variable, t, self.maxSize)
+        if key not in self.images:
+
+            T, Y, X = self.reader.shape
+            lat = np.asarray(self.reader.get_lat())
+            lon = np.asarray(self.reader.get_lon())
+
+            # the finest overview that fits maxSize, then a stride for what is left
+            levels = [] if self.reader.vars is None else get_overview_levels(self.cube)
+            factor = choose_level(levels, float(self.cube.get_pixel_size()), [X, Y], maxSize=self.maxSize)
+            step = max(1, int(np.ceil(max(-(-Y // factor), -(-X // factor)) / self.maxSize)))
+            window = (t, slice(None, None, step), slice(None, None, step))
+
+            with span("explorer_image"):
+                if factor == 1:
+                    data = self.reader.read(self.names.index(variable), *window)
+                else:
+                    with self.reader.lock:
+                        group = self.cube.get_GDAL_data().groups["overview_" + str(factor)]
+                        raw = read_variable(group.variables[variable], window, stats=self.cube.ioStats)
+                        lat = read_variable(group.variables["lat"], stats=self.cube.ioStats)
+                        lon = read_variable(group.variables["lon"], stats=self.cube.ioStats)
+                    data = np.ma.filled(np.ma.asarray(raw).astype(np.float64), np.nan)
+                    if self.reader.nodata != None:
+                        data[data == self.reader.nodata] = np.nan
+
+            self.images[key] = (data, np.asarray(lat)[::step], np.asarray(lon)[::step])
+
+        return self.images[key]
+
+    #################################################
+    # figures, built once per kind and updated in place
+    def timeseries(self, variable=None, summary="mean"):
+
+        variables = self.names if variable == None and len(self.names) > 1 else [self.get_variable(variable)]
+        series = [self.summary(v, summary) for v in variables]
+
+        def traces():
+            return [go.Scatter(x=s.index, y=s.values, mode="lines", name=v) for v, s in zip(variables, series)]
+
+        fig = self.get_figure("timeseries", len(variables), traces)
+        with fig.batch_update():
+            for trace, v, s in zip(fig.data, variables, series):
+                trace.x = s.index
+                trace.y = s.values
+                trace.name = v
+            fig.update_layout(yaxis_title=summary, showlegend=len(variables) > 1)
+
+        return fig
+
+    # histogram of a variable over all time steps, one time step (time) or one year (year)
+    def histogram(self, variable=None, time=None, year=None):
+
+        variable = self.get_variable(variable)
+        counts, edges = self.histogram_counts(variable)
+
+        if time != None:
+            selected = counts[int(time)]
+        elif year != None:
+            if not isinstance(self.time, pd.DatetimeIndex):
+                raise ValueError("a histogram by year needs a cube with dates on its time axis.")
+            selected = counts[np.asarray(self.time.year == int(year))].sum(axis=0)
+        else:
+            selected = counts.sum(axis=0)
+
+        centers = (edges[:-1] + edges[1:]) / 2
+
+        def traces():
+            return [go.Bar(x=centers, y=selected, width=np.diff(edges), name=variable)]
+
+        fig = self.get_figure("histogram", 1, traces)
+        with fig.batch_update():
+            fig.data[0].x = centers
+            fig.data[0].y = selected
+            fig.data[0].width = np.diff(edges)
+            fig.data[0].name = variable
+            fig.update_layout(xaxis_title=variable, yaxis_title="count", bargap=0)
+
+        return fig
+
+    # map of one time step
+    def spatial(self, variable=None, time=0, vmin=None, vmax=None):
+
+        variable = self.get_variable(variable)
+        data, lat, lon = self.image(variable, time)
+
+        # a fixed color range over time keeps frames comparable
+        if vmin == None:
+            vmin = float(np.nanmin(self.summary(variable, "min").values))
+        if vmax == None:
+            vmax = float(np.nanmax(self.summary(variable, "max").values))
+
+        def traces():
+            return [go.Heatmap(z=data, x=lon, y=lat, zmin=vmin, zmax=vmax, colorscale="Viridis")]
+
+        fig = self.get_figure("spatial", 1, traces)
+        with fig.batch_update():
+            fig.data[0].z = data
+            fig.data[0].x = lon
+            fig.data[0].y = lat
+            fig.data[0].zmin = vmin
+            fig.data[0].zmax = vmax
+            fig.update_layout(title=variable + " " + str(self.time[int(time) % len(self.time)]))
+
+        return fig
+
+    # control chart of a summary, the chart is rebuilt but its data comes from the cache
+    def control(self, variable=None, summary="mean", show_avg="all", show_deviations="all", deviation_coefficient=1,
+                show_trends="updown"):
+
+        s = self.summary(variable, summary)
+        df = pd.DataFrame(dict(time=s.index, value=s.values)).dropna().reset_index(drop=True)
+
+        fig = plot_control(df, show_avg, show_deviations, deviation_coefficient, show_trends)
+        fig = update_fig_layout(fig)
+        if self.widget:
+            fig = go.FigureWidget(fig)
+
+        self.figures["control"] = fig
+
+        return fig
+
+    #################################################
+    # helpers of the cube_explorer
+    def get_variable(self, variable):
+
+        if variable == None:
+            return self.names[0]
+        if isinstance(variable, (int, np.integer)):
+            return self.names[variable]
+        if variable not in self.names:
+            raise ValueError("variable " + str(variable) + " is not in the cube: " + str(self.names))
+
+        return str(variable)
+
+    # the figure of a kind, new when it does not exist yet or has another number of traces
+    def get_figure(self, kind, count, traces):
+
+        fig = self.figures.get(kind)
+
+        if fig is None or len(fig.data) != count:
+            fig = go.FigureWidget() if self.widget else go.Figure()
+            for trace in traces():
+                fig.add_trace(trace)
+            fig = update_fig_layout(fig)
+            self.figures[kind] = fig
+
+        return fig
+
+    # median of every time step over space, in time slabs of whole grids
+    def spatial_median(self, variable):
+
+        v = self.names.index(variable)
+        T, Y, X = self.reader.shape
+        slab = int(max(1, min(T, self.budget // (max(1, self.workers) * Y * X * 8 * 2))))
+
+        out = np.full(T, np.nan)
+
+        def slab_median(t0):
+
+            with span("explorer_median_slab"):
+                data = self.reader.read(v, slice(t0, min(T, t0 + slab)))
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning) # time steps without valid values
+                    out[t0:t0 + slab] = np.nanmedian(data.reshape(data.shape[0], -1), axis=1)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(slab_median, range(0, T, slab)))
+
+        return out
+######################################################################################################################
+# END CLASS
+######################################################################################################################
@@ -12,7 +12,8 @@ import statsmodels.api as sm
 import datetime
 import math
 
-from spacetime.graphics.dataSort import sort_dataframe, organize_dataframe
+from spacetime.graphics.dataSort import sort_dataframe, organize_dataframe, compact_dataframe
+from spacetime.objects.tracing import traced, span
 
 # Style color presets
 COLOR_STYLES = {
@@ -33,6 +34,9 @@ COLOR_STYLES = {
     ]
 }
 
+# trace attributes holding data arrays, converted to typed arrays for compact figures
+COMPACT_ATTRIBUTES = ["x", "y", "z", "lat", "lon", "customdata"]
+
 # flags for data styling.
 FLAGS = {
     "base": ["Base", COLOR_STYLES["line_colors"][0]],
@@ -49,6 +53,7 @@ FLAGS = {
 # Primary Methods
 ########################################################################################################################
 # Main Plotting method, delegates plotting to sub-methods and returns a completed plotly figure.
+@traced()
 def plot_cube(
         cube,
         plot_type: str = "timeseries",
@@ -63,6 +68,8 @@ def plot_cube(
         discrete_latlong_size: Union[int, float] = 10,
         bin_size: Union[int, float] = 100,
         show_plot: bool = True,
+        compact: bool = False,
+        max_size: Optional[int] = 512,
 ) -> go.Figure:
 
     """
@@ -149,9 +156,23 @@ def plot_cube(
 
         show_plot: <accepted types: boolean>
                 Allows the user to turn off automatic chart output.
+
+        compact: <accepted types: boolean>
+                Makes a smaller figure: drops the columns the chart does not use, stores values as float32
+                typed arrays (base64 in the figure JSON) and dates as numbers on date axes instead of strings.
+
+        max_size: <accepted types: integer, None>
+                For cubes with overviews (see build_overviews), the plot reads the coarsest overview level with
+                at most max_size pixels along lat and lon instead of the full resolution data, so maps and
+                summaries of large cubes stay fast. Summaries then describe the overview values. None always
+                reads the full resolution data.
     """
 
-    df_plot = organize_dataframe(cube, plot_type, variable, summary)
+    with span("organize_dataframe"):
+        df_plot = organize_dataframe(cube, plot_type, variable, summary, max_size)
+
+    if compact:
+        df_plot = compact_dataframe(df_plot, plot_type)
 
     input_validity = validate_inputs(df_plot,
                                      plot_type,
@@ -182,6 +203,9 @@ def plot_cube(
         elif plot_type == 'box':
             fig = plot_box(df_plot, variable)
 
+        if compact:
+            fig = compact_figure(fig)
+
         if show_plot:
             fig.show()
 
@@ -225,7 +249,7 @@ def plot_spatial(cube, df) -> go.Figure:
 
 # Plot a time series chart
 def plot_timeseries(df) -> go.Figure:
-    time = df['timeChar']
+    time = df['timeChar'] if 'timeChar' in df.columns else df['time']
 
     if 'variables' in df.columns:
         fig = px.line(df, x=time, y="value", color='variables')
@@ -619,6 +643,54 @@ def add_markers(df, fig, marker_name, marker_color) -> go.Figure:
     return fig
 
 
+# Convert the data arrays of a figure (and its animation frames) to compact typed arrays: floats to float32 and
+# dates to milliseconds since the epoch on date axes, which plotly serializes as base64 instead of JSON lists
+def compact_figure(fig) -> go.Figure:
+    traces = list(fig.data) + [trace for frame in fig.frames for trace in frame.data]
+    date_axes = set()
+
+    for trace in traces:
+        for attr in COMPACT_ATTRIBUTES:
+            if attr not in trace or trace[attr] is None or isinstance(trace[attr], str) or np.ndim(trace[attr]) == 0:
+                continue
+
+            values = np.asarray(trace[attr])
+
+            if attr == 'x' and is_date_array(values):
+                dates = pd.to_datetime(values.ravel())
+                values = (dates.values.astype('datetime64[ms]').astype(np.int64)).astype(np.float64)
+                date_axes.add('xaxis' + (trace.xaxis[1:] if 'xaxis' in trace and trace.xaxis else ''))
+            elif values.dtype.kind == 'f':
+                values = values.astype(np.float32)
+            elif values.dtype.kind == 'O':
+                # only numbers, labels such as the year names of a box plot stay categories even if they parse
+                if pd.api.types.infer_dtype(values.ravel(), skipna=True) not in ['integer', 'floating',
+                                                                                  'mixed-integer-float']:
+                    continue
+                values = values.astype(np.float32)
+            elif values.dtype.kind not in ['i', 'u', 'b']:
+                continue
+
+            # plotly skips assignments equal in value to the current array, which would keep its type
+            trace[attr] = None
+            trace[attr] = values
+
+    for axis in date_axes:
+        fig.layout[axis].type = 'date'
+
+    return fig
+
+
+# Check whether an array holds dates, as datetimes or ISO date strings
+def is_date_array(values) -> bool:
+    if values.dtype.kind == 'M':
+        return True
+    if values.dtype.kind not in ['O', 'U'] or values.size == 0:
+        return False
+
+    return bool(pd.Series(values.ravel()).astype(str).str.match(r"^\d{4}-\d{2}-\d{2}").all())
+
+
 # Chart Figure layout update
 def update_fig_layout(fig) -> go.Figure:
     fig.update_layout(
@@ -6,13 +6,14 @@ import numpy as np
 from typing import Tuple, List
 
 from spacetime.operations.cubeToDataframe import cube_to_dataframe
+from spacetime.operations.cubeOverviews import read_overview
 
 
 # Main Method
 ########################################################################################################################
 # Process Cube data for chart plotting
-def organize_dataframe(cube, plot_type, variable, summary) -> pd.DataFrame:
-    df = cube_to_dataframe(cube)
+def organize_dataframe(cube, plot_type, variable, summary, max_size=None) -> pd.DataFrame:
+    df = cube_to_dataframe(cube, plot_array(cube, max_size))
     shape_val = cube.get_shapeval()
 
     if shape_val == 4:
@@ -61,6 +62,34 @@ def organize_dataframe(cube, plot_type, variable, summary) -> pd.DataFrame:
     return summ_df
 
 
+# The data a plot reads: the coarsest overview level of the cube file that fits max_size pixels a side, or the full
+# resolution data when max_size is None, the cube has no overviews or is an interum cube
+def plot_array(cube, max_size=None):
+    if max_size is None or "interum_cube" in str(type(cube)):
+        return cube.get_data_array()
+
+    return read_overview(cube, maxSize=max_size)
+
+
+# Keep only the columns a plot type uses, with float32 values, for compact figures
+def compact_dataframe(df, plot_type) -> pd.DataFrame:
+    columns = {
+        "space": ["timeChar", "lat", "lon", "value"],
+        "timeseries": ["time", "variables", "value"],
+        "control": ["time", "value"],
+        "histogram": ["year", "lat", "lon", "variables", "value"],
+        "box": ["variables", "value"],
+    }
+
+    df_compact = df[[c for c in columns.get(plot_type, df.columns) if c in df.columns]].copy()
+
+    for col in ["lat", "lon", "value"]:
+        if col in df_compact.columns:
+            df_compact[col] = df_compact[col].astype(np.float32)
+
+    return df_compact
+
+
 # sort data for control chart
 def sort_dataframe(
         df: pandas.DataFrame,
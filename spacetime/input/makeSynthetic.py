@@ -0,0 +1,283 @@
+from osgeo import gdal
+from osgeo import osr
+from osgeo import gdal_array
+import numpy as np
+import netCDF4 as nc
+import json
+import os
+from spacetime.operations.time import cube_time
+from spacetime.scale.warpPlan import grid_windows
+from spacetime.objects.tracing import traced
+
+
+######################################################################################################################
+# DESCRIPTION: synthetic_rasters writes a series of multi-band GeoTIFFs for testing at size. Pixels follow
+# value = (t + ((row + col) % period) / period) * valueScale plus optional seeded noise, where t is the global
+# band index across all files, and a seeded fraction of pixels is set to nodata. Files are written tile by tile,
+# so they can be larger than RAM. Count/sum/min/max/mean per time step are accumulated from the blocks as they are
+# written (after rounding, noise and nodata), so they are the reference values of the files
+#
+# INPUTS:
+# outDir (required): directory the files are written to
+# files: number of files in the series
+# dims: (x, y) size of every raster
+# bands: number of bands in every file
+# dtype: numpy type name of the pixels
+# SRS: EPSG code of the rasters
+# ul: (x, y) upper left corner
+# pixelSize: pixel size in SRS units
+# nodataFraction: share of pixels set to nodata
+# nodata: the nodata value, must fit dtype. None uses -9999, or the lowest (signed) or highest (unsigned) value of
+# integer types -9999 does not fit
+# noise: standard deviation of the seeded gaussian noise added to every pixel
+# period: repeat length of the spatial pattern in pixels
+# valueScale: multiplier of the values (useful with integer types)
+# blockSize: tile size of the GeoTIFFs and of the writes
+# compress: GeoTIFF compression (e.g. "DEFLATE", "LZW" or "NONE")
+# seed: seed of the noise and nodata placement
+# start, scale: start date and step ("year", "month" or "day") of the date vector
+#
+# OUTPUT:
+# a dict with the file names, the date vector and the statistics of the values written (also written to stats.json
+# in outDir)
+######################################################################################################################
+@traced()
+def synthetic_rasters(outDir, files=3, dims=(100, 100), bands=5, dtype="float32", SRS=4326, ul=(-100.0, 50.0),
+                      pixelSize=0.1, nodataFraction=0.0, nodata=None, noise=0.0, period=10, valueScale=1.0,
+                      blockSize=256, compress="DEFLATE", seed=0, start="2000-01-01", scale="year"):
+
+    nodata = check_nodata(nodata, dtype)
+
+    os.makedirs(outDir, exist_ok=True)
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(SRS)
+    gdalType = gdal_array.NumericTypeCodeToGDALTypeCode(np.dtype(dtype))
+    driver = gdal.GetDriverByName("GTiff")
+
+    options = ["TILED=YES", "BLOCKXSIZE=" + str(blockSize), "BLOCKYSIZE=" + str(blockSize), "BIGTIFF=IF_SAFER"]
+    if compress != None and compress != "NONE":
+        options.append("COMPRESS=" + compress)
+
+    times = cube_time(start=start, length=files * bands, scale=scale)
+    stats = new_stats(files * bands)
+    names = []
+
+    for f in range(files):
+
+        name = os.path.join(outDir, "synthetic_" + str(f).zfill(4) + ".tif")
+        ds = driver.Create(name, dims[0], dims[1], bands, gdalType, options=options)
+        ds.SetGeoTransform((ul[0], pixelSize, 0.0, ul[1], 0.0, -pixelSize))
+        ds.SetProjection(srs.ExportToWkt())
+
+        for b in range(bands):
+
+            t = f * bands + b
+            band = ds.GetRasterBand(b + 1)
+            band.SetNoDataValue(nodata)
+            band.SetDescription(str(times[t].date()))
+
+            for yoff, xoff, ysize, xsize in grid_windows(dims, blockSize):
+                block = make_block(t, yoff, xoff, ysize, xsize, dtype, nodata, nodataFraction, noise, period,
+                                   valueScale, [seed, f, b, yoff, xoff])
+                band.WriteArray(block, xoff, yoff)
+                add_stats(stats, t, block, nodata)
+
+        ds.FlushCache()
+        ds = None
+        names.append(name)
+
+    out = dict(files=names, time=times, stats=finish_stats(stats))
+    write_stats(os.path.join(outDir, "stats.json"), out)
+
+    return out
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+######################################################################################################################
+# DESCRIPTION: synthetic_cube writes a NetCDF cube laid out like make_cube output (time, lat, lon, spatial_ref and
+# one variable per name) with the same value pattern, nodata placement and statistics as synthetic_rasters.
+# Each time step is written in row blocks, so cubes larger than RAM can be made
+#
+# INPUTS:
+# fileName (required): path of the .nc file
+# dims: (x, y) size of the grid
+# length: number of time steps
+# variables: list of variable names, None writes a single "value" variable like filestotime cubes
+# chunks: (time, lat, lon) chunk sizes of the variables, None leaves the layout to netCDF
+# compress: if True the variables are zlib compressed
+# the remaining inputs are those of synthetic_rasters
+#
+# OUTPUT:
+# a dict with the file name, the date vector and the statistics of the values written per variable
+######################################################################################################################
+@traced()
+def synthetic_cube(fileName, dims=(100, 100), length=10, variables=None, dtype="float32", SRS=4326, ul=(-100.0, 50.0),
+                   pixelSize=0.1, nodataFraction=0.0, nodata=None, noise=0.0, period=10, valueScale=1.0,
+                   blockSize=256, chunks=None, compress=True, seed=0, start="2000-01-01", scale="year"):
+
+    nodata = check_nodata(nodata, dtype)
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(SRS)
+
+    times = cube_time(start=start, length=length, scale=scale)
+
+    if variables == None:
+        names = ["value"]
+    else:
+        names = list(variables)
+
+    ds = nc.Dataset(fileName, 'w', format='NETCDF4')
+
+    ds.createDimension('time', length)
+    ds.createDimension('lat', dims[1])
+    ds.createDimension('lon', dims[0])
+
+    time = ds.createVariable('time', 'float64', ('time',))
+    lats = ds.createVariable('lat', 'f4', ('lat',))
+    lons = ds.createVariable('lon', 'f4', ('lon',))
+
+    lons.units = "degrees_east"
+    lons.standard_name = "longitude"
+    lons.axis = "X"
+
+    lats.units = "degrees_north"
+    lats.standard_name = "latitude"
+    lats.axis = "Y"
+
+    # lat and lon hold the upper left corner of each pixel like cube_meta
+    lats[:] = ul[1] - np.arange(dims[1]) * pixelSize
+    lons[:] = ul[0] + np.arange(dims[0]) * pixelSize
+
+    crs = ds.createVariable('spatial_ref', 'i4')
+    crs.spatial_ref = srs.ExportToWkt()
+
+    time.units = "seconds since " + str(times.to_numpy()[0])
+    time[:] = np.divide(times.to_numpy() - times.to_numpy()[0], 1e+9).astype(np.float64)
+
+    stats = {}
+
+    for v in range(len(names)):
+
+        value = ds.createVariable(names[v], np.dtype(dtype), ('time', 'lat', 'lon',), zlib=compress, chunksizes=chunks)
+        value.code = "EPSG:" + str(SRS)
+        value.missing = nodata
+
+        varStats = new_stats(length)
+
+        for t in range(length):
+            for yoff, xoff, ysize, xsize in grid_windows(dims, blockSize, full=True):
+                block = make_block(t, yoff, xoff, ysize, xsize, dtype, nodata, nodataFraction, noise, period,
+                                   valueScale, [seed, v, t, yoff, xoff])
+                value[t, yoff:yoff + ysize, xoff:xoff + xsize] = block
+                add_stats(varStats, t, block, nodata)
+
+        stats[names[v]] = finish_stats(varStats)
+
+    ds.close()
+
+    out = dict(files=[fileName], time=times, variables=names, stats=stats)
+    write_stats(os.path.splitext(fileName)[0] + "_stats.json", out)
+
+    return out
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+#################################################
+# helper function to check the nodata value against the pixel type, or pick one that fits it
+def check_nodata(nodata, dtype):
+
+    dtype = np.dtype(dtype)
+
+    if dtype.kind in "iu":
+        info = np.iinfo(dtype)
+        if nodata == None:
+            if info.min <= -9999:
+                return -9999
+            return int(info.max) if dtype.kind == "u" else int(info.min)
+        if np.isnan(nodata) or nodata != int(nodata) or nodata < info.min or nodata > info.max:
+            raise ValueError("nodata " + str(nodata) + " does not fit " + str(dtype) + ": use an integer between " +
+                             str(info.min) + " and " + str(info.max))
+        return int(nodata)
+
+    if nodata == None:
+        return -9999
+    if not np.isnan(nodata) and abs(nodata) > float(np.finfo(dtype).max):
+        raise ValueError("nodata " + str(nodata) + " does not fit " + str(dtype))
+
+    return float(nodata)
+
+
+# helper function to make one block of the synthetic pattern
+def make_block(t, yoff, xoff, ysize, xsize, dtype, nodata, nodataFraction, noise, period, valueScale, seed):
+
+    rng = np.random.default_rng(seed)
+
+    rows = np.arange(yoff, yoff + ysize)[:, np.newaxis]
+    cols = np.arange(xoff, xoff + xsize)[np.newaxis, :]
+
+    values = (t + ((rows + cols) % period) / period) * valueScale
+
+    if noise > 0:
+        values = values + rng.normal(0, noise, size=values.shape)
+
+    if np.dtype(dtype).kind in "iu":
+        values = np.round(values)
+
+    values = values.astype(dtype)
+
+    if nodataFraction > 0:
+        values[rng.random(values.shape) < nodataFraction] = nodata
+
+    return values
+
+
+def new_stats(length):
+
+    out = dict(count=np.zeros(length, dtype=np.int64), sum=np.zeros(length), min=np.full(length, np.inf),
+               max=np.full(length, -np.inf))
+
+    return out
+
+
+def add_stats(stats, t, block, nodata):
+
+    if np.isnan(nodata):
+        valid = block[~np.isnan(block)].astype(np.float64)
+    else:
+        valid = block[block != nodata].astype(np.float64)
+
+    if len(valid) > 0:
+        stats["count"][t] += len(valid)
+        stats["sum"][t] += np.sum(valid)
+        stats["min"][t] = min(stats["min"][t], np.min(valid))
+        stats["max"][t] = max(stats["max"][t], np.max(valid))
+
+
+def finish_stats(stats):
+
+    count = stats["count"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = stats["sum"] / count
+
+    out = dict(count=count.tolist(), sum=stats["sum"].tolist(), mean=mean.tolist(), min=stats["min"].tolist(),
+               max=stats["max"].tolist(), total_count=int(np.sum(count)), total_sum=float(np.sum(stats["sum"])))
+
+    return out
+
+
+def write_stats(fileName, out):
+
+    record = dict(out)
+    record["time"] = [str(x) for x in out["time"]]
+
+    with open(fileName, "w") as f:
+        json.dump(record, f, indent=2)
+#################################################
@@ -1,7 +1,9 @@
 from spacetime.objects.fileObject import file_object
 from osgeo import gdal
+from spacetime.objects.tracing import traced, span
 import os
 
+@traced()
 def read_data(dataList=None):
 
     fileData = []
@@ -9,7 +11,8 @@ def read_data(dataList=None):
 
     for i in range(len(dataList)):
 
-        fileData.append(gdal.Open(dataList[i]))
+        with span("open_file", file=str(dataList[i])):
+            fileData.append(gdal.Open(dataList[i]))
 
 
         fileSize.append(os.path.getsize(dataList[i]) * 0.000001)
@@ -6,7 +6,12 @@ import netCDF4 as nc
 import re
 from spacetime.operations.time import cube_time, return_time
 import xarray as xr
-import psutil
+import tempfile
+import os
+from spacetime.objects.tracing import traced
+from spacetime.objects.ioStats import io_stats, read_variable
+from spacetime.objects.memoryPlan import memory_plan
+from spacetime.operations.cubeOverviews import read_overview, get_overview_levels
 
 
 class cube(object):
@@ -21,6 +26,12 @@ class cube(object):
         self.inMemory = inMemory
         self.sizes = fileSize
 
+        # I/O accounting of the reads of this cube
+        self.ioStats = io_stats()
+
+        # the memory plan of the last get_data_array call for each selection of variables
+        self.plans = {}
+
         if self.fileStruc == "filestovar":
             self.ind = self.names[0]
         else:
@@ -53,7 +64,7 @@ class cube(object):
     def get_time(self):
 
         if self.noTime == True:
-            out = self.cubeObj.variables["time"][:]
+            out = read_variable(self.cubeObj.variables["time"], stats=self.ioStats)
 
         else:
             a = self.cubeObj.variables["time"]
@@ -69,11 +80,11 @@ class cube(object):
         return out
 
     def get_lat(self):
-        out = self.cubeObj.variables["lat"][:]
+        out = read_variable(self.cubeObj.variables["lat"], stats=self.ioStats)
         return out
 
     def get_lon(self):
-        out = self.cubeObj.variables["lon"][:]
+        out = read_variable(self.cubeObj.variables["lon"], stats=self.ioStats)
         return out
 
     def get_UL_corner(self):
@@ -103,10 +114,76 @@ class cube(object):
         out = self.cubeObj.variables["spatial_ref"]
         return out
 
+    def get_io_report(self):
+        out = self.ioStats.report()
+        return out
+
+    # the data at the coarsest overview level meeting resolution, or fitting maxSize pixels (see build_overviews)
+    def get_overview(self, resolution=None, maxSize=None, variables=None):
+        out = read_overview(self, resolution=resolution, maxSize=maxSize, variables=variables)
+        return out
+
+    def get_overview_levels(self):
+        out = get_overview_levels(self)
+        return out
+
+    # (min, max) of the valid values, read from the coarsest overview fitting maxSize pixels when the file has
+    # overviews (the range of the overview values), from the full resolution data otherwise or when maxSize is None
+    def get_data_range(self, variables=None, maxSize=512):
+        if maxSize == None:
+            data = self.get_data_array(variables)
+        else:
+            data = read_overview(self, maxSize=maxSize, variables=variables)
+        data = np.ma.filled(np.ma.asarray(data.values).astype(np.float64), np.nan)
+        if self.get_nodata_value() != None:
+            data[data == self.get_nodata_value()] = np.nan
+        if np.isnan(data).all():
+            return tuple([None, None])
+        out = tuple([float(np.nanmin(data)), float(np.nanmax(data))])
+        return out
+
+    # plans how get_data_array holds the data: load, stream from the file or spill to disk
+    def plan_memory(self, variables=None, copies=3):
+
+        names = self.select_names(variables)
+        var = self.cubeObj.variables[names[0]]
+        shape = var.shape + (len(names),)
+
+        plan = memory_plan(shape, dtype=np.result_type(var.dtype, np.float32), copies=copies,
+                           streamable=self.is_streamable(names))
+
+        if self.inMemory == True:
+            plan.mode = "load"
+        elif self.inMemory == False and plan.mode == "load":
+            plan.mode = "stream" if self.is_streamable(names) else "spill"
+
+        return plan
+
+    def get_memory_plan(self, variables=None):
+
+        key = tuple(self.select_names(variables))
+        if key not in self.plans:
+            self.plans[key] = self.plan_memory(variables)
+        out = self.plans[key].report()
+        return out
+
+    @traced("cube.get_data_array")
     def get_data_array(self, variables=None):
 
+        plan = self.plan_memory(variables)
+        self.plans[tuple(self.select_names(variables))] = plan
+
+        if plan.mode == "stream":
+            outMat = self.stream_array()
+            if outMat is not None:
+                return outMat
+            plan.mode = "spill" # the file could not be opened a second time
+
+        if plan.mode == "spill":
+            return self.spill_array(self.select_names(variables), plan.chunkLength)
+
         if self.fileStruc == "filestotime":
-            out = self.cubeObj.variables[self.ind][:]
+            out = self.fill_masked(read_variable(self.cubeObj.variables[self.ind], stats=self.ioStats))
 
             outMat = xr.DataArray(data=out, dims=["time", "lat", "lon"], coords=dict(
                lon=(["lon"], self.get_lon()),
@@ -115,44 +192,112 @@ class cube(object):
 
         if self.fileStruc == "filestovar":
 
+            names = self.select_names(variables)
+
             outList = []
-            for i in range(len(self.names)):
-                outList.append(self.cubeObj.variables[self.names[i]][:])
+            for i in range(len(names)):
+                outList.append(self.fill_masked(read_variable(self.cubeObj.variables[names[i]], stats=self.ioStats)))
 
             intDS = np.array(outList)
 
-            out = xr.DataArray(data=intDS, dims=["variables", "time", "lat", "lon"], coords=dict(
-                  variables = (["variables"], self.names),
+            outMat = xr.DataArray(data=intDS, dims=["variables", "time", "lat", "lon"], coords=dict(
+                  variables = (["variables"], names),
                   lon=(["lon"], self.get_lon()),
                   lat=(["lat"], self.get_lat()),
                   time=self.get_time()))
 
-            # allow selecting of vars
-            if variables == None:
-                outMat = out
-            else:
-                index = [self.names.index(x) for x in variables]
-                outMat = out[index,:,:,:]
+        outMat = outMat.load()
+
+        return outMat
 
-        if self.inMemory == False:
-            outMat = outMat
+    # names of the variables to read, all of them by default
+    def select_names(self, variables=None):
 
-        elif self.inMemory == True:
-            outMat = outMat.load()
+        if self.fileStruc == "filestotime":
+            out = [self.ind]
+        elif variables == None:
+            out = list(self.names)
+        else:
+            out = [self.names[self.names.index(x)] for x in variables]
+
+        return out
 
-        elif self.inMemory == "auto":
-            RAM = psutil.virtual_memory().total / (1024.0 ** 3)
-            fileSize = self.get_file_size()
+    # only single variable cubes written to a file can be read lazily without dask
+    def is_streamable(self, names):
 
-            if fileSize > (.7 * RAM):
-                outMat = outMat
-            else:
-                outMat = outMat.load()
+        if len(names) > 1 or self.fileStruc != "filestotime":
+            return False
+
+        try:
+            out = os.path.isfile(self.cubeObj.filepath())
+        except ValueError:
+            out = False
+
+        return out
+
+    # a lazily indexed array over the file, values are only read when they are used
+    def stream_array(self):
+
+        try:
+            self.cubeObj.sync()
+            ds = xr.open_dataset(self.cubeObj.filepath(), decode_times=False)
+        except (OSError, ValueError, RuntimeError):
+            return None
+
+        outMat = ds[self.ind].assign_coords(
+            lon=np.asarray(self.get_lon()),
+            lat=np.asarray(self.get_lat()),
+            time=self.get_time())
+
+        return outMat
+
+    # copy the variables slab by slab into a memory mapped temporary file
+    def spill_array(self, names, chunkLength):
+
+        first = self.cubeObj.variables[names[0]]
+        dtype = np.result_type(first.dtype, np.float32)
+        shape = (len(names),) + first.shape
+
+        spill = np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode="w+", shape=shape)
+
+        for i in range(len(names)):
+            var = self.cubeObj.variables[names[i]]
+            for t in range(0, shape[1], chunkLength):
+                slab = read_variable(var, slice(t, t + chunkLength), stats=self.ioStats)
+                spill[i, t:t + chunkLength] = self.fill_masked(slab, dtype)
+
+        if self.fileStruc == "filestotime":
+            outMat = xr.DataArray(data=spill[0], dims=["time", "lat", "lon"], coords=dict(
+               lon=(["lon"], self.get_lon()),
+               lat=(["lat"], self.get_lat()),
+               time=self.get_time()))
+        else:
+            outMat = xr.DataArray(data=spill, dims=["variables", "time", "lat", "lon"], coords=dict(
+                  variables = (["variables"], names),
+                  lon=(["lon"], self.get_lon()),
+                  lat=(["lat"], self.get_lat()),
+                  time=self.get_time()))
 
         return outMat
 
+    # values masked by netCDF (never written) hold the nodata value like the stored nodata cells, so every
+    # path of get_data_array returns the same array
+    def fill_masked(self, data, dtype=None):
+
+        data = np.ma.asarray(data)
+        if dtype != None:
+            data = data.astype(dtype)
+
+        nodata = self.get_nodata_value()
+        out = np.ma.filled(data, np.nan if nodata == None else nodata)
+
+        return out
+
     def get_shapeval(self):
 
-        ds = self.get_data_array()
-        shapeVal = len(ds.shape)
-        return shapeVal
\ No newline at end of file
+        # the layout gives the number of dims without reading the data
+        if self.fileStruc == "filestovar":
+            shapeVal = 4
+        else:
+            shapeVal = 3
+        return shapeVal
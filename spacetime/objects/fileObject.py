@@ -2,6 +2,8 @@ from osgeo import gdal
 from osgeo import osr
 import numpy as np
 import netCDF4 as nc
+from spacetime.objects.tracing import traced, span
+from spacetime.objects.ioStats import io_stats, read_band
 
 
 class file_object(object):
@@ -35,6 +37,9 @@ class file_object(object):
 
         self.fileSize = sizes
 
+        # I/O accounting of the reads of this object
+        self.ioStats = io_stats()
+
     # returns a list of gdal or netcdf4 objects
     def get_GDAL_data(self):
 
@@ -166,7 +171,7 @@ class file_object(object):
 
             for j in range(max-min+1):
 
-                band = obj.GetRasterBand(j+1).ReadAsArray()
+                band = read_band(obj.GetRasterBand(j+1), stats=self.ioStats, source=str(id(obj)))
                 tempMat.append(band)
                 #print(j)
 
@@ -238,29 +243,30 @@ class file_object(object):
 
         return self.fileSize
 
+    def get_io_report(self):
+
+        return self.ioStats.report()
 
+
+    @traced("file_object.get_data_array")
     def get_data_array(self): # this is slow (SPEED IT UP)
 
         outList = []
 
         for i in range(len(self.spacetimeObject[0])):
 
-            tempMat = []
-            obj = self.spacetimeObject[0][i]
-
-            for j in range(self.get_band_number()[i]):
+            with span("read_file", index=i):
 
-                import time
-                start = time.time()
+                tempMat = []
+                obj = self.spacetimeObject[0][i]
 
-                band = obj.GetRasterBand(j+1).ReadAsArray()
-                tempMat.append(band)
+                for j in range(self.get_band_number()[i]):
 
-                end = time.time()
-                #print(end - start)
+                    band = read_band(obj.GetRasterBand(j+1), stats=self.ioStats, source=str(id(obj)))
+                    tempMat.append(band)
 
-            outMat = np.stack(tempMat, axis=2)
-            outList.append(outMat)
+                outMat = np.stack(tempMat, axis=2)
+                outList.append(outMat)
 
         return outList
 
@@ -20,6 +20,10 @@ class interum_cube(object):
             self.ind = "value"
             self.names = None
 
+        # results with new variable names (or no structure) take nodata and SRS from the variable of the parent cube
+        if getattr(self, "ind", None) is None or self.ind not in self.cubeObj.variables:
+            self.ind = cube.ind
+
     def get_GDAL_data(self):
         #print("WARNING! Original dataset is no longer of the same dimensions as your working cube. Please write your cube out using the write_cube() to store a .cd4 file of the correct dimensions!")
         out = self.cubeObj
@@ -0,0 +1,284 @@
+from osgeo import gdal
+import numpy as np
+import threading
+from itertools import product
+from collections import OrderedDict
+from spacetime.objects import tracing
+from spacetime.objects.tracing import add_bytes
+
+
+######################################################################################################################
+# DESCRIPTION: I/O accounting for GDAL band reads and netCDF variable slicing. Every read counts the bytes
+# requested, the storage blocks or chunks it touches, and the bytes that had to be decompressed. Cache hits and
+# misses are estimated with a least recently used list of the blocks read, bounded by the size of the cache that
+# serves them (the GDAL block cache or the netCDF chunk cache of the variable): a block still on the list is
+# assumed to be a hit. Counts go to the object's own io_stats and to the session
+#
+# The cache estimate keeps a key for every block read and is off by default: without it chunks are counted
+# arithmetically, every touched chunk is counted as decompressed and hits and misses stay at zero
+#
+# USAGE:
+# cube.get_io_report()          per cube or file_object
+# session_report()              everything read in this session
+# enable_accounting(estimateCache=True)   turn on the hit and miss estimate
+# disable_accounting()          skip the accounting (tracing spans still get their bytes)
+######################################################################################################################
+class io_stats(object):
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+
+        self.readCalls = 0
+        self.bytesRequested = 0
+        self.bytesDecompressed = 0
+        self.chunksTouched = 0
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.cached = OrderedDict()
+        self.cachedBytes = 0
+
+    # count one read touching nBlocks blocks, each holding blockBytes when decompressed. When the block keys are
+    # given the hits and misses are estimated against a cache of cacheBytes
+    def record(self, requested, nBlocks, blockBytes, compressed=True, cacheBytes=None, blocks=None):
+
+        with self.lock:
+
+            self.readCalls += 1
+            self.bytesRequested += requested
+            self.chunksTouched += nBlocks
+
+            if blocks == None:
+                if compressed:
+                    self.bytesDecompressed += nBlocks * blockBytes
+                return
+
+            for b in blocks:
+                if b in self.cached:
+                    self.cacheHits += 1
+                    self.cached.move_to_end(b)
+                else:
+                    self.cacheMisses += 1
+                    self.cached[b] = blockBytes
+                    self.cachedBytes += blockBytes
+                    if compressed:
+                        self.bytesDecompressed += blockBytes
+
+            # evict the least recently read blocks that no longer fit the cache
+            if cacheBytes != None:
+                while self.cachedBytes > cacheBytes and len(self.cached) > 0:
+                    self.cachedBytes -= self.cached.popitem(last=False)[1]
+
+    # add the counts of other, the blocks it remembers stay with it
+    def merge(self, other):
+
+        with self.lock:
+            self.readCalls += other.readCalls
+            self.bytesRequested += other.bytesRequested
+            self.bytesDecompressed += other.bytesDecompressed
+            self.chunksTouched += other.chunksTouched
+            self.cacheHits += other.cacheHits
+            self.cacheMisses += other.cacheMisses
+
+    def report(self):
+
+        touched = self.cacheHits + self.cacheMisses
+
+        out = dict(read_calls=self.readCalls, bytes_requested=self.bytesRequested,
+                   bytes_decompressed=self.bytesDecompressed, chunks_touched=self.chunksTouched,
+                   cache_hits=self.cacheHits, cache_misses=self.cacheMisses,
+                   hit_rate=(self.cacheHits / touched) if touched > 0 else None,
+                   read_amplification=(self.bytesDecompressed / self.bytesRequested) if self.bytesRequested > 0 else None)
+
+        return out
+
+
+# everything read in this session
+SESSION = io_stats()
+
+# accounting switches
+ENABLED = True
+ESTIMATE_CACHE = False
+
+
+def enable_accounting(estimateCache=False):
+
+    global ENABLED, ESTIMATE_CACHE
+
+    ENABLED = True
+    ESTIMATE_CACHE = estimateCache
+
+
+def disable_accounting():
+
+    global ENABLED, ESTIMATE_CACHE
+
+    ENABLED = False
+    ESTIMATE_CACHE = False
+
+
+def session_report():
+
+    return SESSION.report()
+
+
+def reset_session():
+
+    SESSION.reset()
+
+
+
+#################################################
+# helper function to read a window of a GDAL band with accounting
+def read_band(band, xoff=0, yoff=0, xsize=None, ysize=None, stats=None, source=None):
+
+    if xsize == None:
+        xsize = band.XSize - xoff
+    if ysize == None:
+        ysize = band.YSize - yoff
+
+    out = band.ReadAsArray(xoff, yoff, xsize, ysize)
+
+    if not ENABLED:
+        add_bytes(read=out.nbytes)
+        return out
+
+    bx, by = band.GetBlockSize()
+    blockBytes = bx * by * out.itemsize
+
+    # blocks overlapped by the window
+    cols = range(xoff // bx, (xoff + xsize - 1) // bx + 1)
+    rows = range(yoff // by, (yoff + ysize - 1) // by + 1)
+    blocks = None
+    if ESTIMATE_CACHE:
+        if source == None:
+            source = band.GetDataset().GetDescription()
+        blocks = [(source, band.GetBand(), r, c) for r in rows for c in cols]
+
+    for s in [SESSION, stats]:
+        if s != None:
+            s.record(out.nbytes, len(rows) * len(cols), blockBytes, cacheBytes=gdal.GetCacheMax(), blocks=blocks)
+
+    add_bytes(read=out.nbytes)
+
+    return out
+
+
+# helper function to slice a netCDF variable with accounting
+def read_variable(var, key=slice(None), stats=None):
+
+    out = var[key]
+
+    if not ENABLED and tracing.SINK is None:
+        return out
+
+    ranges = index_ranges(key, var.shape)
+    requested = int(np.prod([len(r) for r in ranges])) * var.dtype.itemsize
+    add_bytes(read=requested)
+
+    if not ENABLED:
+        return out
+
+    chunking = var.chunking()
+    source = variable_source(var)
+
+    if chunking == "contiguous" or chunking == None:
+        # contiguous storage is read directly, only the requested bytes move
+        nBlocks = 1
+        blocks = [(source, "contiguous", tuple(index_bounds(r) for r in ranges))] if ESTIMATE_CACHE else None
+        blockBytes = requested
+        compressed = False
+    else:
+        chunkRanges = [chunk_indices(r, c) for r, c in zip(ranges, chunking)]
+        nBlocks = int(np.prod([len(r) for r in chunkRanges]))
+        blocks = [(source,) + idx for idx in product(*chunkRanges)] if ESTIMATE_CACHE else None
+        blockBytes = int(np.prod(chunking)) * var.dtype.itemsize
+        filters = var.filters() or {}
+        compressed = any(bool(v) for k, v in filters.items() if k not in ["fletcher32", "shuffle"])
+
+    for s in [SESSION, stats]:
+        if s != None:
+            s.record(requested, nBlocks, blockBytes, compressed=compressed, cacheBytes=chunk_cache_size(var),
+                     blocks=blocks)
+
+    return out
+
+
+# indices selected on every dimension by a numpy style key, a range for slices and integers and an array for
+# index lists
+def index_ranges(key, shape):
+
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    # expand an ellipsis and pad missing dimensions
+    if any(k is Ellipsis for k in key):
+        i = [k is Ellipsis for k in key].index(True)
+        key = key[:i] + (slice(None),) * (len(shape) - len(key) + 1) + key[i + 1:]
+    key = key + (slice(None),) * (len(shape) - len(key))
+
+    out = []
+    for k, n in zip(key, shape):
+
+        if isinstance(k, slice):
+            out.append(range(*k.indices(n)))
+        elif np.ndim(k) == 0:
+            i = int(k) % n if n > 0 else 0
+            out.append(range(i, i + 1))
+        else:
+            k = np.asarray(k)
+            if k.dtype == bool:
+                k = np.flatnonzero(k)
+            out.append(k.astype(np.int64) % n if n > 0 else k)
+
+    return out
+
+
+# (start, stop) of the indices of one dimension
+def index_bounds(r):
+
+    if len(r) == 0:
+        return (0, 0)
+
+    if isinstance(r, range):
+        return (min(r[0], r[-1]), max(r[0], r[-1]) + 1)
+
+    return (int(np.min(r)), int(np.max(r)) + 1)
+
+
+# chunks of size c holding the indices of one dimension, a stride of at most c touches every chunk in between
+def chunk_indices(r, c):
+
+    if len(r) == 0:
+        return range(0)
+
+    if isinstance(r, range) and abs(r.step) <= c:
+        lo, hi = index_bounds(r)
+        return range(lo // c, (hi - 1) // c + 1)
+
+    return np.unique(np.asarray(r) // c)
+
+
+# bytes of the chunk cache of a netCDF variable, contiguous variables are not cached
+def chunk_cache_size(var):
+
+    try:
+        out = var.get_var_chunk_cache()[0]
+    except (AttributeError, RuntimeError):
+        out = 0
+
+    return out
+
+
+def variable_source(var):
+
+    try:
+        out = var.group().filepath() + ":" + var.name
+    except (ValueError, AttributeError):
+        out = str(id(var.group())) + ":" + var.name
+
+    return out
+#################################################
@@ -0,0 +1,90 @@
+import numpy as np
+import psutil
+
+
+######################################################################################################################
+# DESCRIPTION: memory_plan estimates the in-memory footprint of an operation from its array shape and dtype and
+# checks it against a memory budget. It picks one of three modes:
+#   "load"   the whole array fits in the budget and is read into memory
+#   "stream" the array is read lazily from its file in slabs of chunkLength steps along the first axis
+#   "spill"  the array is copied slab by slab into a memory mapped file on disk and paged from there
+#
+# INPUTS:
+# shape (required): shape of the array the operation works on
+# dtype: type of the values once read (netCDF f4 values are read as masked float32)
+# copies: number of full copies the operation makes (the read, stacking, where/resample results, ...)
+# masked: if True a one byte mask per value is counted, like netCDF4 masked arrays
+# budget: memory budget in bytes. Defaults to the configured budget (see set_memory_budget)
+# streamable: if False the data cannot be read lazily from a file, so "spill" is used instead of "stream"
+#
+# OUTPUT:
+# a memory_plan object. report() returns the plan as a dict
+######################################################################################################################
+
+# fixed budget in bytes, None uses BUDGET_FRACTION of the available memory
+MEMORY_BUDGET = None
+BUDGET_FRACTION = 0.5
+
+
+class memory_plan(object):
+
+    def __init__(self, shape, dtype="float32", copies=3, masked=True, budget=None, streamable=True):
+
+        if budget == None:
+            budget = get_memory_budget()
+
+        self.shape = tuple(int(x) for x in shape)
+        self.dtype = np.dtype(dtype)
+        self.copies = copies
+        self.budget = int(budget)
+
+        itemSize = self.dtype.itemsize + (1 if masked else 0)
+        self.values = int(np.prod(self.shape)) if len(self.shape) > 0 else 1
+        self.bytesPerCopy = self.values * itemSize
+        self.footprint = self.bytesPerCopy * copies
+
+        # bytes of one step along the first axis for all copies
+        stepBytes = max(1, self.footprint // max(1, self.shape[0] if len(self.shape) > 0 else 1))
+        self.chunkLength = int(max(1, min(self.shape[0] if len(self.shape) > 0 else 1, self.budget // stepBytes)))
+
+        if self.footprint <= self.budget:
+            self.mode = "load"
+        elif streamable:
+            self.mode = "stream"
+        else:
+            self.mode = "spill"
+
+    def report(self):
+
+        out = dict(mode=self.mode, shape=self.shape, dtype=str(self.dtype), copies=self.copies,
+                   footprint=self.footprint, budget=self.budget, chunk_length=self.chunkLength)
+
+        return out
+
+    def __repr__(self):
+
+        return (f"memory_plan(mode={self.mode}, footprint={self.footprint / 1024 ** 2:.1f} MB, "
+                f"budget={self.budget / 1024 ** 2:.1f} MB, chunk_length={self.chunkLength})")
+
+
+
+#################################################
+# set the memory budget in bytes, or as a fraction of the available memory
+def set_memory_budget(budget=None, fraction=None):
+
+    global MEMORY_BUDGET, BUDGET_FRACTION
+
+    MEMORY_BUDGET = budget
+    if fraction != None:
+        BUDGET_FRACTION = fraction
+
+
+def get_memory_budget():
+
+    if MEMORY_BUDGET != None:
+        out = MEMORY_BUDGET
+    else:
+        out = BUDGET_FRACTION * psutil.virtual_memory().available
+
+    return int(out)
+#################################################
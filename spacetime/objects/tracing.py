@@ -0,0 +1,279 @@
+import functools
+import threading
+import itertools
+import tracemalloc
+import json
+import time
+import os
+
+
+######################################################################################################################
+# DESCRIPTION: a lightweight tracing layer. Public spacetime functions open named spans that record wall time,
+# CPU time, bytes read and written and (optionally) net array allocations, with nested spans for substeps such as
+# per-file reads. Finished spans go to a pluggable sink. With no sink set, traced functions are called directly
+#
+# USAGE:
+# from spacetime.objects.tracing import enable, memory_sink
+# sink = enable(memory_sink())
+# ... run spacetime functions ...
+# sink.summary()
+#
+# or without touching code: SPACETIME_TRACE=trace.jsonl (JSON lines) or SPACETIME_TRACE=chrome:trace.json
+# (Chrome trace format, open in chrome://tracing or Perfetto)
+######################################################################################################################
+
+# active sink, None means tracing is off
+SINK = None
+
+# record net tracemalloc allocations of every span
+TRACK_ALLOCATIONS = False
+
+IDS = itertools.count(1)
+LOCAL = threading.local()
+
+
+class span(object):
+
+    def __init__(self, name, **attrs):
+
+        self.name = name
+        self.attrs = attrs
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.active = False
+
+    def __enter__(self):
+
+        if SINK is None:
+            return self
+
+        stack = get_stack()
+
+        self.active = True
+        self.id = next(IDS)
+        self.parent = stack[-1].id if len(stack) > 0 else None
+        self.thread = threading.get_ident()
+        self.start = time.time()
+        self.wallStart = time.perf_counter()
+        self.cpuStart = time.process_time()
+
+        if TRACK_ALLOCATIONS and tracemalloc.is_tracing():
+            self.allocStart = tracemalloc.get_traced_memory()[0]
+
+        stack.append(self)
+
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+
+        if self.active == False:
+            return False
+
+        wall = time.perf_counter() - self.wallStart
+        cpu = time.process_time() - self.cpuStart
+
+        stack = get_stack()
+        if len(stack) > 0 and stack[-1] is self:
+            stack.pop()
+
+        record = dict(name=self.name, id=self.id, parent=self.parent, thread=self.thread, start=self.start,
+                      wall=wall, cpu=cpu, bytes_read=self.bytesRead, bytes_written=self.bytesWritten)
+
+        if TRACK_ALLOCATIONS and tracemalloc.is_tracing():
+            record["alloc_bytes"] = tracemalloc.get_traced_memory()[0] - self.allocStart
+
+        if excType is not None:
+            record["error"] = excType.__name__
+
+        if len(self.attrs) > 0:
+            record["attrs"] = self.attrs
+
+        sink = SINK
+        if sink is not None:
+            sink.emit(record)
+
+        return False
+
+    # count bytes moved by this span
+    def add(self, bytesRead=0, bytesWritten=0):
+
+        self.bytesRead += bytesRead
+        self.bytesWritten += bytesWritten
+
+
+
+#################################################
+# decorator that runs a function inside a span named after it
+def traced(name=None):
+
+    def wrap(func):
+
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+
+            if SINK is None:
+                return func(*args, **kwargs)
+
+            with span(label):
+                return func(*args, **kwargs)
+
+        return inner
+
+    return wrap
+
+
+# add bytes to the innermost open span of this thread (does nothing when tracing is off)
+def add_bytes(read=0, written=0):
+
+    if SINK is None:
+        return
+
+    stack = get_stack()
+    if len(stack) > 0:
+        stack[-1].add(bytesRead=read, bytesWritten=written)
+
+
+def get_stack():
+
+    if not hasattr(LOCAL, "stack"):
+        LOCAL.stack = []
+
+    return LOCAL.stack
+
+
+# turn tracing on with a sink (a memory_sink by default) and return the sink
+def enable(sink=None, allocations=False):
+
+    global SINK, TRACK_ALLOCATIONS
+
+    if sink is None:
+        sink = memory_sink()
+
+    TRACK_ALLOCATIONS = allocations
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    SINK = sink
+
+    return sink
+
+
+def disable():
+
+    global SINK, TRACK_ALLOCATIONS
+
+    sink = SINK
+    SINK = None
+
+    if TRACK_ALLOCATIONS and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    TRACK_ALLOCATIONS = False
+
+    if sink is not None:
+        sink.close()
+
+    return sink
+#################################################
+
+
+
+#################################################
+# sinks
+class memory_sink(object):
+
+    def __init__(self):
+
+        self.records = []
+        self.lock = threading.Lock()
+
+    def emit(self, record):
+
+        with self.lock:
+            self.records.append(record)
+
+    def close(self):
+        pass
+
+    # totals per span name: calls, wall, cpu and bytes
+    def summary(self):
+
+        out = {}
+        for r in self.records:
+
+            if r["name"] not in out:
+                out[r["name"]] = dict(calls=0, wall=0.0, cpu=0.0, bytes_read=0, bytes_written=0)
+
+            s = out[r["name"]]
+            s["calls"] += 1
+            s["wall"] += r["wall"]
+            s["cpu"] += r["cpu"]
+            s["bytes_read"] += r["bytes_read"]
+            s["bytes_written"] += r["bytes_written"]
+
+        return out
+
+
+class jsonl_sink(object):
+
+    def __init__(self, fileName):
+
+        self.file = open(fileName, "a")
+        self.lock = threading.Lock()
+
+    def emit(self, record):
+
+        with self.lock:
+            self.file.write(json.dumps(record, default=str) + "\n")
+            self.file.flush()
+
+    def close(self):
+
+        self.file.close()
+
+
+class chrome_sink(object):
+
+    def __init__(self, fileName):
+
+        self.fileName = fileName
+        self.events = []
+        self.lock = threading.Lock()
+
+    def emit(self, record):
+
+        args = dict(cpu=record["cpu"], bytes_read=record["bytes_read"], bytes_written=record["bytes_written"])
+        if "alloc_bytes" in record:
+            args["alloc_bytes"] = record["alloc_bytes"]
+        if "attrs" in record:
+            args.update(record["attrs"])
+
+        event = dict(name=record["name"], ph="X", ts=record["start"] * 1e6, dur=record["wall"] * 1e6,
+                     pid=os.getpid(), tid=record["thread"], args=args)
+
+        with self.lock:
+            self.events.append(event)
+
+    def close(self):
+
+        with self.lock:
+            with open(self.fileName, "w") as f:
+                json.dump(dict(traceEvents=self.events), f, default=str)
+#################################################
+
+
+
+# tracing switched on from the environment
+if os.environ.get("SPACETIME_TRACE"):
+
+    import atexit
+
+    target = os.environ["SPACETIME_TRACE"]
+
+    if target.startswith("chrome:"):
+        enable(chrome_sink(target[len("chrome:"):]))
+    else:
+        enable(jsonl_sink(target))
+
+    atexit.register(disable)
@@ -1,7 +1,12 @@
 import numpy as np
 import netCDF4 as nc
+from spacetime.objects.tracing import traced
+from spacetime.operations.cubeOverviews import array_overviews
 
-def write_netcdf(cube, dataset, fileName, organizeFiles, organizeBands, vars=None, timeObj=None):
+# overviews: factors of the reduced resolution levels (see build_overviews) computed from the arrays as they are written
+@traced()
+def write_netcdf(cube, dataset, fileName, organizeFiles, organizeBands, vars=None, timeObj=None, overviews=None,
+                 overviewMethod="mean"):
 
     ds = nc.Dataset(fileName, 'w', format='NETCDF4')
 
@@ -49,12 +54,17 @@ def write_netcdf(cube, dataset, fileName, organizeFiles, organizeBands, vars=Non
 
             # is it a list of arrays or a dictionary (XARRAY)
             if "<class 'dict'>" in str(type(dataset)):
-                ds.variables[vars[i]][:] = np.moveaxis(dataset[vars[i]], 2, 0)
+                values = np.moveaxis(dataset[vars[i]], 2, 0)
             else:
                 if numVars < 3:
-                    ds.variables[vars[i]][:] = dataset[i]
+                    values = dataset[i]
                 else:
-                    ds.variables[vars[i]][:] = np.moveaxis(dataset[i], 2, 0)
+                    values = np.moveaxis(dataset[i], 2, 0)
+
+            ds.variables[vars[i]][:] = values
+
+            if overviews != None:
+                array_overviews(ds, vars[i], values, overviews, overviewMethod)
 
 
         if str(type(timeObj)) == "<class 'numpy.ndarray'>":
@@ -92,6 +102,9 @@ def write_netcdf(cube, dataset, fileName, organizeFiles, organizeBands, vars=Non
         # create the main variables
         ds.variables['value'][:] = dataset
 
+        if overviews != None:
+            array_overviews(ds, 'value', dataset, overviews, overviewMethod)
+
         if str(type(timeObj)) == "<class 'numpy.ndarray'>":
             ds.variables['time'][:] = timeObj
         else:
@@ -112,3 +125,54 @@ def write_netcdf(cube, dataset, fileName, organizeFiles, organizeBands, vars=Non
 
 
 
+
+
+
+#################################################
+# helper function to create an empty cube file laid out like write_netcdf output, so that operations can write
+# their results into it block by block. lat and lon hold the upper left corner of each pixel. Returns the open
+# dataset with one (time, lat, lon) variable per name
+def create_netcdf(fileName, lat, lon, timeObj, names, spatialRef, code, nodata=-9999, chunks=None, compress=False,
+                  dtype="f4"):
+
+    ds = nc.Dataset(fileName, 'w', format='NETCDF4')
+
+    ds.createDimension('time', len(timeObj))
+    ds.createDimension('lat', len(lat))
+    ds.createDimension('lon', len(lon))
+
+    time = ds.createVariable('time', 'float64', ('time',))
+    lats = ds.createVariable('lat', 'f4', ('lat',))
+    lons = ds.createVariable('lon', 'f4', ('lon',))
+
+    lons.units = "degrees_east"
+    lons.standard_name = "longitude"
+    lons.axis = "X"
+
+    lats.units = "degrees_north"
+    lats.standard_name = "latitude"
+    lats.axis = "Y"
+
+    lats[:] = np.asarray(lat)
+    lons[:] = np.asarray(lon)
+
+    crs = ds.createVariable('spatial_ref', 'i4')
+    crs.spatial_ref = spatialRef
+
+    if isinstance(timeObj, np.ndarray):
+        time[:] = timeObj
+    else:
+        times = np.asarray(timeObj.to_numpy())
+        time.units = "seconds since " + str(times[0])
+        time[:] = (times - times[0]) / np.timedelta64(1, "s")
+
+    if nodata == None:
+        nodata = -9999
+
+    for name in names:
+        value = ds.createVariable(name, dtype, ('time', 'lat', 'lon',), zlib=compress, chunksizes=chunks)
+        value.code = code
+        value.missing = nodata
+
+    return ds
+#################################################
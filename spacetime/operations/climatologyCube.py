@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import threading
+import tempfile
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from spacetime.operations.cubeStream import cube_reader
+from spacetime.operations.reduceCube import REDUCE_OPS, new_partials, array_partials, merge_partials, finish_partials
+from spacetime.operations.loadCube import load_cube
+from spacetime.objects.writeNETCDF import create_netcdf
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: climatology_cube computes per pixel statistics of every calendar group (month, day of year or
+# season) in one streaming pass. Blocks of whole storage chunks are split by group and their partials merged into
+# the running totals of each group, so the cube is never loaded. Nodata values are skipped and groups with fewer
+# than minCount valid values are NaN
+#
+# INPUTS:
+# cube (required): a cube or interum_cube with dates on its time axis
+# by: "month", "dayofyear" or "season" (DJF, MAM, JJA, SON)
+# ops: statistic or list of statistics, any of "mean", "sum", "min", "max", "std", "var" and "count"
+# minCount: fewest valid values a pixel needs in a group
+# workers: number of threads reducing blocks
+# budget: memory budget in bytes for the blocks in flight, defaults to the configured memory budget
+#
+# OUTPUT:
+# an xarray Dataset with one variable per statistic over (by, lat, lon), with variables first for filestovar cubes
+######################################################################################################################
+
+CLIMATOLOGY_GROUPS = ["month", "dayofyear", "season"]
+SEASONS = ["DJF", "MAM", "JJA", "SON"]
+
+
+@traced()
+def climatology_cube(cube, by="month", ops=["mean", "std", "count"], minCount=1, workers=4, budget=None):
+
+    if by not in CLIMATOLOGY_GROUPS:
+        raise ValueError("by must be one of " + str(CLIMATOLOGY_GROUPS))
+    if isinstance(ops, str):
+        ops = [ops]
+    for o in ops:
+        if o not in REDUCE_OPS:
+            raise ValueError("ops must be among " + str(REDUCE_OPS) + ", got " + str(o))
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    reader = cube_reader(cube)
+    T, Y, X = reader.shape
+
+    labels, groups = calendar_groups(reader.get_time(), by)
+    blocks = reader.blocks(budget // (max(1, workers) * 4))
+
+    results = []
+    for v in range(len(reader.names)):
+
+        total = new_partials((len(groups), Y, X))
+
+        def block_groups(block):
+
+            with span("climatology_block"):
+                data = reader.read(v, *block)
+                blockLabels = labels[block[0]]
+                parts = [(g, array_partials(data[blockLabels == g], (0,))) for g in np.unique(blockLabels)]
+
+            return block, parts
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+
+            futures = [pool.submit(block_groups, b) for b in blocks]
+
+            for f in as_completed(futures):
+                block, parts = f.result()
+                for g, part in parts:
+                    merge_partials(total, part, (g, block[1], block[2]))
+
+        stats = finish_partials(total, ops, 0)
+        for o in ops:
+            if o != "count":
+                stats[o] = np.where(total["count"] >= minCount, stats[o], np.nan)
+
+        results.append(stats)
+
+    coords = {by: groups, "lat": reader.get_lat(), "lon": reader.get_lon()}
+    dims = [by, "lat", "lon"]
+
+    if cube.get_var_names() is not None:
+        coords["variables"] = reader.names
+        dataVars = dict((o, (["variables"] + dims, np.stack([r[o] for r in results]))) for o in ops)
+    else:
+        dataVars = dict((o, (dims, results[0][o])) for o in ops)
+
+    out = xr.Dataset(dataVars, coords=coords, attrs=dict(groupby=by))
+
+    return out
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+######################################################################################################################
+# DESCRIPTION: anomaly_cube subtracts the climatology of each time step's calendar group from a cube, optionally
+# dividing by the group standard deviation, and streams the result to a netCDF cube block by block
+#
+# INPUTS:
+# cube (required): a cube or interum_cube with dates on its time axis
+# climatology: a Dataset from climatology_cube (with "mean", and "std" to standardize). Computed when None
+# by: calendar grouping used when the climatology is computed here
+# standardize: if True anomalies are divided by the group standard deviation (z-scores)
+# fileName: path of the output .nc file, defaults to a temporary file
+# workers: number of threads processing blocks
+# budget: memory budget in bytes for the blocks in flight, defaults to the configured memory budget
+#
+# OUTPUT:
+# a cube of the anomalies with the time steps and variables of the input
+######################################################################################################################
+@traced()
+def anomaly_cube(cube, climatology=None, by="month", standardize=False, fileName=None, workers=4, budget=None):
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    if climatology is None:
+        ops = ["mean", "std"] if standardize else ["mean"]
+        climatology = climatology_cube(cube, by=by, ops=ops, workers=workers, budget=budget)
+
+    by = climatology.attrs.get("groupby", by)
+    if standardize and "std" not in climatology:
+        raise ValueError("standardized anomalies need a climatology with 'std'.")
+
+    reader = cube_reader(cube)
+    T, Y, X = reader.shape
+    time = reader.get_time()
+
+    labels, groups = calendar_groups(time, by)
+    if len(groups) != climatology.sizes[by]:
+        raise ValueError("the climatology does not have the calendar groups of the cube.")
+
+    nodata = reader.nodata
+    if nodata == None:
+        nodata = -9999
+
+    if fileName == None:
+        handle, fileName = tempfile.mkstemp(prefix="spacetime_anomaly_", suffix=".nc")
+        os.close(handle)
+
+    ds = create_netcdf(fileName, reader.get_lat(), reader.get_lon(), time, reader.names,
+                       cube.get_spatial_ref().spatial_ref, cube.get_epsg_code(), nodata=nodata, chunks=reader.chunks)
+
+    # netCDF4 is not thread safe, so reads and writes share one lock
+    lock = threading.Lock()
+    reader.lock = lock
+
+    multi = "variables" in climatology.dims
+    blocks = reader.blocks(budget // (max(1, workers) * 6))
+
+    def write_block(job):
+
+        v, block = job
+
+        with span("anomaly_block"):
+
+            data = reader.read(v, *block)
+            g = labels[block[0]]
+
+            mean = climatology["mean"].values[v] if multi else climatology["mean"].values
+            result = data - mean[:, block[1], block[2]][g]
+
+            if standardize:
+                std = climatology["std"].values[v] if multi else climatology["std"].values
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    result = result / std[:, block[1], block[2]][g]
+                result[~np.isfinite(result)] = np.nan
+
+            result = np.where(np.isnan(result), nodata, result)
+
+            with lock:
+                ds.variables[reader.names[v]][block] = result
+
+    jobs = [(v, b) for v in range(len(reader.names)) for b in blocks]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(write_block, jobs))
+
+    ds.close()
+
+    return load_cube(fileName)
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+#################################################
+# helper function to label each time step with the index of its calendar group, and list the groups
+def calendar_groups(time, by):
+
+    if not isinstance(time, pd.DatetimeIndex):
+        raise ValueError("calendar groups need a cube with dates on its time axis.")
+
+    if by == "month":
+        labels = np.asarray(time.month) - 1
+        groups = np.arange(1, 13)
+    elif by == "dayofyear":
+        labels = np.asarray(time.dayofyear) - 1
+        groups = np.arange(1, 367)
+    else:
+        labels = (np.asarray(time.month) % 12) // 3
+        groups = np.array(SEASONS)
+
+    return labels, groups
+#################################################
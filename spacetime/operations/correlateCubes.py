@@ -0,0 +1,250 @@
+import numpy as np
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from spacetime.operations.cubeStream import cube_reader, tile_size
+from spacetime.objects.interumCube import interum_cube
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: per pixel association between the time series of two aligned cubes, optionally at time lags.
+# Pearson correlation and covariance accumulate co-moments (count, means, squared and cross deviations) of the
+# pairs where both cubes are valid over chunks of time, merged with the pairwise update of Chan et al., so memory
+# does not grow with the length of the series. Spearman correlation needs the ranks of whole series and streams
+# over spatial tiles instead
+#
+# INPUTS:
+# cubeA (required): a cube or interum_cube
+# cubeB (required): a cube or interum_cube on the same grid and time steps
+# method: "pearson", "spearman" or "covariance"
+# lags: lag or list of lags in time steps. At lag L the value of cubeA at t is paired with cubeB at t + L
+# variableA, variableB: names of the variables to use for filestovar cubes, the first ones by default
+# minPairs: fewest valid pairs a pixel needs for a result
+# ddof: delta degrees of freedom of the covariance
+# workers: number of threads processing blocks
+# budget: memory budget in bytes for the blocks in flight, defaults to the configured memory budget
+#
+# OUTPUT:
+# a map cube: an interum_cube with one time step and a variable <method>_lag<L> per lag plus count_lag<L>, the
+# number of valid pairs
+######################################################################################################################
+
+CORRELATION_METHODS = ["pearson", "spearman", "covariance"]
+
+
+@traced()
+def correlate_cubes(cubeA, cubeB, method="pearson", lags=0, variableA=None, variableB=None, minPairs=3, ddof=1,
+                    workers=4, budget=None):
+
+    if method not in CORRELATION_METHODS:
+        raise ValueError("method must be one of " + str(CORRELATION_METHODS))
+
+    if np.ndim(lags) == 0:
+        lags = [lags]
+    lags = [int(x) for x in lags]
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    readerA = cube_reader(cubeA)
+    readerB = cube_reader(cubeB)
+
+    if readerA.shape != readerB.shape:
+        raise ValueError("the cubes must be aligned: " + str(readerA.shape) + " and " + str(readerB.shape))
+
+    # netCDF4 is not thread safe, so the reads of both cubes share one lock
+    readerB.lock = readerA.lock
+
+    a = 0 if variableA == None else readerA.names.index(variableA)
+    b = 0 if variableB == None else readerB.names.index(variableB)
+
+    if method == "spearman":
+        totals = spearman_tiles(readerA, readerB, a, b, lags, workers, budget)
+    else:
+        totals = comoment_blocks(readerA, readerB, a, b, lags, workers, budget)
+
+    T, Y, X = readerA.shape
+    nodata = readerA.nodata
+    if nodata == None:
+        nodata = -9999
+
+    names = []
+    layers = []
+    for L in lags:
+
+        t = totals[L]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if method == "covariance":
+                value = t["cxy"] / (t["n"] - ddof)
+            else:
+                value = t["cxy"] / np.sqrt(t["m2x"] * t["m2y"])
+
+        value = np.where(t["n"] >= max(2, minPairs), value, np.nan)
+
+        names += [method + "_lag" + str(L), "count_lag" + str(L)]
+        layers += [np.where(np.isnan(value), nodata, value), t["n"]]
+
+    array = xr.DataArray(data=np.array(layers, dtype=np.float32)[:, None], dims=["variables", "time", "lat", "lon"],
+                         coords=dict(
+                             variables=(["variables"], names),
+                             lon=(["lon"], readerA.get_lon()),
+                             lat=(["lat"], readerA.get_lat()),
+                             time=readerA.get_time()[:1]))
+
+    ret = interum_cube(cube = cubeA, array = array, structure = True)
+
+    return ret
+
+
+
+#################################################
+# helper functions for co-moments
+def new_comoments(shape):
+
+    out = dict(n=np.zeros(shape), mx=np.zeros(shape), my=np.zeros(shape), m2x=np.zeros(shape), m2y=np.zeros(shape),
+               cxy=np.zeros(shape))
+
+    return out
+
+
+# co-moments over the first axis of the pairs where x and y are both valid
+def comoments(x, y):
+
+    valid = ~(np.isnan(x) | np.isnan(y))
+    n = valid.sum(axis=0).astype(np.float64)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mx = np.where(valid, x, 0).sum(axis=0) / n
+        my = np.where(valid, y, 0).sum(axis=0) / n
+
+    dx = np.where(valid, x - mx, 0)
+    dy = np.where(valid, y - my, 0)
+
+    out = dict(n=n, mx=np.nan_to_num(mx), my=np.nan_to_num(my), m2x=(dx * dx).sum(axis=0),
+               m2y=(dy * dy).sum(axis=0), cxy=(dx * dy).sum(axis=0))
+
+    return out
+
+
+# merge the co-moments of a block into the totals over window
+def merge_comoments(total, part, window):
+
+    na = total["n"][window]
+    nb = part["n"]
+    n = na + nb
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        w = np.where(n > 0, na * nb / n, 0)
+        f = np.where(n > 0, nb / n, 0)
+
+    dx = part["mx"] - total["mx"][window]
+    dy = part["my"] - total["my"][window]
+
+    total["m2x"][window] = total["m2x"][window] + part["m2x"] + dx * dx * w
+    total["m2y"][window] = total["m2y"][window] + part["m2y"] + dy * dy * w
+    total["cxy"][window] = total["cxy"][window] + part["cxy"] + dx * dy * w
+    total["mx"][window] = total["mx"][window] + dx * f
+    total["my"][window] = total["my"][window] + dy * f
+    total["n"][window] = n
+
+
+# pearson and covariance: blocks of time read once from each cube and paired at every lag
+def comoment_blocks(readerA, readerB, a, b, lags, workers, budget):
+
+    T, Y, X = readerA.shape
+    lo, hi = min(lags), max(lags)
+
+    totals = dict((L, new_comoments((Y, X))) for L in lags)
+
+    # a block of cubeA and the longer matching block of cubeB
+    blocks = readerA.blocks(budget // (max(1, workers) * 8))
+
+    def block_comoments(block):
+
+        ts, ys, xs = block
+
+        with span("comoment_block"):
+
+            x = readerA.read(a, ts, ys, xs)
+            b0, b1 = max(0, ts.start + lo), min(T, ts.stop + hi)
+            y = readerB.read(b, slice(b0, b1), ys, xs) if b1 > b0 else None
+
+            parts = []
+            for L in lags:
+                # steps t of the block whose partner t + L is in the cube
+                t0, t1 = max(ts.start, -L), min(ts.stop, T - L)
+                if t1 <= t0:
+                    continue
+                parts.append((L, comoments(x[t0 - ts.start:t1 - ts.start], y[t0 + L - b0:t1 + L - b0])))
+
+        return block, parts
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        futures = [pool.submit(block_comoments, blk) for blk in blocks]
+
+        for f in as_completed(futures):
+            block, parts = f.result()
+            for L, part in parts:
+                merge_comoments(totals[L], part, (block[1], block[2]))
+
+    return totals
+
+
+# spearman: spatial tiles of whole series, ranked over the valid pairs of each lag
+def spearman_tiles(readerA, readerB, a, b, lags, workers, budget):
+
+    T, Y, X = readerA.shape
+
+    totals = dict((L, new_comoments((Y, X))) for L in lags)
+
+    def run_tile(tile):
+
+        ys, xs = tile
+
+        with span("spearman_tile"):
+
+            x = readerA.read(a, slice(None), ys, xs)
+            y = readerB.read(b, slice(None), ys, xs)
+
+            for L in lags:
+                xs_ = x[max(0, -L):T - max(0, L)]
+                ys_ = y[max(0, L):T - max(0, -L)]
+
+                pairs = np.isnan(xs_) | np.isnan(ys_)
+                rx = rank_series(np.where(pairs, np.nan, xs_))
+                ry = rank_series(np.where(pairs, np.nan, ys_))
+
+                part = comoments(rx, ry)
+                for k in part:
+                    totals[L][k][ys, xs] = part[k]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run_tile, readerA.spatial_tiles(tile_size(T, budget, workers, copies=12))))
+
+    return totals
+
+
+# ranks (1 to n) along the first axis with ties given their average rank, NaN stays NaN
+def rank_series(data):
+
+    # NaN sorts last, so the valid values of a series take the first ranks
+    order = np.argsort(data, axis=0, kind="mergesort")
+    ordered = np.take_along_axis(data, order, axis=0)
+
+    position = np.arange(1, data.shape[0] + 1, dtype=np.float64).reshape((-1,) + (1,) * (data.ndim - 1))
+    position = np.broadcast_to(position, data.shape)
+
+    # first and last position of every run of equal values
+    change = ordered[1:] != ordered[:-1]
+    edge = np.ones((1,) + data.shape[1:], dtype=bool)
+    first = np.maximum.accumulate(np.where(np.concatenate([edge, change]), position, 0), axis=0)
+    last = np.minimum.accumulate(np.where(np.concatenate([change, edge]), position, np.inf)[::-1], axis=0)[::-1]
+
+    out = np.empty(data.shape)
+    np.put_along_axis(out, order, (first + last) / 2, axis=0)
+    out[np.isnan(data)] = np.nan
+
+    return out
+#################################################
@@ -0,0 +1,299 @@
+import numpy as np
+import xarray as xr
+import os
+from spacetime.operations.cubeStream import cube_reader
+from spacetime.objects.ioStats import read_variable
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: build_overviews adds reduced resolution copies of a cube to its file as netCDF groups named
+# overview_<factor> (overview_2, overview_4, ...). Every group holds lat, lon and the cube variables at 1/factor of
+# the resolution, where each pixel summarizes a factor x factor window of valid values. All levels are computed
+# from the full resolution data in one streaming pass over row bands, so the whole cube is never loaded. make_cube
+# does not use it: write_netcdf downsamples the arrays it writes (array_overviews), so new files are not read back
+#
+# INPUTS:
+# cube (required): a cube whose netCDF file is open for writing (as make_cube leaves it), or the path of a cube file,
+# which is opened for appending and closed again. netCDF cannot open a file for writing while it is open read only,
+# so cubes from load_cube have to be closed and passed by their path
+# factors: list of integer reduction factors
+# method: "mean" for continuous data, "mode" for classes or "max"
+# budget: memory budget in bytes, defaults to the configured memory budget
+#
+# OUTPUT:
+# the list of overview factors in the file
+######################################################################################################################
+
+OVERVIEW_METHODS = ["mean", "mode", "max"]
+
+
+@traced()
+def build_overviews(cube, factors=[2, 4, 8, 16], method="mean", budget=None):
+
+    factors = check_overviews(factors, method)
+
+    if isinstance(cube, (str, os.PathLike)):
+        # cubeObject imports this module, so load_cube is imported here
+        from spacetime.operations.loadCube import load_cube
+        local = load_cube(cube, mode="a")
+        try:
+            return build_overviews(local, factors=factors, method=method, budget=budget)
+        finally:
+            local.get_GDAL_data().close()
+
+    if "interum_cube" in str(type(cube)):
+        raise ValueError("overviews are stored in the cube file, write the interum_cube out with make_cube first.")
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    ds = writable_dataset(cube, dict(overview_method=method))
+    reader = cube_reader(cube)
+    T, Y, X = reader.shape
+    nodata = reader.nodata if reader.nodata != None else -9999
+
+    lat = reader.get_lat()
+    lon = reader.get_lon()
+    code = cube.get_epsg_code()
+
+    groups = overview_groups(ds, factors, method, reader.names, lat, lon, code, nodata)
+
+    # row bands that every factor divides, and the time steps of a band that fit the budget
+    band = int(np.lcm.reduce(factors))
+    stepBytes = band * X * 8 * 4
+    slab = int(max(1, min(T, budget // stepBytes)))
+
+    for v in range(len(reader.names)):
+        for t0 in range(0, T, slab):
+            for y0 in range(0, Y, band):
+
+                with span("overview_band"):
+
+                    data = reader.read(v, slice(t0, min(T, t0 + slab)), slice(y0, y0 + band))
+
+                    for f in factors:
+                        out = downsample(data, f, method)
+                        out = np.where(np.isnan(out), nodata, out)
+                        groups[f].variables[reader.names[v]][t0:t0 + out.shape[0], y0 // f:y0 // f + out.shape[1], :] = out
+
+    levels = get_overview_levels(cube)
+    ds.overviews = ",".join(str(f) for f in levels)
+    ds.sync()
+
+    return levels
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+######################################################################################################################
+# DESCRIPTION: read_overview reads a cube at the coarsest stored level that still meets a requested resolution,
+# or at the finest level that fits a pixel size limit (e.g. the width of a plot). Without a matching overview the
+# full resolution data is read
+#
+# INPUTS:
+# cube (required): a cube with overviews from build_overviews
+# resolution: the coarsest pixel size, in cube units, that is good enough
+# maxSize: the largest number of pixels wanted along lat and lon
+# variables: names of the variables to read for filestovar cubes, all by default
+#
+# OUTPUT:
+# an xarray DataArray shaped like get_data_array output, with the overview factor in its attributes
+######################################################################################################################
+@traced()
+def read_overview(cube, resolution=None, maxSize=None, variables=None):
+
+    factor = choose_level(get_overview_levels(cube), float(cube.get_pixel_size()), cube.get_dims(), resolution, maxSize)
+
+    if factor == 1:
+        out = cube.get_data_array(variables)
+        out.attrs["overview"] = 1
+        return out
+
+    g = cube.get_GDAL_data().groups["overview_" + str(factor)]
+    names = cube.select_names(variables)
+
+    lat = read_variable(g.variables["lat"], stats=cube.ioStats)
+    lon = read_variable(g.variables["lon"], stats=cube.ioStats)
+
+    if cube.fileStruc == "filestotime":
+        out = xr.DataArray(data=read_variable(g.variables[names[0]], stats=cube.ioStats), dims=["time", "lat", "lon"],
+                           coords=dict(lon=(["lon"], lon), lat=(["lat"], lat), time=cube.get_time()))
+    else:
+        outList = [read_variable(g.variables[n], stats=cube.ioStats) for n in names]
+        out = xr.DataArray(data=np.array(outList), dims=["variables", "time", "lat", "lon"], coords=dict(
+              variables=(["variables"], names),
+              lon=(["lon"], lon),
+              lat=(["lat"], lat),
+              time=cube.get_time()))
+
+    out.attrs["overview"] = factor
+
+    return out
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+#################################################
+# helper functions for overviews
+def get_overview_levels(cube):
+
+    out = dataset_levels(cube.get_GDAL_data())
+
+    return out
+
+
+def dataset_levels(ds):
+
+    out = sorted(int(g[len("overview_"):]) for g in ds.groups if g.startswith("overview_"))
+
+    return out
+
+
+# sorted unique factors, after checking them and the method
+def check_overviews(factors, method):
+
+    if method not in OVERVIEW_METHODS:
+        raise ValueError("method must be one of " + str(OVERVIEW_METHODS))
+
+    factors = sorted(set(int(f) for f in factors))
+    if len(factors) == 0 or factors[0] < 2:
+        raise ValueError("overview factors must be integers larger than 1.")
+
+    return factors
+
+
+# create or reuse one group per level, with a variable for each name
+def overview_groups(ds, factors, method, names, lat, lon, code, nodata):
+
+    groups = {}
+    for f in factors:
+
+        name = "overview_" + str(f)
+        if name in ds.groups:
+            g = ds.groups[name]
+        else:
+            g = ds.createGroup(name)
+            g.createDimension("lat", -(-len(lat) // f))
+            g.createDimension("lon", -(-len(lon) // f))
+            lats = g.createVariable("lat", "f4", ("lat",))
+            lons = g.createVariable("lon", "f4", ("lon",))
+            lats[:] = np.asarray(lat)[::f]
+            lons[:] = np.asarray(lon)[::f]
+
+        for n in names:
+            if n not in g.variables:
+                value = g.createVariable(n, "f4", ("time", "lat", "lon",), zlib=True)
+                value.code = code
+                value.missing = nodata
+
+        g.factor = f
+        g.method = method
+        groups[f] = g
+
+    return groups
+
+
+# write the levels of variable name of a cube file from its (time, lat, lon) array while the file is written, one
+# time step at a time, so the data is not read back from the file
+def array_overviews(ds, name, array, factors, method="mean"):
+
+    factors = check_overviews(factors, method)
+
+    var = ds.variables[name]
+    nodata = var.missing
+    groups = overview_groups(ds, factors, method, [name], ds.variables["lat"][:], ds.variables["lon"][:], var.code,
+                             nodata)
+
+    for t in range(var.shape[0]):
+
+        with span("overview_step"):
+
+            data = np.ma.filled(np.ma.asarray(np.asarray(array[t:t + 1])).astype(np.float64), np.nan)
+            data[data == nodata] = np.nan
+
+            for f in factors:
+                out = downsample(data, f, method)
+                groups[f].variables[name][t:t + 1] = np.where(np.isnan(out), nodata, out)
+
+    ds.overview_method = method
+    ds.overviews = ",".join(str(f) for f in dataset_levels(ds))
+
+
+# factor of the level to read: the coarsest meeting resolution, but at least as coarse as maxSize needs
+def choose_level(levels, pixelSize, dims, resolution=None, maxSize=None):
+
+    candidates = [1] + list(levels)
+    out = 1
+
+    if resolution != None:
+        fine = [f for f in candidates if f * pixelSize <= resolution * (1 + 1e-3)]
+        if len(fine) > 0:
+            out = max(fine)
+
+    if maxSize != None:
+        fits = [f for f in candidates if -(-dims[0] // f) <= maxSize and -(-dims[1] // f) <= maxSize]
+        if len(fits) > 0:
+            out = max(out, min(fits))
+        else:
+            out = max(candidates)
+
+    return out
+
+
+# reduce each factor x factor window of a (time, lat, lon) block, NaN where a window has no valid values
+def downsample(data, factor, method="mean"):
+
+    t, h, w = data.shape
+    ph = -(-h // factor) * factor
+    pw = -(-w // factor) * factor
+
+    if ph != h or pw != w:
+        data = np.pad(data, ((0, 0), (0, ph - h), (0, pw - w)), constant_values=np.nan)
+
+    windows = data.reshape(t, ph // factor, factor, pw // factor, factor).swapaxes(2, 3)
+    windows = windows.reshape(t, ph // factor, pw // factor, factor * factor)
+
+    valid = ~np.isnan(windows)
+    count = valid.sum(axis=-1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+
+        if method == "mean":
+            out = np.where(valid, windows, 0).sum(axis=-1) / count
+
+        elif method == "max":
+            out = np.where(valid, windows, -np.inf).max(axis=-1)
+
+        else:
+            # the end of the longest run of equal sorted values holds the mode (NaN sorts last)
+            s = np.sort(windows, axis=-1)
+            idx = np.arange(s.shape[-1])
+            new = np.concatenate([np.ones(s.shape[:-1] + (1,), dtype=bool), s[..., 1:] != s[..., :-1]], axis=-1)
+            start = np.maximum.accumulate(np.where(new, idx, 0), axis=-1)
+            runs = np.where(np.isnan(s), 0, idx - start + 1)
+            out = np.take_along_axis(s, runs.argmax(axis=-1)[..., None], axis=-1)[..., 0]
+
+    out = np.where(count > 0, out, np.nan)
+
+    return out
+
+
+# the netCDF dataset of a cube with attrs set, which has to be open for writing. The dataset is shared with
+# everything holding the cube, so it is never swapped for another handle
+def writable_dataset(cube, attrs):
+
+    ds = cube.get_GDAL_data()
+
+    try:
+        ds.setncatts(attrs)
+    except (AttributeError, RuntimeError, OSError):
+        raise ValueError("the cube file is open read only: close it and pass its path to build_overviews.")
+
+    return ds
+#################################################
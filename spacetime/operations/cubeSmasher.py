@@ -2,7 +2,9 @@ import numpy as np
 import netCDF4 as nc
 from spacetime.objects.interumCube import interum_cube
 import xarray as xr
+from spacetime.objects.tracing import traced
 
+@traced()
 def cube_smasher(function = None, eq = None, parentCube = None, **kwarg):
 
     # is there a parent cube and what is the file structure?
@@ -0,0 +1,123 @@
+import numpy as np
+import threading
+from spacetime.objects.ioStats import read_variable
+
+
+######################################################################################################################
+# DESCRIPTION: helpers shared by the streaming cube operations. cube_reader reads (time, lat, lon) blocks of
+# every variable of a cube or interum_cube as float64 with NaN for nodata, and lays out blocks that follow the
+# storage chunks of the file. Reads go through one lock, since netCDF4 is not thread safe, while the numpy
+# work on the blocks runs in parallel
+######################################################################################################################
+class cube_reader(object):
+
+    def __init__(self, cube):
+
+        self.cube = cube
+        self.nodata = cube.get_nodata_value()
+        self.lock = threading.Lock()
+
+        names = cube.get_var_names()
+        if names is None:
+            self.names = ["value"]
+        else:
+            self.names = [str(x) for x in names]
+
+        if "interum_cube" in str(type(cube)):
+
+            # interum cubes only live in memory as xarray
+            array = cube.get_data_array()
+            if len(array.shape) == 3:
+                array = array.expand_dims("variables")
+            self.array = array.transpose("variables", "time", "lat", "lon")
+            self.vars = None
+            self.shape = tuple(self.array.shape[1:])
+            self.chunks = None
+
+        else:
+
+            ncData = cube.get_GDAL_data()
+            self.array = None
+            self.vars = [ncData.variables[x] for x in self.names]
+            self.shape = tuple(self.vars[0].shape)
+
+            chunking = self.vars[0].chunking()
+            if chunking == "contiguous" or chunking is None:
+                self.chunks = None
+            else:
+                self.chunks = tuple(chunking)
+
+    # block of variable v as float64 with NaN for nodata
+    def read(self, v, t=slice(None), y=slice(None), x=slice(None)):
+
+        with self.lock:
+            if self.vars is None:
+                raw = self.array[v, t, y, x].values
+            else:
+                raw = read_variable(self.vars[v], (t, y, x), stats=getattr(self.cube, "ioStats", None))
+
+        out = np.ma.filled(np.ma.asarray(raw).astype(np.float64), np.nan)
+        if self.nodata is not None:
+            out[out == self.nodata] = np.nan
+
+        return out
+
+    # blocks of whole storage chunks holding about targetBytes of float64 values each
+    def blocks(self, targetBytes):
+
+        T, Y, X = self.shape
+
+        if self.chunks is None:
+            # C order storage, whole time steps are contiguous
+            base = [1, Y, X]
+        else:
+            base = list(self.chunks)
+
+        # grow the block by whole chunks along time, then lat, then lon
+        size = list(base)
+        for axis in [0, 1, 2]:
+            full = self.shape[axis]
+            while size[axis] < full and np.prod(size) * 8 * 2 <= targetBytes:
+                size[axis] = min(full, size[axis] + base[axis])
+
+        out = []
+        for t in range(0, T, size[0]):
+            for y in range(0, Y, size[1]):
+                for x in range(0, X, size[2]):
+                    out.append((slice(t, min(T, t + size[0])), slice(y, min(Y, y + size[1])), slice(x, min(X, x + size[2]))))
+
+        return out
+
+    # spatial tiles with every time step, for operations that need whole series
+    def spatial_tiles(self, tileSize):
+
+        T, Y, X = self.shape
+
+        out = []
+        for y in range(0, Y, tileSize):
+            for x in range(0, X, tileSize):
+                out.append((slice(y, min(Y, y + tileSize)), slice(x, min(X, x + tileSize))))
+
+        return out
+
+    def get_lat(self):
+        return np.asarray(self.cube.get_lat())
+
+    def get_lon(self):
+        return np.asarray(self.cube.get_lon())
+
+    def get_time(self):
+        return self.cube.get_time()
+
+
+
+#################################################
+# helper function to size the tiles of a streaming operation from the memory budget: the side of a square
+# spatial tile whose series of length steps, times copies, fits the budget shared by the workers
+def tile_size(length, budget, workers, copies=4, itemSize=8):
+
+    perPixel = max(1, length) * itemSize * copies
+    out = int(np.sqrt(max(1, budget // max(1, workers)) / perPixel))
+
+    return max(16, out)
+#################################################
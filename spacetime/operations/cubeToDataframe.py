@@ -1,10 +1,12 @@
 import pandas as pd
 import numpy as np
+from spacetime.objects.tracing import traced
 
 
-def cube_to_dataframe(cube):
-    # load data
-    ds = cube.get_data_array()
+@traced()
+def cube_to_dataframe(cube, array=None):
+    # load data, unless a (reduced) array of the cube is given
+    ds = cube.get_data_array() if array is None else array
 
     # if 3d or 4d data
     if cube.get_shapeval() == 4:
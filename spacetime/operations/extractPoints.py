@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+from osgeo import osr
+from concurrent.futures import ThreadPoolExecutor
+from spacetime.operations.cubeStream import cube_reader
+from spacetime.scale.warpPlan import get_grid, map_to_pixel, transform_coords
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: extracts the time series of many points from a cube at once. Point coordinates are mapped to pixel
+# indices with the inverse geotransform of the cube grid, the pixels are grouped by the storage chunk they fall in
+# and every chunk holding a point is read once (in time slabs that fit the memory budget)
+#
+# INPUTS:
+# cube (required): a cube or interum_cube
+# x (required): vector of x coordinates (lon or projected)
+# y (required): vector of y coordinates (lat or projected)
+# SRS: EPSG code or WKT of the coordinates, None if they are in the SRS of the cube
+# method: "nearest" or "bilinear" (weights of missing neighbours are dropped and the rest renormalized)
+# output: "array" for a points x time (x variables) numpy array or "dataframe" for a long table
+# workers: number of threads reading chunks
+# budget: memory budget in bytes, defaults to the configured memory budget
+#
+# OUTPUT:
+# points x time array (points x time x variables for filestovar cubes) or a DataFrame with columns point, x, y,
+# time, (variables,) value. Points outside the cube are NaN
+######################################################################################################################
+
+EXTRACT_METHODS = ["nearest", "bilinear"]
+
+
+@traced()
+def extract_points(cube, x, y, SRS=None, method="nearest", output="array", workers=4, budget=None):
+
+    if method not in EXTRACT_METHODS:
+        raise ValueError("method must be one of " + str(EXTRACT_METHODS))
+    if output not in ["array", "dataframe"]:
+        raise ValueError("output must be 'array' or 'dataframe'")
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    if len(x) != len(y):
+        raise ValueError("x and y must have the same length")
+
+    reader = cube_reader(cube)
+    gt, dims, wkt = get_grid(cube)
+
+    if SRS != None:
+        px, py = transform_coords(x, y, srs_wkt(SRS), wkt)
+    else:
+        px, py = x, y
+
+    col, row = map_to_pixel(gt, px, py)
+    pixels, weights = point_pixels(col, row, dims, method)
+
+    # read every pixel a point needs once
+    needed = np.unique(pixels[pixels >= 0])
+
+    if needed.size == 0:
+        # no point falls on the grid, every series is NaN
+        series = np.full((len(reader.names), reader.shape[0], len(x)), np.nan)
+    else:
+        values = read_pixels(reader, needed, dims, workers, budget)
+
+        # gather the pixel series back to the points, (variables, time, points, neighbours)
+        pos = np.searchsorted(needed, np.maximum(pixels, 0))
+        gathered = values[:, :, pos]
+        gathered[:, :, pixels < 0] = np.nan
+
+        valid = ~np.isnan(gathered)
+        w = np.where(valid, weights, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            series = (np.where(valid, gathered, 0) * w).sum(axis=-1) / w.sum(axis=-1)
+
+    # points x time (x variables)
+    series = np.moveaxis(series, -1, 0)
+    if cube.get_var_names() is None:
+        out = series[:, 0]
+    else:
+        out = np.moveaxis(series, 1, 2)
+
+    if output == "dataframe":
+        out = points_dataframe(out, x, y, reader)
+
+    return out
+
+
+
+#################################################
+# helper functions for point extraction
+def srs_wkt(SRS):
+
+    if isinstance(SRS, str) and not SRS.strip().isdigit():
+        return SRS
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(int(SRS))
+
+    return srs.ExportToWkt()
+
+
+# flat pixel indices (points x neighbours, -1 outside the grid) and their sampling weights
+def point_pixels(col, row, dims, method):
+
+    xDim, yDim = dims
+
+    if method == "nearest":
+        c = np.floor(col)[:, None]
+        r = np.floor(row)[:, None]
+        weights = np.ones((len(col), 1))
+
+    else:
+        # neighbours around the pixel centers, clamped to the edge of the grid
+        fc = col - 0.5
+        fr = row - 0.5
+        c0 = np.floor(fc)
+        r0 = np.floor(fr)
+        dc = fc - c0
+        dr = fr - r0
+
+        c = np.stack([c0, c0 + 1, c0, c0 + 1], axis=1)
+        r = np.stack([r0, r0, r0 + 1, r0 + 1], axis=1)
+        weights = np.stack([(1 - dc) * (1 - dr), dc * (1 - dr), (1 - dc) * dr, dc * dr], axis=1)
+
+        inside = (col >= 0) & (col < xDim) & (row >= 0) & (row < yDim)
+        c = np.where(inside[:, None], np.clip(c, 0, xDim - 1), c)
+        r = np.where(inside[:, None], np.clip(r, 0, yDim - 1), r)
+
+    with np.errstate(invalid="ignore"):
+        outside = ~((c >= 0) & (c < xDim) & (r >= 0) & (r < yDim))
+
+    c = np.where(outside, 0, c)
+    r = np.where(outside, 0, r)
+    pixels = np.where(outside, -1, r * xDim + c).astype(np.int64)
+
+    return pixels, weights
+
+
+# read the series of flat pixel indices, one read per storage chunk (and time slab)
+def read_pixels(reader, needed, dims, workers, budget):
+
+    T = reader.shape[0]
+    V = len(reader.names)
+    xDim = dims[0]
+
+    out = np.full((V, T, len(needed)), np.nan)
+
+    if reader.chunks is None:
+        chunkT, chunkY, chunkX = 1, 256, 256
+    else:
+        chunkT, chunkY, chunkX = reader.chunks
+
+    rows = needed // xDim
+    cols = needed % xDim
+
+    # group the pixels by spatial chunk
+    chunkId = (rows // chunkY) * (xDim // chunkX + 1) + cols // chunkX
+    order = np.argsort(chunkId, kind="stable")
+    splits = np.flatnonzero(np.diff(chunkId[order])) + 1
+    groups = np.split(order, splits)
+
+    def read_group(idx):
+
+        r = rows[idx]
+        c = cols[idx]
+        r0, r1 = int(r.min()), int(r.max()) + 1
+        c0, c1 = int(c.min()), int(c.max()) + 1
+
+        # time slabs of whole chunks that fit the share of the budget of a worker
+        stepBytes = (r1 - r0) * (c1 - c0) * 8 * 2
+        slab = max(1, budget // (max(1, workers) * 4 * stepBytes))
+        slab = max(chunkT, (slab // chunkT) * chunkT)
+
+        with span("extract_chunk", pixels=len(idx)):
+            for v in range(V):
+                for t in range(0, T, slab):
+                    data = reader.read(v, slice(t, min(T, t + slab)), slice(r0, r1), slice(c0, c1))
+                    out[v, t:t + data.shape[0], idx] = data[:, r - r0, c - c0].T
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(read_group, groups))
+
+    return out
+
+
+def points_dataframe(array, x, y, reader):
+
+    time = reader.get_time()
+    P = len(x)
+    T = len(time)
+
+    if array.ndim == 2:
+        df = pd.DataFrame(dict(point=np.repeat(np.arange(P), T), x=np.repeat(x, T), y=np.repeat(y, T),
+                               time=np.tile(time, P), value=array.ravel()))
+    else:
+        V = array.shape[2]
+        df = pd.DataFrame(dict(point=np.repeat(np.arange(P), T * V), x=np.repeat(x, T * V), y=np.repeat(y, T * V),
+                               time=np.tile(np.repeat(time, V), P), variables=np.tile(reader.names, P * T),
+                               value=array.ravel()))
+        df["variables"] = df["variables"].astype("category")
+
+    return df
+#################################################
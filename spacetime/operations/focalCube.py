@@ -0,0 +1,231 @@
+import numpy as np
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from spacetime.operations.cubeStream import cube_reader
+from spacetime.operations.rollingCube import van_herk
+from spacetime.objects.interumCube import interum_cube
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: spatial neighborhood (focal) statistics for every time step of a cube. The cube is processed in
+# spatial tiles read with a halo of the window radius, so results match a whole-grid computation, and time slabs
+# of tiles run in parallel. Square sums and means use summed-area tables and square minima/maxima separable van
+# Herk passes, so their cost does not grow with the window; circular windows and kernels use one shifted pass per
+# cell of the window, or two 1D passes for separable (rank one) kernels. Nodata cells are skipped
+#
+# INPUTS:
+# cube (required): a cube or interum_cube
+# op: "mean", "sum", "min" or "max" (ignored when a kernel is given)
+# size: width of the window in pixels, an odd number
+# shape: "square" or "circle" window
+# kernel: 2D array of weights with odd sides, the result is its convolution with the data
+# minValid: fewest valid cells a window needs for a result. Defaults to 1, and to every weighted cell for kernels
+# workers: number of threads processing tiles
+# budget: memory budget in bytes for the tiles in flight, defaults to the configured memory budget
+#
+# OUTPUT:
+# an interum_cube of the same shape as the input with nodata where a window has too few valid cells
+######################################################################################################################
+
+FOCAL_OPS = ["mean", "sum", "min", "max"]
+FOCAL_SHAPES = ["square", "circle"]
+
+# side of the spatial tiles in pixels
+FOCAL_TILE = 512
+
+
+@traced()
+def focal_cube(cube, op="mean", size=3, shape="square", kernel=None, minValid=None, workers=4, budget=None):
+
+    if kernel is not None:
+        kernel = np.asarray(kernel, dtype=np.float64)
+        if kernel.ndim != 2 or kernel.shape[0] % 2 == 0 or kernel.shape[1] % 2 == 0:
+            raise ValueError("kernel must be a 2D array with odd sides.")
+        op = "convolve"
+        ry, rx = kernel.shape[0] // 2, kernel.shape[1] // 2
+        if minValid == None:
+            minValid = int(np.count_nonzero(kernel))
+    else:
+        if op not in FOCAL_OPS:
+            raise ValueError("op must be one of " + str(FOCAL_OPS))
+        if shape not in FOCAL_SHAPES:
+            raise ValueError("shape must be one of " + str(FOCAL_SHAPES))
+        if int(size) < 1 or int(size) % 2 == 0:
+            raise ValueError("size must be an odd number of pixels.")
+        ry = rx = int(size) // 2
+
+    if minValid == None:
+        minValid = 1
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    reader = cube_reader(cube)
+    T, Y, X = reader.shape
+
+    nodata = reader.nodata
+    if nodata == None:
+        nodata = -9999
+
+    out = np.empty((len(reader.names), T, Y, X), dtype=np.float32)
+
+    # time steps of a tile whose haloed copies fit a worker's share of the budget
+    side = FOCAL_TILE
+    haloBytes = (min(side, Y) + 2 * ry + 1) * (min(side, X) + 2 * rx + 1) * 8 * 8
+    slab = int(max(1, min(T, budget // (max(1, workers) * haloBytes))))
+
+    def run_tile(job):
+
+        v, t0, (ys, xs) = job
+        ts = slice(t0, min(T, t0 + slab))
+
+        with span("focal_tile"):
+            data = read_halo(reader, v, ts, ys, xs, ry, rx)
+            result = focal_window(data, op, ry, rx, shape, kernel, minValid)
+            out[v, ts, ys, xs] = np.where(np.isnan(result), nodata, result)
+
+    jobs = [(v, t0, tile) for v in range(len(reader.names)) for t0 in range(0, T, slab)
+            for tile in reader.spatial_tiles(side)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run_tile, jobs))
+
+    filestovar = cube.get_var_names() is not None
+
+    if filestovar:
+        array = xr.DataArray(data=out, dims=["variables", "time", "lat", "lon"], coords=dict(
+            variables=(["variables"], reader.names),
+            lon=(["lon"], reader.get_lon()),
+            lat=(["lat"], reader.get_lat()),
+            time=reader.get_time()))
+    else:
+        array = xr.DataArray(data=out[0], dims=["time", "lat", "lon"], coords=dict(
+            lon=(["lon"], reader.get_lon()),
+            lat=(["lat"], reader.get_lat()),
+            time=reader.get_time()))
+
+    ret = interum_cube(cube = cube, array = array, structure = filestovar)
+
+    return ret
+
+
+
+#################################################
+# helper function to read a tile with a halo of ry rows and rx columns, NaN beyond the edge of the grid
+def read_halo(reader, v, ts, ys, xs, ry, rx):
+
+    T, Y, X = reader.shape
+
+    y0, y1 = max(0, ys.start - ry), min(Y, ys.stop + ry)
+    x0, x1 = max(0, xs.start - rx), min(X, xs.stop + rx)
+
+    data = reader.read(v, ts, slice(y0, y1), slice(x0, x1))
+
+    pad = ((0, 0), (ry - (ys.start - y0), ry - (y1 - ys.stop)), (rx - (xs.start - x0), rx - (x1 - xs.stop)))
+    if any(p != (0, 0) for p in pad):
+        data = np.pad(data, pad, constant_values=np.nan)
+
+    return data
+
+
+# focal statistic of a (time, rows + 2 ry, cols + 2 rx) block, returning the (time, rows, cols) interior
+def focal_window(data, op, ry, rx, shape="square", kernel=None, minValid=1):
+
+    valid = ~np.isnan(data)
+    values = np.where(valid, data, 0)
+
+    if op == "convolve":
+        # convolution flips the kernel
+        weights = kernel[::-1, ::-1]
+        if np.linalg.matrix_rank(weights) == 1:
+            u, s, vt = np.linalg.svd(weights)
+            col = u[:, 0] * np.sqrt(s[0])
+            row = vt[0] * np.sqrt(s[0])
+            result = line_pass(line_pass(values, col, 1), row, 2)
+            count = line_pass(line_pass(valid.astype(np.float64), (col != 0) * 1.0, 1), (row != 0) * 1.0, 2)
+        else:
+            result = shifted_sum(values, weights)
+            count = shifted_sum(valid.astype(np.float64), (weights != 0) * 1.0)
+
+    elif shape == "square":
+        count = box_sum(valid.astype(np.float64), ry, rx)
+        if op in ["mean", "sum"]:
+            result = box_sum(values, ry, rx)
+        else:
+            # separable sliding extremes, first down the rows then along the columns
+            result = np.moveaxis(van_herk(np.moveaxis(data, 1, 0), 2 * ry + 1, op), 0, 1)[:, 2 * ry:]
+            result = np.moveaxis(van_herk(np.moveaxis(result, 2, 0), 2 * rx + 1, op), 0, 2)[:, :, 2 * rx:]
+
+    else:
+        yy, xx = np.mgrid[-ry:ry + 1, -rx:rx + 1]
+        disk = ((yy * yy + xx * xx) <= ry * rx) * 1.0
+        count = shifted_sum(valid.astype(np.float64), disk)
+        if op in ["mean", "sum"]:
+            result = shifted_sum(values, disk)
+        else:
+            result = shifted_extreme(data, disk, op)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if op == "mean":
+            result = result / count
+
+    result = np.where(np.round(count) >= max(1, minValid), result, np.nan)
+
+    return result
+
+
+# window sums over (2 ry + 1) x (2 rx + 1) boxes from a summed-area table
+def box_sum(a, ry, rx):
+
+    t, h, w = a.shape
+    ky, kx = 2 * ry + 1, 2 * rx + 1
+
+    table = np.zeros((t, h + 1, w + 1))
+    np.cumsum(a, axis=1, out=table[:, 1:, 1:])
+    np.cumsum(table[:, 1:, 1:], axis=2, out=table[:, 1:, 1:])
+
+    return table[:, ky:, kx:] - table[:, :-ky, kx:] - table[:, ky:, :-kx] + table[:, :-ky, :-kx]
+
+
+# weighted sums along one axis (1 rows, 2 columns) of a 1D kernel, keeping the interior
+def line_pass(a, weights, axis):
+
+    k = len(weights)
+    n = a.shape[axis] - k + 1
+    out = np.zeros(a.shape[:axis] + (n,) + a.shape[axis + 1:])
+
+    for i in range(k):
+        if weights[i] != 0:
+            out += weights[i] * np.take(a, np.arange(i, i + n), axis=axis)
+
+    return out
+
+
+# weighted sums of a 2D kernel, one shifted slice per weighted cell
+def shifted_sum(a, weights):
+
+    ky, kx = weights.shape
+    h = a.shape[1] - ky + 1
+    w = a.shape[2] - kx + 1
+
+    out = np.zeros((a.shape[0], h, w))
+    for i, j in zip(*np.nonzero(weights)):
+        out += weights[i, j] * a[:, i:i + h, j:j + w]
+
+    return out
+
+
+def shifted_extreme(a, mask, op):
+
+    ky, kx = mask.shape
+    h = a.shape[1] - ky + 1
+    w = a.shape[2] - kx + 1
+    reduce = np.fmin if op == "min" else np.fmax
+
+    out = np.full((a.shape[0], h, w), np.nan)
+    for i, j in zip(*np.nonzero(mask)):
+        out = reduce(out, a[:, i:i + h, j:j + w])
+
+    return out
+#################################################
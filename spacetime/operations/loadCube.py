@@ -3,17 +3,22 @@ import numpy as np
 from spacetime.objects.cubeObject import cube
 from spacetime.operations.time import cube_time, return_time
 import os
+from spacetime.objects.tracing import traced
+from spacetime.objects.ioStats import io_stats, read_variable
 
-def load_cube(file):
+@traced()
+def load_cube(file, mode="r"):
 
-    # get data set
-    ds = nc.Dataset(file)
+    # get data set, mode "a" opens it for appending (e.g. overviews)
+    ds = nc.Dataset(file, mode)
+
+    stats = io_stats()
 
     # get time
     if "units: seconds since" in str(ds.variables["time"]):
         time = return_time(ds.variables["time"])
     else:
-        time = ds.variables["time"][:]
+        time = read_variable(ds.variables["time"], stats=stats)
 
     # get var names
     vars = list(ds.variables.keys())
@@ -29,6 +34,7 @@ def load_cube(file):
     fileSize = os.path.getsize(file) * 0.000001
 
     cube_ds = cube(ds, fileStruc = struc, names=varNames, timeObj=time, fileSize = fileSize)
+    cube_ds.ioStats.merge(stats)
 
     return cube_ds
 
@@ -6,9 +6,12 @@ from spacetime.objects.writeNETCDF import write_netcdf
 from spacetime.objects.cubeObject import cube
 from itertools import accumulate
 import string
+from spacetime.objects.tracing import traced, span
 
 # todo: pass timeObj down to netcdf maker for if state
-def make_cube(data = None, fileName = None, organizeFiles="filestotime", organizeBands="bandstotime", varNames=None, timeObj=None, inMemory = "auto"):
+# overviews: factors of reduced resolution levels (e.g. [2, 4, 8]) written while the data is written, see build_overviews
+@traced()
+def make_cube(data = None, fileName = None, organizeFiles="filestotime", organizeBands="bandstotime", varNames=None, timeObj=None, inMemory = "auto", overviews = None, overviewMethod = "mean"):
 
     if "file_object" in str(type(data)):
 
@@ -45,12 +48,10 @@ def make_cube(data = None, fileName = None, organizeFiles="filestotime", organiz
                 index = len(timeList)
         else:
             index = len(data.get_time())
-        print("get array")
-
-        array = data.get_data_array()
+        with span("get_array"):
+            array = data.get_data_array()
 
         for i in range(index):
-            print(i)
 
             tempArray = array[i] # this is the big time sink in the program
 
@@ -78,7 +79,7 @@ def make_cube(data = None, fileName = None, organizeFiles="filestotime", organiz
             fullCube = gdal.BuildVRT("", dataList, separate=True) # make a virtual cube for vrt layers
             gdalCube = cube_meta(fullCube) # make gdal cube to query data and metadata
 
-            preCube = write_netcdf(cube=gdalCube, dataset=outMat, fileName=fileName, organizeFiles = "filestotime", organizeBands = "bandstotime", timeObj = time) # make netcdf4 cube
+            preCube = write_netcdf(cube=gdalCube, dataset=outMat, fileName=fileName, organizeFiles = "filestotime", organizeBands = "bandstotime", timeObj = time, overviews = overviews, overviewMethod = overviewMethod) # make netcdf4 cube
             cubeObj = cube(preCube, fileStruc = "filestotime", timeObj=time, inMemory = inMemory, fileSize = sizes) # make a cube object
 
         if organizeFiles == "filestotime" and organizeBands == "bandstovar":
@@ -107,7 +108,7 @@ def make_cube(data = None, fileName = None, organizeFiles="filestotime", organiz
             #split into a list of arrays for each variable instead of for time
             dataOut = split_list(arranged, [1]*len(varNames), squeeze = True)
 
-            preCube = write_netcdf(cube=gdalCube[0], dataset=dataOut, fileName=fileName, organizeFiles = "filestovar", organizeBands="bandstotime", vars=varNames, timeObj = time) # make netcdf4 cube
+            preCube = write_netcdf(cube=gdalCube[0], dataset=dataOut, fileName=fileName, organizeFiles = "filestovar", organizeBands="bandstotime", vars=varNames, timeObj = time, overviews = overviews, overviewMethod = overviewMethod) # make netcdf4 cube
             cubeObj = cube(preCube, fileStruc = "filestovar", names=varNames, timeObj=time, inMemory = inMemory, fileSize = sizes)
 
         # if files are each one variable
@@ -138,7 +139,7 @@ def make_cube(data = None, fileName = None, organizeFiles="filestotime", organiz
             #split into a list of arrays for each variable instead of for time
             dataOut = split_list(arranged, [1]*len(varNames), squeeze = False)
 
-            preCube = write_netcdf(cube=gdalCube[0], dataset=dataOut, fileName=fileName, organizeFiles = "filestovar", organizeBands="bandstovar", vars=varNames, timeObj = time) # make netcdf4 cube
+            preCube = write_netcdf(cube=gdalCube[0], dataset=dataOut, fileName=fileName, organizeFiles = "filestovar", organizeBands="bandstovar", vars=varNames, timeObj = time, overviews = overviews, overviewMethod = overviewMethod) # make netcdf4 cube
             cubeObj = cube(preCube, fileStruc = "filestovar", names=varNames, timeObj=time, inMemory = inMemory, fileSize = sizes)
 
 
@@ -166,7 +167,7 @@ def make_cube(data = None, fileName = None, organizeFiles="filestotime", organiz
 
 
             # 0.0239 seconds SECOND SLOWEST SECTION
-            preCube = write_netcdf(cube=gdalCube[0], dataset=dataMerge, fileName=fileName, organizeFiles = "filestovar", organizeBands="bandstotime", vars=varNames, timeObj = time) # make netcdf4 cube
+            preCube = write_netcdf(cube=gdalCube[0], dataset=dataMerge, fileName=fileName, organizeFiles = "filestovar", organizeBands="bandstotime", vars=varNames, timeObj = time, overviews = overviews, overviewMethod = overviewMethod) # make netcdf4 cube
 
             # 0.0000062 seconds
             cubeObj = cube(preCube, fileStruc = "filestovar", names=varNames, timeObj=time, inMemory= inMemory, fileSize = sizes)
@@ -182,14 +183,13 @@ def make_cube(data = None, fileName = None, organizeFiles="filestotime", organiz
         sizes = data.get_file_size()
 
         if type(varNames) != type(None):
-            preCube = write_netcdf(cube=data, dataset=array, fileName=fileName, organizeFiles = "filestovar",organizeBands="bandstotime", vars=varNames, timeObj = time) # make netcdf4 cube
+            preCube = write_netcdf(cube=data, dataset=array, fileName=fileName, organizeFiles = "filestovar",organizeBands="bandstotime", vars=varNames, timeObj = time, overviews = overviews, overviewMethod = overviewMethod) # make netcdf4 cube
             cubeObj = cube(preCube, fileStruc = "filestovar", names=varNames, timeObj=time, fileSize = sizes)
 
         else:
-            preCube = write_netcdf(cube=data, dataset=array, fileName=fileName, organizeFiles = "filestotime", organizeBands="bandstotime" ,timeObj = time) # make netcdf4 cube
+            preCube = write_netcdf(cube=data, dataset=array, fileName=fileName, organizeFiles = "filestotime", organizeBands="bandstotime" ,timeObj = time, overviews = overviews, overviewMethod = overviewMethod) # make netcdf4 cube
             cubeObj = cube(preCube, fileStruc = "filestotime", timeObj=time, inMemory = inMemory, fileSize = sizes)
 
-
     return cubeObj
 
 
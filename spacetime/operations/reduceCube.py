@@ -0,0 +1,193 @@
+import numpy as np
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from spacetime.operations.cubeStream import cube_reader
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: reduces a cube over one or more of its axes without loading it. The file is streamed in blocks of
+# whole storage chunks and every block is reduced to partials (count, sum, sum of squared deviations, min, max)
+# which are merged into the output with the pairwise update of Chan et al., so only the output and a few blocks per
+# worker are ever in memory. Nodata values are skipped
+#
+# INPUTS:
+# cube (required): a cube or interum_cube
+# dims: axis or list of axes to reduce over, any of "time", "lat" and "lon"
+# ops: statistic or list of statistics, any of "mean", "sum", "min", "max", "std", "var" and "count"
+# ddof: delta degrees of freedom of std and var
+# workers: number of threads reducing blocks
+# budget: memory budget in bytes for the blocks in flight, defaults to the configured memory budget
+#
+# OUTPUT:
+# an xarray Dataset with one variable per statistic over the axes that were not reduced (and "variables" for
+# filestovar cubes). Cells without valid values are NaN, except count which is 0
+######################################################################################################################
+
+REDUCE_OPS = ["mean", "sum", "min", "max", "std", "var", "count"]
+AXES = ["time", "lat", "lon"]
+
+
+@traced()
+def reduce_cube(cube, dims="time", ops="mean", ddof=0, workers=4, budget=None):
+
+    if isinstance(dims, str):
+        dims = [dims]
+    if isinstance(ops, str):
+        ops = [ops]
+
+    for d in dims:
+        if d not in AXES:
+            raise ValueError("dims must be among " + str(AXES) + ", got " + str(d))
+    for o in ops:
+        if o not in REDUCE_OPS:
+            raise ValueError("ops must be among " + str(REDUCE_OPS) + ", got " + str(o))
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    reader = cube_reader(cube)
+    axes = tuple(AXES.index(d) for d in dims)
+    keep = [i for i in range(3) if i not in axes]
+    outShape = tuple(reader.shape[i] for i in keep)
+
+    # each worker holds a block and its float64 copies
+    blocks = reader.blocks(budget // (max(1, workers) * 4))
+
+    results = []
+    for v in range(len(reader.names)):
+
+        total = new_partials(outShape)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+
+            futures = [pool.submit(block_partials, reader, v, b, axes) for b in blocks]
+
+            for f in as_completed(futures):
+                block, part = f.result()
+                window = tuple(block[i] for i in keep)
+                merge_partials(total, part, window)
+
+        results.append(finish_partials(total, ops, ddof))
+
+    return to_dataset(reader, results, ops, dims, keep)
+
+
+
+#################################################
+# helper functions for the partials of a reduction
+def new_partials(shape):
+
+    out = dict(count=np.zeros(shape, dtype=np.int64),
+               sum=np.zeros(shape, dtype=np.float64),
+               m2=np.zeros(shape, dtype=np.float64),
+               min=np.full(shape, np.inf),
+               max=np.full(shape, -np.inf))
+
+    return out
+
+
+# read one block and reduce it over axes
+def block_partials(reader, v, block, axes):
+
+    with span("reduce_block"):
+        data = reader.read(v, *block)
+        part = array_partials(data, axes)
+
+    return block, part
+
+
+# count, sum, sum of squared deviations, min and max of the valid values of an array over axes
+def array_partials(data, axes):
+
+    valid = ~np.isnan(data)
+
+    count = valid.sum(axis=axes)
+    total = np.where(valid, data, 0).sum(axis=axes)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        dev = np.where(valid, data - np.expand_dims(mean, axes), 0)
+
+    out = dict(count=count,
+               sum=total,
+               m2=(dev * dev).sum(axis=axes),
+               min=np.where(valid, data, np.inf).min(axis=axes),
+               max=np.where(valid, data, -np.inf).max(axis=axes))
+
+    return out
+
+
+# merge the partials of a block into the totals over window
+def merge_partials(total, part, window):
+
+    na = total["count"][window]
+    nb = part["count"]
+    n = na + nb
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        delta = np.where(nb > 0, part["sum"] / nb, 0) - np.where(na > 0, total["sum"][window] / na, 0)
+        update = np.where((na > 0) & (nb > 0), delta * delta * na * nb / n, 0)
+
+    total["m2"][window] = total["m2"][window] + part["m2"] + update
+    total["sum"][window] = total["sum"][window] + part["sum"]
+    total["count"][window] = n
+    total["min"][window] = np.minimum(total["min"][window], part["min"])
+    total["max"][window] = np.maximum(total["max"][window], part["max"])
+
+
+def finish_partials(total, ops, ddof):
+
+    count = total["count"]
+    empty = count == 0
+
+    out = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for o in ops:
+            if o == "count":
+                out[o] = count
+            elif o == "sum":
+                out[o] = np.where(empty, np.nan, total["sum"])
+            elif o == "mean":
+                out[o] = np.where(empty, np.nan, total["sum"] / count)
+            elif o == "min":
+                out[o] = np.where(empty, np.nan, total["min"])
+            elif o == "max":
+                out[o] = np.where(empty, np.nan, total["max"])
+            else:
+                var = np.where(count - ddof > 0, total["m2"] / (count - ddof), np.nan)
+                out[o] = var if o == "var" else np.sqrt(var)
+
+    return out
+
+
+def to_dataset(reader, results, ops, dims, keep):
+
+    coords = {}
+    for i in keep:
+        if AXES[i] == "time":
+            coords["time"] = reader.get_time()
+        elif AXES[i] == "lat":
+            coords["lat"] = reader.get_lat()
+        else:
+            coords["lon"] = reader.get_lon()
+
+    outDims = [AXES[i] for i in keep]
+
+    # filestovar cubes keep their variables as the first dimension
+    multi = reader.cube.get_var_names() is not None
+    if multi:
+        coords["variables"] = reader.names
+
+    dataVars = {}
+    for o in ops:
+        if multi:
+            dataVars[o] = (["variables"] + outDims, np.stack([r[o] for r in results]))
+        else:
+            dataVars[o] = (outDims, results[0][o])
+
+    out = xr.Dataset(dataVars, coords=coords, attrs=dict(reduced=",".join(dims)))
+
+    return out
+#################################################
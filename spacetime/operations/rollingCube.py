@@ -0,0 +1,169 @@
+import numpy as np
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from spacetime.operations.cubeStream import cube_reader, tile_size
+from spacetime.objects.interumCube import interum_cube
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: moving window statistics over the time axis of a cube. Sums, means and standard deviations come
+# from differences of cumulative sums and minima/maxima from the van Herk/Gil-Werman block algorithm (the
+# vectorized form of a monotonic deque), so every step costs the same whatever the window length. The cube is
+# streamed in spatial tiles holding the whole series, processed by several workers
+#
+# INPUTS:
+# cube (required): a cube or interum_cube
+# window (required): number of time steps in the window
+# op: "mean", "sum", "min", "max" or "std"
+# minPeriods: fewest valid values a window needs for a result, defaults to the window length
+# center: if True the window is centered on each step (reaching (window - 1) // 2 steps ahead), otherwise it
+# ends there
+# ddof: delta degrees of freedom of std
+# workers: number of threads processing tiles
+# budget: memory budget in bytes for the tiles in flight, defaults to the configured memory budget
+#
+# OUTPUT:
+# an interum_cube of the same shape as the input with nodata where a window has too few valid values
+######################################################################################################################
+
+ROLLING_OPS = ["mean", "sum", "min", "max", "std"]
+
+
+@traced()
+def rolling_cube(cube, window, op="mean", minPeriods=None, center=False, ddof=1, workers=4, budget=None):
+
+    if op not in ROLLING_OPS:
+        raise ValueError("op must be one of " + str(ROLLING_OPS))
+
+    window = int(window)
+    if window < 1:
+        raise ValueError("window must be at least one time step.")
+
+    if minPeriods == None:
+        minPeriods = window
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    reader = cube_reader(cube)
+    T, Y, X = reader.shape
+
+    nodata = reader.nodata
+    if nodata == None:
+        nodata = -9999
+
+    out = np.empty((len(reader.names), T, Y, X), dtype=np.float32)
+
+    # the cumulative sums and padded copies take about eight float64 copies of a tile
+    tiles = reader.spatial_tiles(tile_size(T + window, budget, workers, copies=8))
+
+    def run_tile(job):
+
+        v, (ys, xs) = job
+
+        with span("rolling_tile"):
+            data = reader.read(v, slice(None), ys, xs)
+            result = rolling_window(data, window, op, minPeriods, center, ddof)
+            out[v, :, ys, xs] = np.where(np.isnan(result), nodata, result)
+
+    jobs = [(v, t) for v in range(len(reader.names)) for t in tiles]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run_tile, jobs))
+
+    filestovar = cube.get_var_names() is not None
+
+    if filestovar:
+        array = xr.DataArray(data=out, dims=["variables", "time", "lat", "lon"], coords=dict(
+            variables=(["variables"], reader.names),
+            lon=(["lon"], reader.get_lon()),
+            lat=(["lat"], reader.get_lat()),
+            time=reader.get_time()))
+    else:
+        array = xr.DataArray(data=out[0], dims=["time", "lat", "lon"], coords=dict(
+            lon=(["lon"], reader.get_lon()),
+            lat=(["lat"], reader.get_lat()),
+            time=reader.get_time()))
+
+    ret = interum_cube(cube = cube, array = array, structure = filestovar)
+
+    return ret
+
+
+
+#################################################
+# helper function for a moving window over the first axis of an array with NaN for missing values
+def rolling_window(data, window, op, minPeriods, center=False, ddof=1):
+
+    T = data.shape[0]
+
+    # a centered window is a trailing window ending (window - 1) // 2 steps later
+    ahead = (window - 1) // 2 if center else 0
+    if ahead > 0:
+        data = np.concatenate([data, np.full((ahead,) + data.shape[1:], np.nan)])
+
+    valid = ~np.isnan(data)
+    count = window_sum(valid.astype(np.float64), window)
+
+    if op in ["min", "max"]:
+        result = van_herk(data, window, op)
+    else:
+        # shift each series by its mean so the squared sums do not lose precision
+        shift = np.where(valid, data, 0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+        values = np.where(valid, data - shift, 0)
+
+        total = window_sum(values, window)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if op == "sum":
+                result = total + count * shift
+            elif op == "mean":
+                result = total / count + shift
+            else:
+                squares = window_sum(values * values, window)
+                var = (squares - total * total / count) / (count - ddof)
+                result = np.sqrt(np.maximum(var, 0))
+                result[count - ddof <= 0] = np.nan
+
+    result = np.where(count >= max(1, minPeriods), result, np.nan)
+
+    return result[ahead:ahead + T]
+
+
+# sums of the trailing windows from a cumulative sum, O(1) per step
+def window_sum(values, window):
+
+    T = values.shape[0]
+
+    cum = np.zeros((T + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=cum[1:])
+
+    hi = np.arange(1, T + 1)
+    lo = np.maximum(hi - window, 0)
+
+    return cum[hi] - cum[lo]
+
+
+# trailing window minima or maxima with the van Herk/Gil-Werman algorithm: prefix and suffix extremes within
+# blocks of the window length give every window from two lookups, O(1) per step
+def van_herk(data, window, op):
+
+    T = data.shape[0]
+    fill = np.inf if op == "min" else -np.inf
+    reduce = np.minimum if op == "min" else np.maximum
+
+    # pad so that the window ending at t starts at t, and to whole blocks
+    blocks = -(-(T + window - 1) // window)
+    padded = np.full((blocks * window,) + data.shape[1:], fill)
+    padded[window - 1:window - 1 + T] = np.where(np.isnan(data), fill, data)
+
+    shaped = padded.reshape((blocks, window) + data.shape[1:])
+    prefix = reduce.accumulate(shaped, axis=1).reshape(padded.shape)
+    suffix = reduce.accumulate(shaped[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+
+    out = reduce(suffix[:T], prefix[window - 1:window - 1 + T])
+    out = np.where(np.isinf(out), np.nan, out)
+
+    return out
+#################################################
@@ -3,6 +3,7 @@ import netCDF4 as nc
 import numpy as np
 from spacetime.objects.interumCube import interum_cube
 import xarray as xr
+from spacetime.objects.tracing import traced
 
 
 ########################################################################################################################
@@ -43,6 +44,7 @@ def return_time(timeObject):
 
 
 ########################################################################################################################
+@traced()
 def select_time(cube, range="entire", scale = None, element=None):
 
     ds  = cube.get_data_array()
@@ -88,6 +90,7 @@ def select_time(cube, range="entire", scale = None, element=None):
 
 
 ########################################################################################################################
+@traced()
 def scale_time(cube, scale, method):
 
     format = cube.get_time()
@@ -124,6 +127,7 @@ def scale_time(cube, scale, method):
 
 ####
 
+@traced()
 def expand_time(cube, target_time, starting_scale = "month", target_scale = "day"):
 
     startTime = cube.get_time()
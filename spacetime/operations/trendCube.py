@@ -0,0 +1,240 @@
+import numpy as np
+import warnings
+import pandas as pd
+import math
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from spacetime.operations.cubeStream import cube_reader
+from spacetime.objects.interumCube import interum_cube
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: fits a linear trend through the time series of every pixel of a cube at once. Slope, intercept, r2
+# and the p-value of the slope come from closed form moments of the valid values of each series, and the
+# Theil-Sen slope from the median of the pairwise slopes. The cube is streamed in spatial tiles holding the whole
+# series, processed by several workers
+#
+# INPUTS:
+# cube (required): a cube or interum_cube with a single variable (filestotime) or the variable to use
+# variable: name of the variable of a filestovar cube, the first one by default
+# scale: unit of the time axis of the slope, "step" (one per time step), "day" or "year" (from the cube dates)
+# senSlope: if True the Theil-Sen slope is added
+# maxPairs: largest number of pairwise slopes per pixel for Theil-Sen. Longer series use a fixed random sample of
+# pairs, which estimates the median slope
+# workers: number of threads processing tiles
+# budget: memory budget in bytes for the tiles in flight, defaults to the configured memory budget
+#
+# OUTPUT:
+# an interum_cube with one time step and the variables slope, intercept (at the first time step), r2, p_value and
+# sen_slope. Pixels with fewer than three valid values are nodata
+######################################################################################################################
+
+TREND_STATS = ["slope", "intercept", "r2", "p_value", "sen_slope"]
+
+
+@traced()
+def trend_cube(cube, variable=None, scale="step", senSlope=True, maxPairs=5000, workers=4, budget=None):
+
+    if scale not in ["step", "day", "year"]:
+        raise ValueError("scale must be 'step', 'day' or 'year'")
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    reader = cube_reader(cube)
+    T, Y, X = reader.shape
+
+    v = 0
+    if variable != None:
+        v = reader.names.index(variable)
+
+    nodata = reader.nodata
+    if nodata == None:
+        nodata = -9999
+
+    x = time_axis(reader.get_time(), scale)
+    pairs = theil_sen_pairs(T, maxPairs) if senSlope else None
+    stats = TREND_STATS if senSlope else TREND_STATS[:4]
+
+    out = np.empty((len(stats), 1, Y, X), dtype=np.float32)
+
+    # bytes per pixel: the series and its copies plus the pairwise slopes
+    perPixel = T * 8 * 6 + (len(pairs[0]) * 8 * 3 if senSlope else 0)
+    side = int(max(16, np.sqrt(max(1, budget // max(1, workers)) / perPixel)))
+
+    def run_tile(tile):
+
+        ys, xs = tile
+
+        with span("trend_tile"):
+            data = reader.read(v, slice(None), ys, xs)
+            result = pixel_trends(data, x, pairs)
+            for i in range(len(stats)):
+                out[i, 0, ys, xs] = np.where(np.isnan(result[stats[i]]), nodata, result[stats[i]])
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run_tile, reader.spatial_tiles(side)))
+
+    # a map cube: the statistics are its variables on a single time step
+    array = xr.DataArray(data=out, dims=["variables", "time", "lat", "lon"], coords=dict(
+        variables=(["variables"], stats),
+        lon=(["lon"], reader.get_lon()),
+        lat=(["lat"], reader.get_lat()),
+        time=reader.get_time()[:1]))
+
+    ret = interum_cube(cube = cube, array = array, structure = True)
+
+    return ret
+
+
+
+#################################################
+# helper functions for trends
+def time_axis(time, scale):
+
+    if scale == "step":
+        return np.arange(len(time), dtype=np.float64)
+
+    if isinstance(time, pd.DatetimeIndex):
+        out = np.asarray((time - time[0]) / pd.Timedelta(days=1), dtype=np.float64)
+        if scale == "year":
+            out = out / 365.25
+    else:
+        # cubes without dates use their time values as they are
+        out = np.asarray(time, dtype=np.float64)
+        out = out - out[0]
+
+    return out
+
+
+# index pairs (i < j) of the pairwise slopes, a fixed random sample when there are more than maxPairs
+def theil_sen_pairs(T, maxPairs):
+
+    i, j = np.triu_indices(T, k=1)
+
+    if len(i) > maxPairs:
+        pick = np.sort(np.random.default_rng(0).choice(len(i), size=maxPairs, replace=False))
+        i, j = i[pick], j[pick]
+
+    return i, j
+
+
+# trend statistics of the (time, rows, cols) series of a tile with NaN for missing values
+def pixel_trends(data, x, pairs=None):
+
+    valid = ~np.isnan(data)
+    n = valid.sum(axis=0)
+
+    xv = np.where(valid, x[:, None, None], 0)
+    yv = np.where(valid, data, 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+
+        # centered moments of the valid values of each series
+        mx = xv.sum(axis=0) / n
+        my = yv.sum(axis=0) / n
+        dx = np.where(valid, x[:, None, None] - mx, 0)
+        dy = np.where(valid, data - my, 0)
+
+        sxx = (dx * dx).sum(axis=0)
+        syy = (dy * dy).sum(axis=0)
+        sxy = (dx * dy).sum(axis=0)
+
+        slope = sxy / sxx
+        intercept = my - slope * mx
+        r2 = np.where(syy > 0, sxy * sxy / (sxx * syy), 0)
+
+        # two sided p-value of the slope from the t distribution with n - 2 degrees of freedom
+        df = n - 2
+        t2 = r2 / np.maximum(1 - r2, 1e-300) * df
+        pValue = betainc(df / 2, 0.5, df / (df + t2))
+        pValue = np.where(r2 >= 1, 0, pValue)
+
+    enough = n >= 3
+    out = dict(slope=np.where(enough, slope, np.nan),
+               intercept=np.where(enough, intercept, np.nan),
+               r2=np.where(enough, r2, np.nan),
+               p_value=np.where(enough, pValue, np.nan))
+
+    if pairs is not None:
+        i, j = pairs
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slopes = (data[j] - data[i]) / (x[j] - x[i])[:, None, None]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning) # pixels without any pair
+            sen = np.nanmedian(slopes, axis=0)
+        out["sen_slope"] = np.where(enough, sen, np.nan)
+
+    return out
+
+
+# regularized incomplete beta function I_x(a, b), NaN where it is not defined
+def betainc(a, b, x, iterations=300, eps=1e-14):
+
+    a, b, x = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64),
+                                  np.asarray(x, dtype=np.float64))
+    ok = (a > 0) & (b > 0) & (x >= 0) & (x <= 1)
+
+    # the fraction converges quickly below (a + 1) / (a + b + 2), above it use I_x(a, b) = 1 - I_1-x(b, a)
+    flip = ok & (x > (a + 1) / (a + b + 2))
+    p = np.where(ok, np.where(flip, b, a), 1)
+    q = np.where(ok, np.where(flip, a, b), 1)
+    z = np.where(ok, np.where(flip, 1 - x, x), 0)
+
+    with np.errstate(divide="ignore"):
+        front = np.exp(p * np.log(z) + q * np.log1p(-z) - log_beta(p, q)) / p
+
+    value = front * beta_fraction(p, q, z, iterations, eps)
+    out = np.where(flip, 1 - value, value)
+
+    return np.where(ok, out, np.nan)
+
+
+# continued fraction of the incomplete beta function, evaluated with the modified Lentz method
+def beta_fraction(a, b, x, iterations, eps):
+
+    tiny = 1e-300
+
+    def nonzero(v):
+        return np.where(np.abs(v) < tiny, tiny, v)
+
+    c = np.ones_like(x)
+    d = 1 / nonzero(1 - (a + b) * x / (a + 1))
+    out = d
+
+    for m in range(1, iterations + 1):
+
+        # even step
+        coef = m * (b - m) * x / ((a - 1 + 2 * m) * (a + 2 * m))
+        d = 1 / nonzero(1 + coef * d)
+        c = nonzero(1 + coef / c)
+        out = out * d * c
+
+        # odd step
+        coef = -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 1 + 2 * m))
+        d = 1 / nonzero(1 + coef * d)
+        c = nonzero(1 + coef / c)
+        delta = d * c
+        out = out * delta
+
+        if np.all(np.abs(delta - 1) < eps):
+            break
+
+    return out
+
+
+# log of the beta function, the gamma function is evaluated once per distinct argument
+def log_beta(a, b):
+
+    return log_gamma(a) + log_gamma(b) - log_gamma(a + b)
+
+
+def log_gamma(v):
+
+    values, inverse = np.unique(v, return_inverse=True)
+    out = np.array([math.lgamma(x) for x in values])[inverse]
+
+    return out.reshape(np.shape(v))
+#################################################
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from spacetime.operations.cubeStream import cube_reader
+from spacetime.scale.polygonMask import zone_labels
+from spacetime.scale.warpPlan import get_grid
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: computes statistics of a cube per polygon zone and time step in one pass over the data. The polygon
+# layer is rasterized once into a cached label raster on the cube grid; the labelled pixels are sorted by zone so
+# that every time slab is reduced per zone with vectorized reduceat kernels, without a masked copy per zone. Only
+# the bounding window of the polygons is read
+#
+# INPUTS:
+# cube (required): a cube or interum_cube
+# shapeFile (required): path to a polygon layer readable by OGR (e.g. demoData/DelhiShape/Districts.shp)
+# ops: statistic or list of statistics, any of "count", "sum", "mean", "min", "max" and "std"
+# attribute: name of a field of the layer to label the zones with in the output
+# allTouched: if True every pixel touched by a polygon counts towards it
+# workers: number of threads reducing time slabs
+# budget: memory budget in bytes, defaults to the configured memory budget
+#
+# OUTPUT:
+# a tidy DataFrame with one row per zone, time step (and variable) and one column per statistic. Zones without
+# pixels on the grid have a count of 0 and NaN statistics
+######################################################################################################################
+
+ZONAL_OPS = ["count", "sum", "mean", "min", "max", "std"]
+
+
+@traced()
+def zonal_stats(cube, shapeFile, ops=ZONAL_OPS, attribute=None, allTouched=False, workers=4, budget=None):
+
+    if isinstance(ops, str):
+        ops = [ops]
+    for o in ops:
+        if o not in ZONAL_OPS:
+            raise ValueError("ops must be among " + str(ZONAL_OPS) + ", got " + str(o))
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    labels, zones = zone_labels(shapeFile, get_grid(cube), allTouched=allTouched)
+
+    if attribute != None and attribute not in zones.columns:
+        raise ValueError(f"{attribute} is not a field of {shapeFile}.")
+
+    reader = cube_reader(cube)
+    T = reader.shape[0]
+    Z = len(zones)
+
+    # bounding window of the labelled pixels
+    rows = np.flatnonzero(np.any(labels > 0, axis=1))
+    cols = np.flatnonzero(np.any(labels > 0, axis=0))
+    if len(rows) == 0:
+        raise ValueError(f"{shapeFile} does not overlap the cube.")
+    ySlice = slice(int(rows[0]), int(rows[-1]) + 1)
+    xSlice = slice(int(cols[0]), int(cols[-1]) + 1)
+
+    # labelled pixels of the window sorted by zone, and the start of each zone in that order
+    window = labels[ySlice, xSlice].ravel()
+    order = np.argsort(window, kind="stable")
+    order = order[window[order] > 0]
+    present, starts = np.unique(window[order], return_index=True)
+    sizes = np.diff(np.append(starts, len(order)))
+
+    # time slabs that fit the share of the budget of a worker
+    stepBytes = max(1, window.size * 8 * 6)
+    slab = int(max(1, min(T, budget // (max(1, workers) * stepBytes))))
+    if reader.chunks is not None:
+        slab = max(reader.chunks[0], (slab // reader.chunks[0]) * reader.chunks[0])
+
+    results = []
+    for v in range(len(reader.names)):
+
+        stats = dict((o, np.full((T, Z), np.nan)) for o in ops)
+        if "count" in stats:
+            stats["count"] = np.zeros((T, Z), dtype=np.int64)
+
+        def reduce_slab(t):
+
+            with span("zonal_slab"):
+                data = reader.read(v, slice(t, min(T, t + slab)), ySlice, xSlice)
+                data = data.reshape(data.shape[0], -1)[:, order]
+                part = zone_reduce(data, starts, sizes, ops)
+
+            for o in ops:
+                stats[o][t:t + data.shape[0], present - 1] = part[o]
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(reduce_slab, range(0, T, slab)))
+
+        results.append(stats)
+
+    out = zonal_dataframe(results, ops, zones, attribute, reader, cube.get_var_names() is not None)
+
+    return out
+
+
+
+#################################################
+# helper function to reduce (time, pixels) values sorted by zone into (time, zones) statistics
+def zone_reduce(data, starts, sizes, ops):
+
+    valid = ~np.isnan(data)
+
+    count = np.add.reduceat(valid, starts, axis=1)
+    total = np.add.reduceat(np.where(valid, data, 0), starts, axis=1)
+    empty = count == 0
+
+    out = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+
+        mean = total / count
+
+        for o in ops:
+            if o == "count":
+                out[o] = count
+            elif o == "sum":
+                out[o] = np.where(empty, np.nan, total)
+            elif o == "mean":
+                out[o] = mean
+            elif o == "min":
+                out[o] = np.where(empty, np.nan, np.minimum.reduceat(np.where(valid, data, np.inf), starts, axis=1))
+            elif o == "max":
+                out[o] = np.where(empty, np.nan, np.maximum.reduceat(np.where(valid, data, -np.inf), starts, axis=1))
+            elif o == "std":
+                # second pass over the slab around the zone means
+                dev = np.where(valid, data - np.repeat(mean, sizes, axis=1), 0)
+                out[o] = np.sqrt(np.add.reduceat(dev * dev, starts, axis=1) / count)
+
+    return out
+
+
+def zonal_dataframe(results, ops, zones, attribute, reader, multi):
+
+    time = reader.get_time()
+    T = len(time)
+    Z = len(zones)
+
+    frames = []
+    for v in range(len(results)):
+
+        df = pd.DataFrame(dict(zone=np.tile(zones.index.values, T), time=np.repeat(time, Z)))
+        if attribute != None:
+            df.insert(1, attribute, np.tile(zones[attribute].values, T))
+        if multi:
+            df["variables"] = reader.names[v]
+        for o in ops:
+            df[o] = results[v][o].ravel()
+
+        frames.append(df)
+
+    out = pd.concat(frames, ignore_index=True)
+    if multi:
+        out["variables"] = out["variables"].astype("category")
+
+    return out
+#################################################
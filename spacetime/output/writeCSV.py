@@ -1,7 +1,10 @@
 import pandas as pd
 from spacetime.operations.cubeToDataframe import cube_to_dataframe
+from spacetime.objects.tracing import traced, add_bytes
+import os
 
 
+@traced()
 def write_csv(cube=None, file_name=None):
 
     shapeval = cube.get_shapeval()
@@ -23,3 +26,7 @@ def write_csv(cube=None, file_name=None):
         final_df.to_csv(file_name, encoding='UTF8')
     else:
         df.to_csv(file_name, encoding='UTF8')
+
+    # only paths have a size on disk, None returns nothing and buffers are left to the caller
+    if isinstance(file_name, (str, os.PathLike)):
+        add_bytes(written=os.path.getsize(file_name))
@@ -1,6 +1,7 @@
 import netCDF4 as nc
 import numpy as np
 from osgeo import gdal
+from spacetime.objects.tracing import traced
 
 ######################################################################################################################
 # DESCRIPTION: write_cube writes out a .nc file from the input of the raster_trim function and
@@ -19,6 +20,7 @@ from osgeo import gdal
 # It outputs a netCDF4 dataset and writes a .nc file to disk
 ######################################################################################################################
 
+@traced()
 def write_cube(rastList=None, yCoords=None, xCoords=None, fileName=None, timePoints=None):
 
     if rastList is None:
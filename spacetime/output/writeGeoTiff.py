@@ -0,0 +1,192 @@
+from osgeo import gdal
+import netCDF4 as nc
+import numpy as np
+import pandas as pd
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from spacetime.scale.warpPlan import get_grid, mem_dataset
+from spacetime.objects.tracing import traced, span, add_bytes
+
+
+######################################################################################################################
+# DESCRIPTION: write_geotiff exports time slices of a cube as cloud optimized GeoTIFFs, one file per time step and
+# variable: tiled, compressed and with internal overviews, georeferenced from the cube's spatial_ref and the upper
+# left corners on its lat/lon axes. Slices of cube files are written by a pool of processes, each reading its own
+# slice from the file, so the cube is never loaded as a whole. Slices of interum cubes, which only live in memory,
+# are taken one at a time by a pool of threads instead of being copied to the processes
+#
+# INPUTS:
+# cube (required): a cube or interum_cube
+# outDir (required): directory for the GeoTIFFs, created if needed
+# times: index or list of indices of the time steps to write, all by default
+# variables: name or list of names of the variables of a filestovar cube, all by default
+# prefix: start of the file names, followed by the variable (filestovar cubes) and the date of the slice
+# resampling: resampling of the overviews, "average", "nearest" (for classes), "mode", "min" or "max"
+# blockSize: side of the internal tiles in pixels, overviews are built down to a single tile
+# compress: compression of the tiles, "DEFLATE", "LZW", "ZSTD" or "NONE"
+# workers: number of processes (threads for interum cubes) writing slices
+#
+# OUTPUT:
+# a list of the paths of the GeoTIFFs written, in the order of the slices
+######################################################################################################################
+
+COG_RESAMPLING = ["average", "nearest", "mode", "min", "max"]
+
+
+@traced()
+def write_geotiff(cube, outDir, times=None, variables=None, prefix="cube", resampling="average", blockSize=512,
+                  compress="DEFLATE", workers=4):
+
+    if resampling not in COG_RESAMPLING:
+        raise ValueError("resampling must be one of " + str(COG_RESAMPLING))
+    if blockSize % 16 != 0:
+        raise ValueError("blockSize must be a multiple of 16.")
+
+    os.makedirs(outDir, exist_ok=True)
+
+    time = cube.get_time()
+    if times is None:
+        times = range(len(time))
+    elif np.ndim(times) == 0:
+        times = [times]
+    times = [int(t) for t in times]
+
+    names = cube.get_var_names()
+    filestovar = names is not None
+    if not filestovar:
+        names = ["value"]
+    names = [str(x) for x in names]
+
+    if variables is not None:
+        if isinstance(variables, str):
+            variables = [variables]
+        for v in variables:
+            if v not in names:
+                raise ValueError("variable " + str(v) + " is not in the cube: " + str(names))
+        names = [str(v) for v in variables]
+
+    nodata = cube.get_nodata_value()
+    if nodata == None:
+        nodata = -9999
+
+    grid = get_grid(cube)
+    labels = time_labels(time)
+    driver = cog_driver()
+    options = (driver, cog_options(driver, resampling, blockSize, compress))
+
+    # file cubes are read in the workers from the path, interum cubes only live in memory and pass their slices
+    interum = "interum_cube" in str(type(cube))
+    if interum:
+        array = cube.get_data_array()
+        if len(array.shape) == 3:
+            array = array.expand_dims("variables")
+        array = array.transpose("variables", "time", "lat", "lon")
+        index = [list(np.array(array.variables).astype(str)).index(v) for v in names] if filestovar else [0]
+        source = None
+    else:
+        source = cube.get_GDAL_data().filepath()
+
+    slices = [(t, i) for t in times for i in range(len(names))]
+
+    # the job of a slice, with its data only for interum cubes
+    def slice_job(s):
+
+        t, i = s
+        parts = [prefix] + ([names[i]] if filestovar else []) + [labels[t]]
+        outName = os.path.join(outDir, "_".join(parts) + ".tif")
+        data = np.asarray(array[index[i], t].values) if interum else None
+
+        return (source, names[i], t, data, nodata, grid, outName, options, resampling, blockSize)
+
+    with span("geotiff_slices"):
+        if workers <= 1 or len(slices) <= 1:
+            out = [write_slice(slice_job(s)) for s in slices]
+        elif interum:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                out = list(pool.map(lambda s: write_slice(slice_job(s)), slices))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                out = list(pool.map(write_slice, (slice_job(s) for s in slices)))
+
+    add_bytes(written=sum(os.path.getsize(x) for x in out))
+
+    return out
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+#################################################
+# helper functions for the GeoTIFF export
+
+# file name labels of the time steps, dates when the cube has them
+def time_labels(time):
+
+    if isinstance(time, pd.DatetimeIndex):
+        if (time == time.normalize()).all():
+            return list(time.strftime("%Y%m%d"))
+        return list(time.strftime("%Y%m%dT%H%M%S"))
+
+    return [str(t) for t in range(len(time))]
+
+
+# the COG driver (GDAL >= 3.1) lays out tiles and overviews itself, older GDAL copies them from a GTiff
+def cog_driver():
+
+    if gdal.GetDriverByName("COG") != None:
+        return "COG"
+    return "GTiff"
+
+
+def cog_options(driver, resampling, blockSize, compress):
+
+    compress = compress.upper()
+
+    if driver == "COG":
+        options = ["BLOCKSIZE=" + str(blockSize), "COMPRESS=" + compress, "BIGTIFF=IF_SAFER",
+                   "OVERVIEW_RESAMPLING=" + resampling.upper()]
+        if compress != "NONE":
+            options.append("PREDICTOR=YES")
+        return options
+
+    options = ["TILED=YES", "BLOCKXSIZE=" + str(blockSize), "BLOCKYSIZE=" + str(blockSize),
+               "COMPRESS=" + compress, "BIGTIFF=IF_SAFER", "COPY_SRC_OVERVIEWS=YES"]
+    if compress != "NONE":
+        options.append("PREDICTOR=3")
+    return options
+
+
+# write one slice, run in a worker process or thread
+def write_slice(job):
+
+    source, name, t, data, nodata, grid, outName, (driver, options), resampling, blockSize = job
+
+    if data is None:
+        ds = nc.Dataset(source, "r")
+        try:
+            data = ds.variables[name][t]
+        finally:
+            ds.close()
+
+    # masked values and NaN (left by read_data for nodata) both become nodata
+    data = np.ma.filled(np.ma.asarray(data).astype(np.float32), nodata)
+    data[~np.isfinite(data)] = nodata
+
+    mem = mem_dataset(data, grid, nodata=nodata)
+
+    if driver == "GTiff":
+        # overviews of the memory copy halve the grid down to a single tile, copied into the file
+        factors = []
+        while max(grid[1]) / 2 ** len(factors) > blockSize:
+            factors.append(2 ** (len(factors) + 1))
+        if len(factors) > 0:
+            mem.BuildOverviews(resampling.upper(), factors)
+
+    out = gdal.GetDriverByName(driver).CreateCopy(outName, mem, options=options)
+    out.FlushCache()
+    out = None
+    mem = None
+
+    return outName
+#################################################
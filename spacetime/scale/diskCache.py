@@ -0,0 +1,258 @@
+from osgeo import gdal
+import numpy as np
+import argparse
+import hashlib
+import json
+import shutil
+import time
+import os
+from spacetime.scale.warpPlan import TILED_OPTIONS
+
+
+# cache location and size limit, both can be set from the environment
+DEFAULT_CACHE_DIR = os.environ.get("SPACETIME_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "spacetime"))
+DEFAULT_MAX_SIZE = int(float(os.environ.get("SPACETIME_CACHE_SIZE", 10 * 1024 ** 3)))
+
+# creation options for cached rasters
+CACHE_OPTIONS = TILED_OPTIONS
+
+
+######################################################################################################################
+# DESCRIPTION: disk_cache is an opt-in on-disk store for aligned and trimmed rasters. Entries are keyed on the
+# identity of the input files (path, size and mtime, or a content hash) plus the operation parameters, and are
+# stored as tiled, compressed GeoTIFFs. The least recently used entries are evicted once the cache is over size
+#
+# INPUTS:
+# path: directory of the cache. Defaults to $SPACETIME_CACHE or ~/.cache/spacetime
+# maxSize: size limit in bytes. Defaults to $SPACETIME_CACHE_SIZE or 10 GB
+# hashContent: if True inputs are identified by a hash of their bytes instead of size and mtime
+#
+# OUTPUT:
+# a disk_cache object
+######################################################################################################################
+class disk_cache(object):
+
+    def __init__(self, path=None, maxSize=None, hashContent=False):
+
+        if path == None:
+            path = DEFAULT_CACHE_DIR
+        if maxSize == None:
+            maxSize = DEFAULT_MAX_SIZE
+
+        self.path = path
+        self.maxSize = maxSize
+        self.hashContent = hashContent
+
+        os.makedirs(self.path, exist_ok=True)
+
+
+    # key for a list of gdal datasets, an operation name and its parameters
+    def key(self, rastList, operation, params):
+
+        h = hashlib.sha256()
+        h.update(operation.encode())
+        h.update(repr(params).encode())
+
+        for ds in rastList:
+            h.update(self.identity(ds).encode())
+
+        return h.hexdigest()
+
+
+    # identity of a gdal dataset from its files, or from its VRT definition or pixels when it only lives in memory
+    def identity(self, ds):
+
+        out = [repr(ds.GetGeoTransform()), ds.GetProjection(), str((ds.RasterXSize, ds.RasterYSize, ds.RasterCount))]
+
+        files = ds.GetFileList() or []
+        for f in files:
+            if os.path.isfile(f):
+                if self.hashContent == True:
+                    out.append(f + ":" + file_hash(f))
+                else:
+                    stat = os.stat(f)
+                    out.append(os.path.abspath(f) + ":" + str(stat.st_size) + ":" + str(stat.st_mtime_ns))
+
+        vrt = ds.GetMetadata("xml:VRT")
+        if vrt:
+            out.append(vrt[0])
+
+        if len(files) == 0 and not vrt:
+            out.append(hashlib.sha256(np.ascontiguousarray(ds.ReadAsArray()).tobytes()).hexdigest())
+
+        return "|".join(out)
+
+
+    # returns the cached datasets for a key or None on a miss
+    def get(self, key):
+
+        entry = os.path.join(self.path, key)
+        meta = os.path.join(entry, "meta.json")
+
+        if not os.path.isfile(meta):
+            return None
+
+        with open(meta) as f:
+            files = json.load(f)["files"]
+
+        out = [gdal.Open(os.path.join(entry, x)) for x in files]
+        if any(x is None for x in out):
+            return None
+
+        # mark as recently used
+        os.utime(meta)
+
+        return out
+
+
+    # writes datasets to the cache and returns them opened from the cache
+    def put(self, key, rastList, operation=None, params=None):
+
+        entry = os.path.join(self.path, key)
+        temp = entry + ".tmp" + str(os.getpid())
+        os.makedirs(temp, exist_ok=True)
+
+        files = []
+        for i in range(len(rastList)):
+            name = str(i).zfill(4) + ".tif"
+            ds = gdal.Translate(os.path.join(temp, name), rastList[i], format="GTiff", creationOptions=CACHE_OPTIONS)
+            ds = None # flush to disk
+            files.append(name)
+
+        with open(os.path.join(temp, "meta.json"), "w") as f:
+            json.dump(dict(operation=operation, params=repr(params), files=files, created=time.time()), f)
+
+        # another process may have written the same entry in the meantime
+        if os.path.isdir(entry):
+            shutil.rmtree(temp, ignore_errors=True)
+        else:
+            os.replace(temp, entry)
+
+        self.evict()
+
+        out = self.get(key)
+        if out == None:
+            out = rastList
+
+        return out
+
+
+    # list of the cache entries with their size and last access, most recent first
+    def entries(self):
+
+        out = []
+        for name in os.listdir(self.path):
+
+            meta = os.path.join(self.path, name, "meta.json")
+            if ".tmp" in name or not os.path.isfile(meta):
+                continue
+
+            with open(meta) as f:
+                info = json.load(f)
+
+            size = sum(os.path.getsize(os.path.join(self.path, name, x)) for x in os.listdir(os.path.join(self.path, name)))
+
+            out.append(dict(key=name, operation=info.get("operation"), files=len(info["files"]), size=size,
+                            created=info.get("created"), accessed=os.path.getmtime(meta)))
+
+        out.sort(key=lambda x: x["accessed"], reverse=True)
+
+        return out
+
+
+    def info(self):
+
+        entries = self.entries()
+        out = dict(path=self.path, entries=len(entries), size=sum(x["size"] for x in entries), maxSize=self.maxSize)
+
+        return out
+
+
+    # drops least recently used entries until the cache fits in maxSize
+    def evict(self, maxSize=None):
+
+        if maxSize == None:
+            maxSize = self.maxSize
+
+        entries = self.entries()
+        total = sum(x["size"] for x in entries)
+
+        removed = 0
+        while total > maxSize and len(entries) > 0:
+            old = entries.pop()
+            shutil.rmtree(os.path.join(self.path, old["key"]), ignore_errors=True)
+            total = total - old["size"]
+            removed += 1
+
+        return removed
+
+
+    def clear(self):
+
+        return self.evict(maxSize=0)
+######################################################################################################################
+# END CLASS
+######################################################################################################################
+
+
+
+#################################################
+# helper function to turn the cache argument of an operation into a disk_cache (or None when caching is off)
+def get_cache(cache):
+
+    if cache == None or cache is False:
+        out = None
+    elif cache is True:
+        out = disk_cache()
+    elif isinstance(cache, str):
+        out = disk_cache(path=cache)
+    else:
+        out = cache
+
+    return out
+
+
+def file_hash(fileName, blockSize=2 ** 20):
+
+    h = hashlib.sha256()
+    with open(fileName, "rb") as f:
+        for block in iter(lambda: f.read(blockSize), b""):
+            h.update(block)
+
+    return h.hexdigest()
+#################################################
+
+
+
+#################################################
+# command line access to the cache: python -m spacetime.scale.diskCache [info|list|clear]
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m spacetime.scale.diskCache", description="Inspect or clear the spacetime raster cache.")
+    parser.add_argument("command", choices=["info", "list", "clear", "evict"])
+    parser.add_argument("--path", default=None, help="cache directory")
+    parser.add_argument("--max-size", type=float, default=None, help="size limit in bytes for evict")
+    args = parser.parse_args(argv)
+
+    store = disk_cache(path=args.path)
+
+    if args.command == "info":
+        info = store.info()
+        print(f"{info['path']}: {info['entries']} entries, {info['size'] / 1024 ** 2:.1f} MB of {info['maxSize'] / 1024 ** 2:.1f} MB")
+
+    if args.command == "list":
+        for x in store.entries():
+            accessed = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(x["accessed"]))
+            print(f"{x['key'][:16]}  {x['operation']}  {x['files']} files  {x['size'] / 1024 ** 2:.1f} MB  {accessed}")
+
+    if args.command == "clear":
+        print(f"removed {store.clear()} entries")
+
+    if args.command == "evict":
+        maxSize = None if args.max_size == None else int(args.max_size)
+        print(f"removed {store.evict(maxSize)} entries")
+
+
+if __name__ == '__main__':
+    main()
+#################################################
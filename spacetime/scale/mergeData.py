@@ -0,0 +1,316 @@
+from osgeo import gdal
+from osgeo import osr
+import numpy as np
+import threading
+import tempfile
+import os
+from concurrent.futures import ThreadPoolExecutor
+from spacetime.input.readData import read_data
+from spacetime.operations.cubeStream import cube_reader
+from spacetime.operations.loadCube import load_cube
+from spacetime.objects.writeNETCDF import create_netcdf
+from spacetime.objects.ioStats import read_band
+from spacetime.objects.memoryPlan import get_memory_budget
+from spacetime.scale.warpPlan import get_grid, grid_windows, TILED_OPTIONS
+from spacetime.objects.tracing import traced, span
+
+
+######################################################################################################################
+# DESCRIPTION: merge_data mosaics spatially adjacent tiles into one dataset on the union of their grids. The output
+# is written block by block, each block only reading the windows of the tiles that overlap it, so the full mosaic
+# is never held in memory. Tiles must share the SRS and pixel size and sit on the same pixel lattice (use
+# raster_align with a template first if they do not)
+#
+# INPUTS:
+# data (required): a list of file_objects (each holding the same number of rasters and bands, e.g. one raster per
+# year) or a list of cubes (with the same time steps and variables)
+# rule: where tiles overlap "first" keeps the first valid value, "last" the last valid value, "mean" averages the
+# valid values and "max"/"min" keep the largest/smallest valid value. Nodata never overrides a valid value
+# fileName: output directory for file_objects (one GeoTIFF per raster) or the .nc file for cubes. Defaults to a
+# temporary location
+# noneVal: nodata value of the output. Defaults to the nodata value of the first tile or -9999
+# blockSize: side of the square output blocks in pixels
+# workers: number of blocks merged at the same time
+# budget: memory budget in bytes for the blocks in flight, defaults to the configured memory budget
+# tol: tolerance, in pixels, for tiles to count as sitting on the same lattice, on top of the rounding of the float32
+# lat/lon of cubes
+#
+# OUTPUT:
+# a file_object of the merged GeoTIFFs or a cube of the merged netCDF file
+######################################################################################################################
+
+MERGE_RULES = ["first", "last", "mean", "max", "min"]
+
+
+@traced()
+def merge_data(data, rule="first", fileName=None, noneVal=None, blockSize=512, workers=4, budget=None, tol=1e-3):
+
+    if rule not in MERGE_RULES:
+        raise ValueError("rule must be one of " + str(MERGE_RULES))
+    if len(data) == 0:
+        raise ValueError("merge_data needs at least one tile.")
+
+    if budget == None:
+        budget = get_memory_budget()
+
+    if all("file_object" in str(type(x)) for x in data):
+        out = merge_files(data, rule, fileName, noneVal, blockSize, workers, tol)
+    elif all("cube" in str(type(x)) for x in data):
+        out = merge_cubes(data, rule, fileName, noneVal, blockSize, workers, budget, tol)
+    else:
+        raise ValueError("data must be a list of file_objects or a list of cubes.")
+
+    return out
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+#################################################
+# helper function to mosaic file_objects into one tiled GeoTIFF per raster
+def merge_files(data, rule, outDir, noneVal, blockSize, workers, tol):
+
+    counts = set(len(x.get_GDAL_data()) for x in data)
+    if len(counts) > 1:
+        raise ValueError("every file_object must hold the same number of rasters.")
+
+    if outDir == None:
+        outDir = tempfile.mkdtemp(prefix="spacetime_merge_")
+    os.makedirs(outDir, exist_ok=True)
+
+    lock = threading.Lock()
+    outNames = []
+
+    for i in range(counts.pop()):
+
+        rasters = [x.get_GDAL_data()[i] for x in data]
+        bands = set(r.RasterCount for r in rasters)
+        if len(bands) > 1:
+            raise ValueError(f"raster {i} does not have the same number of bands in every file_object.")
+        bands = bands.pop()
+
+        grid, windows = union_grid([get_grid(r) for r in rasters], tol)
+        gt, dims, wkt = grid
+
+        nodata = noneVal
+        if nodata == None:
+            nodata = rasters[0].GetRasterBand(1).GetNoDataValue()
+        if nodata == None:
+            nodata = -9999
+
+        name = os.path.join(outDir, "merged_" + str(i) + ".tif")
+        out = gdal.GetDriverByName("GTiff").Create(name, dims[0], dims[1], bands, gdal.GDT_Float32,
+                                                   options=TILED_OPTIONS)
+        out.SetGeoTransform(gt)
+        out.SetProjection(wkt)
+        for b in range(bands):
+            out.GetRasterBand(b + 1).SetNoDataValue(nodata)
+
+        def reader(tile, ds):
+
+            def read(y0, y1, x0, x1):
+                layers = []
+                with lock:
+                    for b in range(bands):
+                        band = ds.GetRasterBand(b + 1)
+                        values = read_band(band, x0, y0, x1 - x0, y1 - y0, stats=tile.ioStats,
+                                           source=str(id(ds))).astype(np.float64)
+                        if band.GetNoDataValue() != None:
+                            values[values == band.GetNoDataValue()] = np.nan
+                        layers.append(values)
+                return np.array(layers)
+
+            return read
+
+        sources = [(windows[j], reader(data[j], rasters[j])) for j in range(len(rasters))]
+
+        def write_block(window):
+
+            yoff, xoff, ysize, xsize = window
+            with span("merge_block"):
+                block = merge_window(sources, window, bands, rule)
+                block = np.where(np.isnan(block), nodata, block)
+                with lock:
+                    for b in range(bands):
+                        out.GetRasterBand(b + 1).WriteArray(block[b], xoff, yoff)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(write_block, grid_windows(dims, blockSize)))
+
+        out.FlushCache()
+        out = None
+        outNames.append(name)
+
+    return read_data(outNames)
+
+
+# helper function to mosaic cubes into one netCDF cube, in time slabs that fit the budget
+def merge_cubes(data, rule, fileName, noneVal, blockSize, workers, budget, tol):
+
+    readers = [cube_reader(x) for x in data]
+
+    if len(set(r.shape[0] for r in readers)) > 1:
+        raise ValueError("every cube must have the same number of time steps.")
+    if len(set(tuple(r.names) for r in readers)) > 1:
+        raise ValueError("every cube must have the same variables.")
+
+    grid, windows = union_grid([get_grid(x) for x in data], tol)
+    gt, dims, wkt = grid
+    T = readers[0].shape[0]
+    names = readers[0].names
+
+    nodata = noneVal
+    if nodata == None:
+        nodata = data[0].get_nodata_value()
+    if nodata == None:
+        nodata = -9999
+
+    if fileName == None:
+        handle, fileName = tempfile.mkstemp(prefix="spacetime_merge_", suffix=".nc")
+        os.close(handle)
+
+    lat = gt[3] + np.arange(dims[1]) * gt[5]
+    lon = gt[0] + np.arange(dims[0]) * gt[1]
+
+    ds = create_netcdf(fileName, lat, lon, data[0].get_time(), names, wkt, data[0].get_epsg_code(), nodata=nodata)
+
+    # netCDF4 is not thread safe, so the reads of every tile and the writes share one lock
+    lock = threading.Lock()
+    for r in readers:
+        r.lock = lock
+
+    # time steps per block for each worker's share of the budget
+    slab = int(max(1, min(T, budget // (max(1, workers) * 4 * blockSize * blockSize * 8))))
+
+    def reader(r, v, t0, t1):
+
+        def read(y0, y1, x0, x1):
+            return r.read(v, slice(t0, t1), slice(y0, y1), slice(x0, x1))
+
+        return read
+
+    def write_block(job):
+
+        v, t0, window = job
+        yoff, xoff, ysize, xsize = window
+        t1 = min(T, t0 + slab)
+
+        with span("merge_block"):
+            sources = [(windows[j], reader(readers[j], v, t0, t1)) for j in range(len(readers))]
+            block = merge_window(sources, window, t1 - t0, rule)
+            block = np.where(np.isnan(block), nodata, block)
+            with lock:
+                ds.variables[names[v]][t0:t1, yoff:yoff + ysize, xoff:xoff + xsize] = block
+
+    jobs = [(v, t0, w) for v in range(len(names)) for t0 in range(0, T, slab) for w in grid_windows(dims, blockSize)]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(write_block, jobs))
+
+    ds.close()
+
+    return load_cube(fileName)
+
+
+# helper function to find the union grid of tiles on a common lattice and the window [xoff, yoff, xsize, ysize]
+# of every tile in it. The lattice is the corner and pixel size of the first tile, every check is in its pixels
+def union_grid(grids, tol=1e-3):
+
+    gt0, dims0, wkt0 = grids[0]
+    srs0 = osr.SpatialReference(wkt=wkt0)
+
+    xSize = gt0[1]
+    ySize = gt0[5]
+
+    offsets = []
+    for gt, dims, wkt in grids:
+
+        if wkt != wkt0 and not srs0.IsSame(osr.SpatialReference(wkt=wkt)):
+            raise ValueError("all tiles must share the same SRS, align them with raster_align first.")
+        if gt[2] != 0 or gt[4] != 0:
+            raise ValueError("rotated grids cannot be merged.")
+
+        xTol = lattice_tol(gt[0], gt0[0], xSize, tol)
+        yTol = lattice_tol(gt[3], gt0[3], ySize, tol)
+
+        # a different pixel size drifts off the lattice across the tile
+        if abs(gt[1] - xSize) * dims[0] / abs(xSize) > xTol or abs(gt[5] - ySize) * dims[1] / abs(ySize) > yTol:
+            raise ValueError("all tiles must have the same pixel size, align them with raster_align first.")
+
+        xoff = (gt[0] - gt0[0]) / xSize
+        yoff = (gt[3] - gt0[3]) / ySize
+
+        if abs(xoff - round(xoff)) > xTol or abs(yoff - round(yoff)) > yTol:
+            raise ValueError("tiles are not on the same pixel lattice, align them with raster_align first.")
+
+        offsets.append((int(round(xoff)), int(round(yoff)), dims))
+
+    x0 = min(o[0] for o in offsets)
+    y0 = min(o[1] for o in offsets)
+
+    windows = [[xoff - x0, yoff - y0, dims[0], dims[1]] for xoff, yoff, dims in offsets]
+
+    xDim = max(w[0] + w[2] for w in windows)
+    yDim = max(w[1] + w[3] for w in windows)
+
+    # the union starts at the corners of the tiles on its edges
+    left = [g[0][0] for g, o in zip(grids, offsets) if o[0] == x0][0]
+    top = [g[0][3] for g, o in zip(grids, offsets) if o[1] == y0][0]
+
+    out = ((left, xSize, 0.0, top, 0.0, ySize), (xDim, yDim), wkt0)
+
+    return out, windows
+
+
+# helper function to get the tolerance in pixels of two corners on a lattice: tol plus the float32 rounding of both
+# corners, which is how cubes store their lat/lon
+def lattice_tol(corner, corner0, size, tol):
+
+    rounding = np.spacing(np.float32(abs(corner))) + np.spacing(np.float32(abs(corner0)))
+
+    return tol + float(rounding) / abs(size)
+
+
+# helper function to merge the tiles overlapping an output window [yoff, xoff, ysize, xsize] into a
+# (layers, ysize, xsize) block, NaN where no tile has a valid value
+def merge_window(sources, window, layers, rule):
+
+    yoff, xoff, ysize, xsize = window
+
+    out = np.full((layers, ysize, xsize), np.nan)
+    if rule == "mean":
+        count = np.zeros((layers, ysize, xsize))
+
+    # the last valid value is the first one when going backwards
+    if rule == "last":
+        sources = sources[::-1]
+
+    for (tx, ty, tw, th), read in sources:
+
+        y0, y1 = max(yoff, ty), min(yoff + ysize, ty + th)
+        x0, x1 = max(xoff, tx), min(xoff + xsize, tx + tw)
+        if y0 >= y1 or x0 >= x1:
+            continue
+
+        values = read(y0 - ty, y1 - ty, x0 - tx, x1 - tx)
+        valid = ~np.isnan(values)
+        dst = out[:, y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff]
+
+        if rule in ["first", "last"]:
+            fill = valid & np.isnan(dst)
+            dst[fill] = values[fill]
+        elif rule == "max":
+            dst[:] = np.fmax(dst, values)
+        elif rule == "min":
+            dst[:] = np.fmin(dst, values)
+        else:
+            dst[:] = np.where(valid, np.where(np.isnan(dst), 0, dst) + values, dst)
+            count[:, y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] += valid
+
+    if rule == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = np.where(count > 0, out / count, np.nan)
+
+    return out
+#################################################
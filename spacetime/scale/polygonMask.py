@@ -0,0 +1,249 @@
+from osgeo import gdal
+from osgeo import ogr
+import numpy as np
+import xarray as xr
+import pandas as pd
+import os
+from spacetime.objects.interumCube import interum_cube
+from spacetime.scale.warpPlan import get_grid, grid_key, mem_dataset
+from spacetime.objects.tracing import traced, span
+from spacetime.objects.ioStats import read_variable
+
+
+# cache of rasterized polygon masks keyed by shapefile identity and target grid
+MASK_CACHE = {}
+
+# cache of zone label rasters keyed the same way
+LABEL_CACHE = {}
+
+
+######################################################################################################################
+# DESCRIPTION: polygon_mask rasterizes a polygon layer once onto a raster grid and returns a boolean mask cropped
+# to the bounding window of the polygons. Masks are cached, so every raster or cube on the same grid reuses it
+#
+# INPUTS:
+# shapeFile (required): path to a polygon layer readable by OGR (e.g. demoData/DelhiShape/Districts.shp)
+# grid (required): a grid tuple from get_grid or anything get_grid accepts (raster, file_object, cube)
+# allTouched: if True every pixel touched by a polygon is kept, otherwise only pixels whose center is inside
+#
+# OUTPUT:
+# a tuple of the boolean mask and its window [xoff, yoff, xsize, ysize] on the grid
+######################################################################################################################
+@traced()
+def polygon_mask(shapeFile, grid, allTouched=False):
+
+    if not isinstance(grid, tuple):
+        grid = get_grid(grid)
+
+    stat = os.stat(shapeFile)
+    key = (os.path.abspath(shapeFile), stat.st_mtime, stat.st_size, grid_key(grid), allTouched)
+
+    if key not in MASK_CACHE:
+
+        with span("rasterize", file=shapeFile):
+            full = rasterize_shapes(shapeFile, grid, allTouched=allTouched) > 0
+
+        rows = np.flatnonzero(np.any(full, axis=1))
+        cols = np.flatnonzero(np.any(full, axis=0))
+
+        if len(rows) == 0:
+            raise ValueError(f"{shapeFile} does not overlap the raster grid.")
+
+        window = [int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)]
+        mask = full[window[1]:window[1] + window[3], window[0]:window[0] + window[2]]
+
+        MASK_CACHE[key] = (mask, window)
+
+    return MASK_CACHE[key]
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+######################################################################################################################
+# DESCRIPTION: clip_cube crops a cube to the bounding window of a polygon layer and sets pixels outside the
+# polygons to the nodata value, using a cached polygon mask instead of a cutline warp
+#
+# INPUTS:
+# cube (required): a cube or interum_cube
+# shapeFile (required): path to a polygon layer readable by OGR
+# allTouched: if True every pixel touched by a polygon is kept
+#
+# OUTPUT:
+# an interum_cube holding the clipped data
+######################################################################################################################
+@traced()
+def clip_cube(cube, shapeFile, allTouched=False):
+
+    mask, window = polygon_mask(shapeFile, get_grid(cube), allTouched=allTouched)
+    xoff, yoff, xsize, ysize = window
+
+    lat = np.asarray(cube.get_lat())[yoff:yoff + ysize]
+    lon = np.asarray(cube.get_lon())[xoff:xoff + xsize]
+    nodata = cube.get_nodata_value()
+
+    if "interum_cube" in str(type(cube)):
+
+        ds = cube.get_data_array().isel(lat=slice(yoff, yoff + ysize), lon=slice(xoff, xoff + xsize))
+
+    else:
+
+        # only read the window of the polygons from the file
+        ncData = cube.get_GDAL_data()
+        names = cube.get_var_names()
+
+        if names == None:
+            out = read_variable(ncData.variables["value"], (slice(None), slice(yoff, yoff + ysize), slice(xoff, xoff + xsize)),
+                                stats=cube.ioStats)
+            ds = xr.DataArray(data=out, dims=["time", "lat", "lon"], coords=dict(
+                lon=(["lon"], lon),
+                lat=(["lat"], lat),
+                time=cube.get_time()))
+        else:
+            outList = []
+            for i in range(len(names)):
+                outList.append(read_variable(ncData.variables[names[i]], (slice(None), slice(yoff, yoff + ysize),
+                                             slice(xoff, xoff + xsize)), stats=cube.ioStats))
+
+            ds = xr.DataArray(data=np.array(outList), dims=["variables", "time", "lat", "lon"], coords=dict(
+                variables=(["variables"], names),
+                lon=(["lon"], lon),
+                lat=(["lat"], lat),
+                time=cube.get_time()))
+
+    out = ds.where(xr.DataArray(mask, dims=["lat", "lon"]), nodata)
+
+    if len(out.shape) >= 4:
+        filestovar = True
+    else:
+        filestovar = False
+
+    ret = interum_cube(cube = cube, array = out, structure = filestovar)
+
+    return ret
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+#################################################
+# helper function to rasterize a polygon layer onto a grid. Features are reprojected to the grid SRS first.
+# Pixels get the value of attribute (or 1) and 0 outside the polygons
+def rasterize_shapes(shapeFile, grid, attribute=None, allTouched=False):
+
+    vector = memory_layer(shapeFile, grid[2])
+    out = burn_layer(vector, grid, attribute, allTouched)
+
+    return out
+
+
+# polygon layer reprojected into an in memory OGR dataset
+def memory_layer(shapeFile, wkt):
+
+    out = gdal.VectorTranslate('', shapeFile, format='Memory', dstSRS=wkt, geometryType='PROMOTE_TO_MULTI')
+
+    return out
+
+
+def burn_layer(vector, grid, attribute=None, allTouched=False):
+
+    gt, dims, wkt = grid
+
+    target = gdal.GetDriverByName("MEM").Create("", dims[0], dims[1], 1, gdal.GDT_Int32)
+    target.SetGeoTransform(gt)
+    target.SetProjection(wkt)
+
+    if attribute == None:
+        gdal.Rasterize(target, vector, burnValues=[1], allTouched=allTouched)
+    else:
+        gdal.Rasterize(target, vector, attribute=attribute, allTouched=allTouched)
+
+    out = target.GetRasterBand(1).ReadAsArray()
+
+    return out
+#################################################
+
+
+
+######################################################################################################################
+# DESCRIPTION: zone_labels rasterizes a polygon layer once onto a grid as an integer label raster, where each
+# pixel holds the zone id (feature number + 1) of the polygon covering it and 0 outside the polygons. Where
+# polygons overlap the later feature wins. Label rasters are cached like polygon masks
+#
+# INPUTS:
+# shapeFile (required): path to a polygon layer readable by OGR
+# grid (required): a grid tuple from get_grid or anything get_grid accepts (raster, file_object, cube)
+# allTouched: if True every pixel touched by a polygon is labelled, otherwise only pixels whose center is inside
+#
+# OUTPUT:
+# a tuple of the int32 label raster and a DataFrame of the feature attributes indexed by zone id
+######################################################################################################################
+@traced()
+def zone_labels(shapeFile, grid, allTouched=False):
+
+    if not isinstance(grid, tuple):
+        grid = get_grid(grid)
+
+    stat = os.stat(shapeFile)
+    key = (os.path.abspath(shapeFile), stat.st_mtime, stat.st_size, grid_key(grid), allTouched)
+
+    if key not in LABEL_CACHE:
+
+        with span("rasterize", file=shapeFile):
+
+            vector = memory_layer(shapeFile, grid[2])
+            layer = vector.GetLayer(0)
+
+            # number the features in a new field and burn it
+            layer.CreateField(ogr.FieldDefn("zone_id", ogr.OFTInteger))
+
+            rows = []
+            layer.ResetReading()
+            for i, feature in enumerate(layer):
+                rows.append(feature.items())
+                feature.SetField("zone_id", i + 1)
+                layer.SetFeature(feature)
+
+            labels = burn_layer(vector, grid, attribute="zone_id", allTouched=allTouched)
+
+        zones = pd.DataFrame(rows, index=pd.RangeIndex(1, len(rows) + 1, name="zone"))
+        zones = zones.drop(columns=["zone_id"], errors="ignore")
+
+        LABEL_CACHE[key] = (labels, zones)
+
+    return LABEL_CACHE[key]
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+
+#################################################
+# helper function to mask a raster with the cached polygon mask and return an in memory dataset of the window
+def mask_raster(ds, shapeFile, allTouched=False):
+
+    grid = get_grid(ds)
+    mask, window = polygon_mask(shapeFile, grid, allTouched=allTouched)
+    xoff, yoff, xsize, ysize = window
+
+    band = ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    dataType = band.DataType
+
+    if nodata == None:
+        nodata = -9999
+        dataType = gdal.GDT_Float32
+
+    array = ds.ReadAsArray(xoff, yoff, xsize, ysize)
+    array = np.where(mask, array, nodata)
+
+    # geotransform of the window
+    gt = grid[0]
+    winGT = (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1], gt[2], gt[3] + xoff * gt[4] + yoff * gt[5], gt[4], gt[5])
+
+    out = mem_dataset(array, (winGT, (xsize, ysize), grid[2]), nodata=nodata, dataType=dataType)
+
+    return out
+#################################################
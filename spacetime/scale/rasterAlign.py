@@ -2,6 +2,16 @@ from osgeo import gdal
 from spacetime.objects.fileObject import file_object
 import numpy as np
 from spacetime.input.readData import read_data
+from spacetime.scale.warpPlan import get_grid, get_plan, grid_key, mem_dataset, PLAN_ALGORITHMS, TILED_OPTIONS
+from spacetime.scale.diskCache import get_cache
+from spacetime.objects.tracing import traced, span, add_bytes
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import os
+
+
+# pixel size of a source grid in a target SRS, keyed by grid and SRS
+RESOLUTION_CACHE = {}
 
 
 ######################################################################################################################
@@ -16,11 +26,21 @@ from spacetime.input.readData import read_data
 # resolution: the pixel dimensions to be used for all rasters. Defaults to the largest common pixel size
 # SRS: this is the SRS code that sets the units and geospatial scale. Defaults to EPSG:3857 like google maps
 # noneVal: the value to be used for pixels in the raster that contain no value. Defaults to -9999
+# template: a raster file name, file_object or cube whose grid all rasters are aligned to. Rasters that share a
+# source grid reuse one cached resampling plan (near, bilinear or average) instead of a GDAL warp per file
+# materialize: if True the warps are run once with multiple threads and written to tiled, compressed GeoTIFFs
+# instead of lazy VRTs that redo the reprojection on every read
+# outDir: directory for the materialized GeoTIFFs. Defaults to a new temporary directory
+# threads: number of GDAL warp threads used for each file when materializing
+# workers: number of files warped at the same time when materializing
+# cache: True, a cache directory or a disk_cache to reuse aligned rasters from earlier runs on the same inputs
 #
 # OUTPUT:
 # It outputs a list of rescaled and geospatialy aligned rasters
 ######################################################################################################################
-def raster_align(data=None, resolution="min", SRS=4326, noneVal=None, algorithm="near", template = None):
+@traced()
+def raster_align(data=None, resolution="min", SRS=4326, noneVal=None, algorithm="near", template = None,
+                 materialize = False, outDir = None, threads = None, workers = None, cache = None):
 
     if SRS == None:
         SRS_code = data.get_epsg_code()[0]
@@ -32,6 +52,38 @@ def raster_align(data=None, resolution="min", SRS=4326, noneVal=None, algorithm=
 
     objSize = len(data.get_epsg_code()) # time dimension for list
 
+    # reuse a cached result of the same inputs and parameters
+    store = get_cache(cache)
+    if store != None:
+        if template is not None:
+            templateKey = get_grid(template)
+        else:
+            templateKey = None
+        key = store.key(data.get_GDAL_data(), "raster_align", [resolution, SRS_code, noneVal, algorithm, templateKey])
+        hit = store.get(key)
+        if hit != None:
+            return file_object(hit, data.get_file_size())
+
+    # align everything to the grid of the template
+    if template is not None:
+        outObj = template_align(data, template, noneVal, algorithm)
+
+    else:
+        outObj = warp_align(data, objSize, resolution, SRS_code, noneVal, algorithm, materialize, outDir, threads, workers)
+
+    if store != None:
+        outObj = file_object(store.put(key, outObj.get_GDAL_data(), operation="raster_align"), data.get_file_size())
+
+    return outObj
+######################################################################################################################
+# END FUNCTION
+######################################################################################################################
+
+
+#################################################
+# helper function to warp every raster to a common SRS and resolution
+def warp_align(data, objSize, resolution, SRS_code, noneVal, algorithm, materialize, outDir, threads, workers):
+
     # initialize a mat to store files in during the loop and one to store the modification
     dataMat = [[0] * objSize for i in range(2)]
 
@@ -42,9 +94,8 @@ def raster_align(data=None, resolution="min", SRS=4326, noneVal=None, algorithm=
     for i in range(objSize):
         dataMat[0][i] = data.get_GDAL_data()[i]
 
-        # get list of resolutions
-        ps = gdal.Warp('', dataMat[0][i], dstSRS=SRS_code, format='VRT')
-        reso.append(ps.GetGeoTransform()[1])
+        # get list of resolutions from the geotransform instead of a probe warp
+        reso.append(target_resolution(dataMat[0][i], SRS_code))
 
 
     # pick the resolution
@@ -55,10 +106,17 @@ def raster_align(data=None, resolution="min", SRS=4326, noneVal=None, algorithm=
     else:
         resolution = resolution
 
+    warpArgs = dict(targetAlignedPixels=True, dstSRS=SRS_code, xRes=resolution, yRes=-resolution,
+                    dstNodata=noneVal, resampleAlg=algorithm)
+
     # do transformation and alignment
-    for i in range(objSize):
-        dataMat[1][i] = gdal.Warp('', dataMat[0][i], targetAlignedPixels=True, dstSRS=SRS_code, format='VRT',
-        xRes=resolution, yRes=-resolution, dstNodata=noneVal, resampleAlg=algorithm)
+    if materialize == True:
+        dataMat[1] = materialize_warps(dataMat[0], warpArgs, outDir=outDir, threads=threads, workers=workers)
+
+    else:
+        for i in range(objSize):
+            with span("warp_file", index=i):
+                dataMat[1][i] = gdal.Warp('', dataMat[0][i], format='VRT', **warpArgs)
 
     #print((dataMat[1][0]).GetRasterBand(1).ReadAsArray())
     # make a cube object
@@ -67,6 +125,106 @@ def raster_align(data=None, resolution="min", SRS=4326, noneVal=None, algorithm=
 
 
     return outObj
-######################################################################################################################
-# END FUNCTION
-######################################################################################################################
\ No newline at end of file
+#################################################
+
+
+
+#################################################
+# helper function to get the pixel size a raster will have in a new SRS, from the output GDAL suggests for a VRT
+# warp (as a probe warp of every file did before). Rasters on the same grid share one probe
+def target_resolution(ds, SRS_code):
+
+    key = (grid_key(get_grid(ds)), str(SRS_code))
+
+    if key not in RESOLUTION_CACHE:
+        probe = gdal.Warp('', ds, dstSRS=SRS_code, format='VRT')
+        RESOLUTION_CACHE[key] = probe.GetGeoTransform()[1]
+        probe = None
+
+    return RESOLUTION_CACHE[key]
+#################################################
+
+
+
+#################################################
+# helper function to align rasters to the grid of a template with reusable resampling plans
+def template_align(data, template, noneVal, algorithm):
+
+    dstGrid = get_grid(template)
+    gt, dims, wkt = dstGrid
+
+    if noneVal == None:
+        noneVal = -9999
+
+    outList = []
+
+    for ds in data.get_GDAL_data():
+
+        if algorithm in PLAN_ALGORITHMS:
+
+            # one plan per distinct source grid, shared by every raster on that grid
+            with span("warp_plan"):
+                plan = get_plan(get_grid(ds), dstGrid, algorithm)
+
+            with span("remap_file"):
+                array = ds.ReadAsArray()
+                add_bytes(read=array.nbytes)
+                out = plan.apply(array, srcNodata=ds.GetRasterBand(1).GetNoDataValue(), dstNodata=noneVal)
+
+            if out.dtype == np.float32:
+                dataType = gdal.GDT_Float32
+            else:
+                dataType = ds.GetRasterBand(1).DataType
+
+            outDS = mem_dataset(out, dstGrid, nodata=noneVal, dataType=dataType)
+
+        else:
+            # other GDAL resampling methods still go through a warp onto the template extent
+            bounds = [gt[0], gt[3] + gt[5] * dims[1], gt[0] + gt[1] * dims[0], gt[3]]
+            outDS = gdal.Warp('', ds, format='VRT', dstSRS=wkt, outputBounds=bounds, width=dims[0],
+                              height=dims[1], dstNodata=noneVal, resampleAlg=algorithm)
+
+        outList.append(outDS)
+
+    outObj = file_object(outList, data.get_file_size())
+
+    return outObj
+#################################################
+
+
+
+#################################################
+# helper function to run warps once into tiled compressed GeoTIFFs with a pool of files and GDAL warp threads
+def materialize_warps(rastList, warpArgs, outDir=None, threads=None, workers=None):
+
+    if outDir == None:
+        outDir = tempfile.mkdtemp(prefix="spacetime_align_")
+    os.makedirs(outDir, exist_ok=True)
+
+    cpus = os.cpu_count() or 1
+
+    # split the cpus between the file pool and the warp threads of each file
+    if workers == None:
+        workers = max(1, min(len(rastList), cpus))
+    if threads == None:
+        threads = max(1, cpus // workers)
+
+    def warp(i):
+
+        name = os.path.splitext(os.path.basename(rastList[i].GetDescription()))[0]
+        path = os.path.join(outDir, str(i).zfill(4) + "_" + name + ".tif")
+
+        with span("warp_file", index=i):
+            ds = gdal.Warp(path, rastList[i], format='GTiff', multithread=True,
+                           warpOptions=["NUM_THREADS=" + str(threads)],
+                           creationOptions=TILED_OPTIONS, **warpArgs)
+            ds = None # flush to disk
+            add_bytes(written=os.path.getsize(path))
+
+        return gdal.Open(path)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        out = list(pool.map(warp, range(len(rastList))))
+
+    return out
+#################################################
@@ -1,7 +1,10 @@
-import re
 import numpy as np
+import os
 from osgeo import gdal
 from spacetime.objects.fileObject import file_object
+from spacetime.scale.polygonMask import mask_raster
+from spacetime.scale.diskCache import get_cache
+from spacetime.objects.tracing import traced
 
 
 ######################################################################################################################
@@ -15,45 +18,43 @@ from spacetime.objects.fileObject import file_object
 #
 # INPUTS:
 # rastList (required): a list of raster objects typically already rescaled by the raster_align function.
+# method: "intersection", "union", "corners" (uses ul and lr), "shape" (crops to shapeFile with a cutline warp)
+# or "polygon" (crops to shapeFile with a polygon mask rasterized once per grid and cached)
+# cache: True, a cache directory or a disk_cache to reuse trimmed rasters from earlier runs on the same inputs
+#
+# Bounds come straight from each geotransform and the common window is snapped to whole pixels, so every
+# raster is cut with one pixel exact srcWin. Rasters that already match the window are passed through as is.
 #
 # OUTPUT:
 # A list of trimmed raster matrices with the last two elements as a vector of the greatest common coords
 # for the upper left and lower right corners and the GDAL geotransform output vector
 ######################################################################################################################
 
-def raster_trim(data = None, method = "intersection", ul = None, lr = None, shapeFile = None):
+@traced()
+def raster_trim(data = None, method = "intersection", ul = None, lr = None, shapeFile = None, cache = None):
 
     outList = [] # initialize a list
 
     # bring in raster objects
     rastList = data.get_GDAL_data()
 
-    # create matrix for storing corner data
-    cornerArray = np.empty(shape=(len(rastList),4))
-
-    # here is where the loop needs to be:
-    for i in range(len(rastList)):
-
-##############################################################################################################
-
-        # get meta data for each raster
-        meta = gdal.Info(rastList[i])
-
-        # use regex to extract upper and lower right corners
-        Uleft = re.search(r'Upper Left  \(([^)]+)', meta).group(1)
-        Lright = re.search(r'Lower Right \(([^)]+)', meta).group(1)
+    # reuse a cached result of the same inputs and parameters
+    store = get_cache(cache)
+    if store != None:
+        shapeKey = None
+        if shapeFile != None:
+            shapeKey = [shapeFile, os.path.getsize(shapeFile), os.path.getmtime(shapeFile)]
+        key = store.key(rastList, "raster_trim", [method, ul, lr, shapeKey])
+        hit = store.get(key)
+        if hit != None:
+            return file_object(hit, data.get_file_size())
 
-        # create full string
-        corners = Uleft + ',' + Lright
+    # geotransforms and dimensions of every raster
+    gts = np.array([rastList[i].GetGeoTransform() for i in range(len(rastList))])
+    dims = np.array([[rastList[i].RasterXSize, rastList[i].RasterYSize] for i in range(len(rastList))])
 
-        # numeric list of corners (upper left [0-1] and lower right [2-3])
-        cornersList = corners.split(',')
-        cornersList = [ float(x) for x in cornersList ]
-
-        # add corners to an array
-        cornerArray[i,:] = cornersList
-
-########################################################################################################################
+    # corner data (upper left [0-1] and lower right [2-3])
+    cornerArray = np.column_stack([gts[:,0], gts[:,3], gts[:,0] + gts[:,1] * dims[:,0], gts[:,3] + gts[:,5] * dims[:,1]])
 
     # find greatest common dimensions to crop rasters to:
     # highest x, lowest y (upper left corner): lowest x, highest y (lower right corner)
@@ -66,29 +67,73 @@ def raster_trim(data = None, method = "intersection", ul = None, lr = None, shap
     if method == "corners":
         cornersCommon = ul + lr
 
-    # loop to find common bounding box
-    for i in range(len(rastList)):
-
-        # trim the matrix
-        if shapeFile != None and method == "shape":
+    if shapeFile != None and method == "shape":
 
+        for i in range(len(rastList)):
             trimData = gdal.Warp('', rastList[i], cutlineDSName = shapeFile, cropToCutline=True, format='VRT')
+            outList.append(trimData)
+
+    elif shapeFile != None and method == "polygon":
+
+        for i in range(len(rastList)):
+            trimData = mask_raster(rastList[i], shapeFile)
+            outList.append(trimData)
 
-        else:
+    else:
 
-            # common corners
-            ulx=cornersCommon[0]
-            uly=cornersCommon[1]
-            lrx=cornersCommon[2]
-            lry=cornersCommon[3]
+        # snap the common window to whole pixels of the first raster
+        cornersCommon = snap_window(cornersCommon, gts[0], method)
 
-            trimData = gdal.Translate('', rastList[i], projWin = [ulx, uly, lrx, lry], format='VRT')
+        # pixel window of the common corners in every raster
+        xoff = np.round((cornersCommon[0] - gts[:,0]) / gts[:,1]).astype(int)
+        yoff = np.round((cornersCommon[1] - gts[:,3]) / gts[:,5]).astype(int)
+        xsize = np.round((cornersCommon[2] - cornersCommon[0]) / gts[:,1]).astype(int)
+        ysize = np.round((cornersCommon[3] - cornersCommon[1]) / gts[:,5]).astype(int)
 
-        # append the data layers to the list
-        outList.append(trimData)
+        # rasters already matching the window need no translate
+        same = (xoff == 0) & (yoff == 0) & (xsize == dims[:,0]) & (ysize == dims[:,1])
+
+        for i in range(len(rastList)):
+
+            if same[i]:
+                trimData = rastList[i]
+            else:
+                srcWin = [int(xoff[i]), int(yoff[i]), int(xsize[i]), int(ysize[i])]
+                trimData = gdal.Translate('', rastList[i], srcWin = srcWin, format='VRT')
+
+            # append the data layers to the list
+            outList.append(trimData)
 
         ###################################################################################################
 
+    if store != None:
+        outList = store.put(key, outList, operation="raster_trim")
+
     outObj = file_object(outList, data.get_file_size())
 
     return outObj
+
+
+
+#################################################
+# helper function to snap window corners onto the pixel grid of a geotransform. Intersections snap inward,
+# unions outward and user corners to the nearest pixel edge
+def snap_window(corners, gt, method, tol=1e-6):
+
+    px = (np.array([corners[0], corners[2]]) - gt[0]) / gt[1]
+    py = (np.array([corners[1], corners[3]]) - gt[3]) / gt[5]
+
+    if method == "intersection":
+        px = [np.ceil(px[0] - tol), np.floor(px[1] + tol)]
+        py = [np.ceil(py[0] - tol), np.floor(py[1] + tol)]
+    elif method == "union":
+        px = [np.floor(px[0] + tol), np.ceil(px[1] - tol)]
+        py = [np.floor(py[0] + tol), np.ceil(py[1] - tol)]
+    else:
+        px = np.round(px)
+        py = np.round(py)
+
+    out = [gt[0] + px[0] * gt[1], gt[3] + py[0] * gt[5], gt[0] + px[1] * gt[1], gt[3] + py[1] * gt[5]]
+
+    return out
+#################################################
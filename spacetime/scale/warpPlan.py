@@ -0,0 +1,338 @@
+from osgeo import gdal
+from osgeo import osr
+import numpy as np
+
+
+# cache of resampling plans keyed by source grid, target grid and algorithm
+PLAN_CACHE = {}
+
+# algorithms a plan can do without GDAL
+PLAN_ALGORITHMS = ["near", "bilinear", "average"]
+
+# creation options of the tiled, compressed GeoTIFFs written on a grid
+TILED_OPTIONS = ["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"]
+
+
+class warp_plan(object):
+
+    def __init__(self, srcGrid, dstGrid, algorithm="near"):
+
+        self.srcGrid = srcGrid
+        self.dstGrid = dstGrid
+        self.algorithm = algorithm
+
+        srcX, srcY = srcGrid[1]
+        dstX, dstY = dstGrid[1]
+
+        self.srcShape = (srcY, srcX)
+        self.dstShape = (dstY, dstX)
+
+        if algorithm == "average":
+
+            # every target pixel averages the source pixels its footprint overlaps, weighted by the overlap, so
+            # targets finer than the source are filled too. Footprints are the bounding boxes of the target pixel
+            # corners on the source grid
+            row, col = np.divmod(np.arange((dstX + 1) * (dstY + 1), dtype=np.float64), dstX + 1)
+            x, y = pixel_to_map(dstGrid[0], col, row)
+            x, y = transform_coords(x, y, dstGrid[2], srcGrid[2])
+            c, r = map_to_pixel(srcGrid[0], x, y)
+            c = c.reshape(dstY + 1, dstX + 1)
+            r = r.reshape(dstY + 1, dstX + 1)
+
+            def corners(a, f):
+                return f(f(a[:-1, :-1], a[:-1, 1:]), f(a[1:, :-1], a[1:, 1:])).ravel()
+
+            with np.errstate(invalid="ignore"):
+                cMin = np.clip(corners(c, np.fmin), 0, srcX)
+                cMax = np.clip(corners(c, np.fmax), 0, srcX)
+                rMin = np.clip(corners(r, np.fmin), 0, srcY)
+                rMax = np.clip(corners(r, np.fmax), 0, srcY)
+
+            found = np.isfinite(cMin) & np.isfinite(cMax) & np.isfinite(rMin) & np.isfinite(rMax)
+            cMin, cMax, rMin, rMax = [np.where(found, v, 0) for v in [cMin, cMax, rMin, rMax]]
+
+            c0 = np.floor(cMin).astype(np.int64)
+            r0 = np.floor(rMin).astype(np.int64)
+            nCols = np.maximum(np.ceil(cMax).astype(np.int64) - c0, 0)
+            nRows = np.maximum(np.ceil(rMax).astype(np.int64) - r0, 0)
+
+            target = np.arange(dstX * dstY)
+            index = []
+            targets = []
+            weights = []
+            for dr in range(int(nRows.max(initial=0))):
+                for dc in range(int(nCols.max(initial=0))):
+
+                    cc = c0 + dc
+                    rr = r0 + dr
+                    wc = np.minimum(cc + 1, cMax) - np.maximum(cc, cMin)
+                    wr = np.minimum(rr + 1, rMax) - np.maximum(rr, rMin)
+                    keep = (dc < nCols) & (dr < nRows) & (wc > 0) & (wr > 0)
+
+                    index.append((rr * srcX + cc)[keep])
+                    targets.append(target[keep])
+                    weights.append((wc * wr)[keep])
+
+            self.index = np.concatenate(index) if len(index) > 0 else np.zeros(0, dtype=np.int64)
+            self.target = np.concatenate(targets) if len(targets) > 0 else np.zeros(0, dtype=np.int64)
+            self.weights = np.concatenate(weights) if len(weights) > 0 else np.zeros(0)
+
+        else:
+
+            # every target pixel center is located on the source grid
+            col, row = grid_centers(dstGrid)
+            x, y = pixel_to_map(dstGrid[0], col, row)
+            x, y = transform_coords(x, y, dstGrid[2], srcGrid[2])
+            c, r = map_to_pixel(srcGrid[0], x, y)
+
+            if algorithm == "near":
+
+                c = np.floor(c).astype(np.int64)
+                r = np.floor(r).astype(np.int64)
+
+                inside = (c >= 0) & (c < srcX) & (r >= 0) & (r < srcY)
+                self.index = np.where(inside, r * srcX + c, -1)
+                self.weights = None
+
+            if algorithm == "bilinear":
+
+                # fractional positions relative to the source pixel centers
+                c = c - 0.5
+                r = r - 0.5
+                c0 = np.floor(c)
+                r0 = np.floor(r)
+                fc = c - c0
+                fr = r - r0
+                c0 = c0.astype(np.int64)
+                r0 = r0.astype(np.int64)
+
+                index = []
+                weights = []
+                for dr, dc, w in [(0, 0, (1 - fr) * (1 - fc)), (0, 1, (1 - fr) * fc),
+                                  (1, 0, fr * (1 - fc)), (1, 1, fr * fc)]:
+
+                    rr = r0 + dr
+                    cc = c0 + dc
+                    inside = (cc >= 0) & (cc < srcX) & (rr >= 0) & (rr < srcY)
+
+                    index.append(np.where(inside, rr * srcX + cc, 0))
+                    weights.append(np.where(inside, w, 0))
+
+                self.index = np.array(index)
+                self.weights = np.array(weights)
+
+
+    # remap a (bands, y, x) or (y, x) array from the source grid to the target grid
+    def apply(self, array, srcNodata=None, dstNodata=-9999):
+
+        array = np.asarray(array)
+        squeeze = array.ndim == 2
+        flat = array.reshape(-1, self.srcShape[0] * self.srcShape[1])
+
+        if self.algorithm == "near":
+
+            out = np.take(flat, np.maximum(self.index, 0), axis=1)
+
+            # keep the source type unless the nodata value does not fit in it
+            if out.dtype.kind in "iu":
+                info = np.iinfo(out.dtype)
+                if np.isnan(dstNodata) or dstNodata != int(dstNodata) or dstNodata < info.min or dstNodata > info.max:
+                    out = out.astype(np.float32)
+
+            out[:, self.index < 0] = dstNodata
+
+            if srcNodata != None:
+                out[out == srcNodata] = dstNodata
+
+        else:
+
+            valid = np.isfinite(flat)
+            if srcNodata != None:
+                valid = valid & (flat != srcNodata)
+            values = np.where(valid, flat, 0).astype(np.float64)
+
+            if self.algorithm == "bilinear":
+
+                # weighted sum of the four neighbours, skipping nodata neighbours
+                w = self.weights[np.newaxis] * valid[:, self.index]
+                total = np.sum(w * values[:, self.index], axis=1)
+                norm = np.sum(w, axis=1)
+
+            if self.algorithm == "average":
+
+                # overlap weighted mean of the valid source pixels of every target footprint
+                nOut = self.dstShape[0] * self.dstShape[1]
+                total = np.empty((flat.shape[0], nOut))
+                norm = np.empty((flat.shape[0], nOut))
+
+                for b in range(flat.shape[0]):
+                    keep = valid[b][self.index]
+                    w = self.weights[keep]
+                    total[b] = np.bincount(self.target[keep], weights=values[b][self.index[keep]] * w, minlength=nOut)
+                    norm[b] = np.bincount(self.target[keep], weights=w, minlength=nOut)
+
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out = np.where(norm > 0, total / norm, dstNodata).astype(np.float32)
+
+        out = out.reshape((-1,) + self.dstShape)
+        if squeeze == True:
+            out = out[0]
+
+        return out
+
+
+
+#################################################
+# returns a cached plan, building it only the first time a source and target grid pair is seen
+def get_plan(srcGrid, dstGrid, algorithm="near"):
+
+    key = (grid_key(srcGrid), grid_key(dstGrid), algorithm)
+
+    if key not in PLAN_CACHE:
+        PLAN_CACHE[key] = warp_plan(srcGrid, dstGrid, algorithm)
+
+    return PLAN_CACHE[key]
+
+
+def clear_plans():
+
+    PLAN_CACHE.clear()
+#################################################
+
+
+
+#################################################
+# helper function to get the grid (geotransform, (x dim, y dim), wkt) of a raster file name, gdal dataset,
+# file_object or cube
+def get_grid(obj):
+
+    if isinstance(obj, str):
+        obj = gdal.Open(obj)
+
+    if isinstance(obj, gdal.Dataset):
+        out = (tuple(obj.GetGeoTransform()), (obj.RasterXSize, obj.RasterYSize), obj.GetProjection())
+
+    elif "file_object" in str(type(obj)):
+        out = get_grid(obj.get_GDAL_data()[0])
+
+    else:
+        # cube lat and lon vectors hold the upper left corner of each pixel. They are stored as float32, so the
+        # pixel size comes from the span of the axis rather than from one difference of neighbours
+        lon = np.asarray(obj.get_lon(), dtype=np.float64)
+        lat = np.asarray(obj.get_lat(), dtype=np.float64)
+
+        if len(lon) > 1:
+            xSize = (lon[-1] - lon[0]) / (len(lon) - 1)
+        else:
+            xSize = float(obj.get_pixel_size())
+        if len(lat) > 1:
+            ySize = (lat[-1] - lat[0]) / (len(lat) - 1)
+        else:
+            ySize = -xSize
+
+        wkt = str(obj.get_spatial_ref().spatial_ref)
+
+        out = ((float(lon[0]), float(xSize), 0.0, float(lat[0]), 0.0, float(ySize)), (len(lon), len(lat)), wkt)
+
+    return out
+
+
+# helper function to write a (bands, y, x) array into an in memory gdal dataset on a grid
+def mem_dataset(array, grid, nodata=None, dataType=None):
+
+    array = np.atleast_3d(np.asarray(array).T).T
+    gt, dims, wkt = grid
+
+    if dataType == None:
+        dataType = gdal.GDT_Float32
+
+    ds = gdal.GetDriverByName("MEM").Create("", dims[0], dims[1], array.shape[0], dataType)
+    ds.SetGeoTransform(gt)
+    ds.SetProjection(wkt)
+
+    for j in range(array.shape[0]):
+        band = ds.GetRasterBand(j+1)
+        if nodata != None:
+            band.SetNoDataValue(nodata)
+        band.WriteArray(array[j])
+
+    return ds
+
+
+# windows (yoff, xoff, ysize, xsize) covering a grid of dims (x, y) in square tiles or full-width row blocks
+def grid_windows(dims, blockSize, full=False):
+
+    xDim, yDim = dims
+
+    for yoff in range(0, yDim, blockSize):
+        ysize = min(blockSize, yDim - yoff)
+
+        if full == True:
+            yield yoff, 0, ysize, xDim
+        else:
+            for xoff in range(0, xDim, blockSize):
+                yield yoff, xoff, ysize, min(blockSize, xDim - xoff)
+
+
+def grid_key(grid):
+
+    return (tuple(np.round(grid[0], 12)), tuple(grid[1]), grid[2])
+
+
+# pixel centers of a grid as flat column and row vectors
+def grid_centers(grid):
+
+    xDim, yDim = grid[1]
+    row, col = np.divmod(np.arange(xDim * yDim, dtype=np.float64), xDim)
+
+    return col + 0.5, row + 0.5
+
+
+def pixel_to_map(gt, col, row):
+
+    x = gt[0] + col * gt[1] + row * gt[2]
+    y = gt[3] + col * gt[4] + row * gt[5]
+
+    return x, y
+
+
+def map_to_pixel(gt, x, y):
+
+    inv = gdal.InvGeoTransform(gt)
+    if len(inv) == 2: # older bindings return a success flag first
+        inv = inv[1]
+
+    col = inv[0] + x * inv[1] + y * inv[2]
+    row = inv[3] + x * inv[4] + y * inv[5]
+
+    return col, row
+
+
+# reproject coordinate vectors, skipping the transform when the two SRS match
+def transform_coords(x, y, srcWkt, dstWkt, batch=1000000):
+
+    srcSRS = osr.SpatialReference(wkt=srcWkt)
+    dstSRS = osr.SpatialReference(wkt=dstWkt)
+
+    if srcWkt == dstWkt or srcSRS.IsSame(dstSRS):
+        return x, y
+
+    srcSRS.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dstSRS.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(srcSRS, dstSRS)
+
+    outX = np.empty(len(x))
+    outY = np.empty(len(y))
+
+    for i in range(0, len(x), batch):
+        points = transform.TransformPoints(list(zip(x[i:i + batch].tolist(), y[i:i + batch].tolist())))
+        points = np.array(points)
+        outX[i:i + batch] = points[:, 0]
+        outY[i:i + batch] = points[:, 1]
+
+    # points that could not be transformed land outside every grid
+    outX[~np.isfinite(outX)] = np.nan
+    outY[~np.isfinite(outY)] = np.nan
+
+    return outX, outY
+#################################################